@@ -0,0 +1,190 @@
+import os
+import sqlite3
+import threading
+import time
+import numpy as np
+from embedding_cache import CACHE_DIR
+
+# a cached answer is reused when the new question's embedding has at least this cosine similarity with the
+# cached question's, for the same embedding model, chunk size, llm, k and packing
+ANSWER_CACHE_THRESHOLD = float(os.environ.get("ANSWER_CACHE_THRESHOLD", 0.95))
+# seconds an answer stays valid, and the most answers kept per backend (least recently used go first)
+ANSWER_CACHE_TTL = float(os.environ.get("ANSWER_CACHE_TTL", 7 * 24 * 3600))
+ANSWER_CACHE_MAX_ENTRIES = int(os.environ.get("ANSWER_CACHE_MAX_ENTRIES", 10000))
+# sql condition on the columns of a scope
+SCOPE_CONDITION = "embedding_model = ? AND chunk_size = ? AND llm_model = ? AND k = ? AND packed = ?"
+
+
+def _unit(vector):
+    vector = np.asarray(vector, dtype=np.float32).ravel()
+    return vector / max(float(np.linalg.norm(vector)), 1e-12)
+
+
+# semantic cache of generated answers for one backend, keyed on the question embedding. Entries are scoped
+# to (embedding model, chunk size, llm, k, packing), the settings that decide the context an answer was
+# generated from, and tagged with the manifest fingerprint of the chunks they were
+# generated from (IngestManifest.fingerprint); once those chunks change, the scope's entries are dropped
+class AnswerCache:
+    def __init__(self, backend, threshold=ANSWER_CACHE_THRESHOLD, ttl=ANSWER_CACHE_TTL,
+                 max_entries=ANSWER_CACHE_MAX_ENTRIES, path=None):
+        self.path = path or os.path.join(CACHE_DIR, f"answers_{backend}.sqlite")
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.invalidated = 0
+        self.expired = 0
+        self.evicted = 0
+        self._lock = threading.Lock()
+        self._conn = None
+        # (embedding model, chunk size, llm, k, packed, dimension) -> {"fingerprint", "ids", "created", "matrix"}
+        # of the live entries; the dimension keeps rows of a model whose vectors were resized apart
+        self._scopes = {}
+
+    # opened on first use, so scripts that never use the cache never create the file
+    def _db(self):
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            # a cache from before answers were scoped by k and packing can't tell its entries apart, start over
+            columns = [row[1] for row in self._conn.execute("PRAGMA table_info(answers)")]
+            if columns and "k" not in columns:
+                self._conn.execute("DROP TABLE answers")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS answers (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    embedding_model TEXT NOT NULL,
+                    chunk_size INTEGER NOT NULL,
+                    llm_model TEXT NOT NULL,
+                    k INTEGER NOT NULL,
+                    packed INTEGER NOT NULL,
+                    fingerprint TEXT NOT NULL,
+                    question TEXT NOT NULL,
+                    embedding BLOB NOT NULL,
+                    answer TEXT NOT NULL,
+                    created REAL NOT NULL,
+                    last_used REAL NOT NULL
+                )
+                """
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS answers_scope ON answers (embedding_model, chunk_size, llm_model, k, packed)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS answers_last_used ON answers (last_used)")
+            self._conn.commit()
+        return self._conn
+
+    # the live entries of a scope, dropping the ones generated from other chunks or older than the ttl
+    def _scope(self, scope, fingerprint):
+        cached = self._scopes.get(scope)
+        if cached is not None and cached["fingerprint"] == fingerprint:
+            return cached
+
+        conn = self._db()
+        cursor = conn.execute(
+            f"DELETE FROM answers WHERE {SCOPE_CONDITION} AND fingerprint != ?",
+            (*scope[:5], fingerprint),
+        )
+        self.invalidated += cursor.rowcount
+        cursor = conn.execute(
+            f"DELETE FROM answers WHERE {SCOPE_CONDITION} AND created < ?",
+            (*scope[:5], time.time() - self.ttl),
+        )
+        self.expired += cursor.rowcount
+        conn.commit()
+
+        rows = conn.execute(
+            f"SELECT id, created, embedding FROM answers WHERE {SCOPE_CONDITION} AND length(embedding) = ?",
+            (*scope[:5], scope[5] * 4),
+        ).fetchall()
+        cached = {
+            "fingerprint": fingerprint,
+            "ids": [row[0] for row in rows],
+            "created": np.array([row[1] for row in rows], dtype=np.float64),
+            "matrix": np.stack([np.frombuffer(row[2], dtype=np.float32) for row in rows]) if rows else None,
+        }
+        self._scopes[scope] = cached
+        return cached
+
+    # the cached answer of the most similar earlier question if it reaches the threshold, else None; k and
+    # packed are the retrieval settings the answer has to come from.
+    # manifest is the backend's IngestManifest, reloaded first in case another process re-ingested
+    def lookup(self, embedding_model, chunk_size, llm_model, k, packed, question_embedding, manifest):
+        if self.threshold is None:
+            return None
+        manifest.refresh()
+        fingerprint = manifest.fingerprint(embedding_model, chunk_size)
+        query = _unit(question_embedding)
+        key = (embedding_model, int(chunk_size), llm_model, int(k), int(packed), len(query))
+        with self._lock:
+            scope = self._scope(key, fingerprint)
+            if scope["matrix"] is None:
+                self.misses += 1
+                return None
+
+            scores = scope["matrix"] @ query
+            scores[scope["created"] < time.time() - self.ttl] = -1.0
+            best = int(np.argmax(scores))
+            if scores[best] < self.threshold:
+                self.misses += 1
+                return None
+
+            conn = self._db()
+            row = conn.execute("SELECT answer FROM answers WHERE id = ?", (scope["ids"][best],)).fetchone()
+            if row is None:
+                self._scopes.pop(key, None)
+                self.misses += 1
+                return None
+            conn.execute("UPDATE answers SET last_used = ? WHERE id = ?", (time.time(), scope["ids"][best]))
+            conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def store(self, embedding_model, chunk_size, llm_model, k, packed, question, question_embedding, manifest, answer):
+        if self.threshold is None:
+            return
+        fingerprint = manifest.fingerprint(embedding_model, chunk_size)
+        embedding = _unit(question_embedding)
+        now = time.time()
+        with self._lock:
+            key = (embedding_model, int(chunk_size), llm_model, int(k), int(packed), len(embedding))
+            scope = self._scope(key, fingerprint)
+            conn = self._db()
+            cursor = conn.execute(
+                "INSERT INTO answers (embedding_model, chunk_size, llm_model, k, packed, fingerprint, question, embedding, "
+                "answer, created, last_used) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (*key[:5], fingerprint, question, embedding.tobytes(), answer, now, now),
+            )
+            scope["ids"].append(cursor.lastrowid)
+            scope["created"] = np.append(scope["created"], now)
+            scope["matrix"] = embedding[None, :] if scope["matrix"] is None else np.vstack([scope["matrix"], embedding])
+
+            count = conn.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+            if count > self.max_entries:
+                cursor = conn.execute(
+                    "DELETE FROM answers WHERE id IN (SELECT id FROM answers ORDER BY last_used LIMIT ?)",
+                    (count - self.max_entries,),
+                )
+                self.evicted += cursor.rowcount
+                self._scopes.clear()
+            conn.commit()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "invalidated": self.invalidated,
+            "expired": self.expired,
+            "evicted": self.evicted,
+        }
+
+    def print_stats(self):
+        stats = self.stats()
+        if stats["hits"] or stats["misses"]:
+            print(
+                f"Answer cache: {stats['hits']} hits, {stats['misses']} misses ({stats['hit_rate']:.1%} hit rate), "
+                f"{stats['invalidated']} invalidated, {stats['expired']} expired, {stats['evicted']} evicted"
+            )
@@ -0,0 +1,116 @@
+import asyncio
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import ollama
+from embedding_cache import get_embedding_cache
+from dim_reduction import reduce_embeddings
+
+OLLAMA_HOST = os.environ.get("OLLAMA_HOST", "http://localhost:11434")
+EMBED_BATCH_SIZE = int(os.environ.get("EMBED_BATCH_SIZE", 64))
+EMBED_CONCURRENCY = int(os.environ.get("EMBED_CONCURRENCY", 4))
+
+_client = None
+_stats_lock = threading.Lock()
+embed_stats = {"chunks": 0, "embedded": 0, "requests": 0, "seconds": 0.0}
+
+
+# returns a shared ollama client pointed at OLLAMA_HOST (a fake server works too, see fake_ollama.py)
+def get_ollama_client():
+    global _client
+    if _client is None:
+        _client = ollama.Client(host=OLLAMA_HOST)
+    return _client
+
+
+# sends one /api/embed request for a whole batch of texts
+def _embed_request(client, model, texts):
+    response = client.embed(model=model, input=texts)
+    return response["embeddings"]
+
+
+# embeds a list of texts and returns a float32 matrix with one row per text, reduced to the model's
+# target dimension (see dim_reduction.py) unless reduce is False; the cache always keeps full vectors
+def embed_batch(texts, model, batch_size=EMBED_BATCH_SIZE, max_concurrency=EMBED_CONCURRENCY, client=None, reduce=True):
+    if not texts:
+        return np.zeros((0, 0), dtype=np.float32)
+
+    start_time = time.perf_counter()
+    client = client or get_ollama_client()
+    cache = get_embedding_cache()
+
+    vectors = cache.get_many(model, texts)
+    missing = [i for i, vector in enumerate(vectors) if vector is None]
+    batches = [missing[i:i + batch_size] for i in range(0, len(missing), batch_size)]
+
+    if batches:
+        with ThreadPoolExecutor(max_workers=max(1, max_concurrency)) as pool:
+            futures = [pool.submit(_embed_request, client, model, [texts[i] for i in batch]) for batch in batches]
+            for batch, future in zip(batches, futures):
+                embeddings = future.result()
+                for i, embedding in zip(batch, embeddings):
+                    vectors[i] = embedding
+                cache.put_many(model, [texts[i] for i in batch], embeddings)
+
+    matrix = np.asarray(vectors, dtype=np.float32)
+    if reduce:
+        matrix = reduce_embeddings(model, matrix)
+
+    with _stats_lock:
+        embed_stats["chunks"] += len(texts)
+        embed_stats["embedded"] += len(missing)
+        embed_stats["requests"] += len(batches)
+        embed_stats["seconds"] += time.perf_counter() - start_time
+    return matrix
+
+
+# async counterpart of embed_batch for the ingest pipeline (see ingest_pipeline.py): same cache, reduction and
+# stats, the batches go out through an ollama.AsyncClient, which has to belong to the running loop. At most
+# EMBED_CONCURRENCY requests are in flight at once; callers running several of these at a time pass one
+# asyncio.Semaphore as limit so the bound holds across all of them
+async def embed_batch_async(texts, model, client, batch_size=EMBED_BATCH_SIZE, reduce=True, limit=None):
+    if not texts:
+        return np.zeros((0, 0), dtype=np.float32)
+
+    start_time = time.perf_counter()
+    cache = get_embedding_cache()
+
+    vectors = cache.get_many(model, texts)
+    missing = [i for i, vector in enumerate(vectors) if vector is None]
+    batches = [missing[i:i + batch_size] for i in range(0, len(missing), batch_size)]
+
+    limit = limit or asyncio.Semaphore(max(1, EMBED_CONCURRENCY))
+
+    async def embed(batch):
+        async with limit:
+            return await client.embed(model=model, input=[texts[i] for i in batch])
+
+    responses = await asyncio.gather(*(embed(batch) for batch in batches))
+    for batch, response in zip(batches, responses):
+        embeddings = response["embeddings"]
+        for i, embedding in zip(batch, embeddings):
+            vectors[i] = embedding
+        cache.put_many(model, [texts[i] for i in batch], embeddings)
+
+    matrix = np.asarray(vectors, dtype=np.float32)
+    if reduce:
+        matrix = reduce_embeddings(model, matrix)
+
+    with _stats_lock:
+        embed_stats["chunks"] += len(texts)
+        embed_stats["embedded"] += len(missing)
+        embed_stats["requests"] += len(batches)
+        embed_stats["seconds"] += time.perf_counter() - start_time
+    return matrix
+
+
+# prints chunks/sec over every embed_batch call so far
+def print_embedding_throughput():
+    seconds = embed_stats["seconds"]
+    rate = embed_stats["chunks"] / seconds if seconds else 0.0
+    print(
+        f"Embedding: {embed_stats['chunks']} chunks ({embed_stats['embedded']} sent to Ollama "
+        f"in {embed_stats['requests']} requests) in {seconds:.2f}s, {rate:.1f} chunks/sec"
+    )
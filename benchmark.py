@@ -0,0 +1,542 @@
+## Retrieval benchmark for the vector store backends
+##
+## python benchmark.py --backends redis chroma qdrant numpy_store --output benchmark_report.json
+##
+## Embeddings come from fake_ollama.py running in-process, so the numbers are reproducible offline and
+## only the vector stores are being measured: ingest throughput, query latency percentiles and recall@k
+## against an exact brute-force top-k over the same vectors.
+
+import argparse
+import importlib
+import importlib.util
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+import numpy as np
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+BENCH_MODEL = "bench-fake-embed"
+BACKENDS = ["redis", "chroma", "qdrant", "numpy_store"]
+# vector storage modes each backend supports, float32 first as the baseline
+STORAGE_MODES = {
+    "redis": ["float32", "float16"],
+    "chroma": ["float32"],
+    "qdrant": ["float32", "int8"],
+    "numpy_store": ["float32", "float16", "int8"],
+}
+# KB of vectors above which the qdrant sweep collections build their HNSW graph (and filtered searches use it);
+# 0 would turn indexing off instead, qdrant's default is about 10 MB
+QDRANT_INDEXING_THRESHOLD = 1
+
+
+# redis.py shadows the redis package when the repo is on sys.path, so import the real one first
+def _import_redis_package():
+    saved_path = sys.path[:]
+    sys.path = [p for p in sys.path if os.path.abspath(p or os.getcwd()) != REPO_DIR]
+    try:
+        importlib.import_module("redis")
+        importlib.import_module("redis.commands.search.query")
+    finally:
+        sys.path = saved_path
+
+
+# loads one of the backend scripts as a module without running its main()
+def load_backend(name):
+    if name == "redis":
+        _import_redis_package()
+    spec = importlib.util.spec_from_file_location(f"{name}_backend", os.path.join(REPO_DIR, f"{name}.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+# starts the in-process fake ollama and points every client at it, with a throwaway embedding cache
+def use_fake_ollama(work_dir, port, latency=0.0):
+    from fake_ollama import start_fake_ollama
+    server = start_fake_ollama(port=port, latency=latency)
+    os.environ["OLLAMA_HOST"] = f"http://127.0.0.1:{port}"
+    import embedding_cache
+    embedding_cache._cache = embedding_cache.EmbeddingCache(os.path.join(work_dir, "embeddings.sqlite"))
+    return server
+
+
+# chunks of the first max_files PDFs in folder: [(source, [chunk, ...]), ...]
+def build_corpus(folder, chunk_size, max_files):
+    from pdf_extraction import extract_pages
+    from chunking import iter_chunks
+    pdf_files = sorted(Path(folder).glob('*.pdf'))[:max_files]
+    pages = extract_pages(pdf_files)
+    return [
+        (pdf_file.name, [chunk.text for chunk in iter_chunks(pages[str(pdf_file)], pdf_file.name, [chunk_size])])
+        for pdf_file in pdf_files
+    ]
+
+
+# the project questions plus word windows sampled from the corpus, seeded so every run uses the same set
+def build_queries(questions, corpus, n_queries, seed):
+    rng = random.Random(seed)
+    chunks = [chunk for _, source_chunks in corpus for chunk in source_chunks if chunk]
+    queries = list(questions)
+    while len(queries) < n_queries and chunks:
+        words = rng.choice(chunks).split()
+        start = rng.randrange(max(1, len(words) - 12))
+        queries.append(" ".join(words[start:start + 12]))
+    return queries[:n_queries]
+
+
+# exact cosine top-k chunk ids for every query
+def brute_force_top_k(chunk_ids, chunk_matrix, query_matrix, k):
+    chunks = chunk_matrix / np.maximum(np.linalg.norm(chunk_matrix, axis=1, keepdims=True), 1e-12)
+    queries = query_matrix / np.maximum(np.linalg.norm(query_matrix, axis=1, keepdims=True), 1e-12)
+    scores = queries @ chunks.T
+    top = np.argsort(-scores, axis=1)[:, :k]
+    return [[chunk_ids[i] for i in row] for row in top]
+
+
+# thin adapters over each script's own create/store/search functions, isolated from the real data
+class BackendAdapter:
+    def __init__(self, name, module, work_dir, chunk_size, storage="float32", hnsw=None):
+        from manifest import IngestManifest
+        from dedupe import DedupeIndex
+        self.name = name
+        self.module = module
+        self.work_dir = work_dir
+        self.chunk_size = chunk_size
+        self.storage = storage
+        self.hnsw = hnsw
+        module.embedding_models = [BENCH_MODEL]
+        module.chunk_sizes = [chunk_size]
+        module.manifest = IngestManifest(f"bench_{name}", path=os.path.join(work_dir, f"manifest_{name}.json"))
+        module.dedupe_index = DedupeIndex(f"bench_{name}", path=os.path.join(work_dir, f"dedupe_{name}.npz"))
+        if name == "qdrant":
+            module.COLLECTION_NAME = "bench_notes"
+
+    # hnsw is {"m", "ef_construction", "ef_search"} mapped onto each backend's own parameter names
+    def setup(self):
+        m = self.module
+        hnsw = self.hnsw
+        if self.name == "redis":
+            params = {"m": hnsw["m"], "ef_construction": hnsw["ef_construction"], "ef_runtime": hnsw["ef_search"]} if hnsw else {}
+            m.create_indices(rebuild=True, vector_type=self.storage.upper(), **params)
+        elif self.name == "qdrant":
+            params = {"m": hnsw["m"], "ef_construct": hnsw["ef_construction"], "indexing_threshold": QDRANT_INDEXING_THRESHOLD} if hnsw else {}
+            m.HNSW_EF = hnsw["ef_search"] if hnsw else None
+            m.create_indices(rebuild=True, quantize=self.storage == "int8", **params)
+        elif self.name == "chroma":
+            params = {"m": hnsw["m"], "construction_ef": hnsw["ef_construction"], "search_ef": hnsw["ef_search"]} if hnsw else {}
+            m.initialize_vector_store(os.path.join(self.work_dir, "chroma"), rebuild=True, **params)
+        elif self.name == "numpy_store":
+            self.module.create_indices(rebuild=True, directory=os.path.join(self.work_dir, "numpy_store"), dtype=self.storage)
+
+    def ingest(self, source, chunk_ids, texts, embeddings):
+        m, size = self.module, self.chunk_size
+        if self.name == "redis":
+            with m.BulkWriter(m.redis_client) as writer:
+                for chunk_id, text, embedding in zip(chunk_ids, texts, embeddings):
+                    m.store_embedding(BENCH_MODEL, chunk_id, text, source, chunk_id, size, embedding, writer=writer)
+        elif self.name == "qdrant":
+            m.store_embeddings([m.point_id(c) for c in chunk_ids], texts, source, chunk_ids, size, {BENCH_MODEL: embeddings.tolist()})
+        elif self.name == "chroma":
+            m.add_document(BENCH_MODEL, size, texts, source, chunk_ids, embeddings.tolist())
+        else:
+            m.store_embedding(BENCH_MODEL, size, texts, source, chunk_ids, embeddings)
+
+    # waits for work a backend does in the background after the last insert, so it counts towards build time:
+    # qdrant builds the HNSW graph of the sweep collections once the points are in
+    def finish_ingest(self):
+        if self.name == "qdrant" and self.hnsw:
+            self.module.wait_for_index()
+
+    def search(self, query_embedding, k):
+        m, size = self.module, self.chunk_size
+        if self.name == "redis":
+            return [doc.chunk_id for doc in m.search_chunks(query_embedding, BENCH_MODEL, size, k)]
+        if self.name == "qdrant":
+            return [hit.payload["chunk_id"] for hit in m.search_batch(BENCH_MODEL, size, query_embedding[None, :], k)[0]]
+        if self.name == "chroma":
+            return [doc["chunk_id"] for doc in m.query_vector_store(BENCH_MODEL, size, query_embedding.tolist(), k)]
+        return [doc["chunk_id"] for doc in m.search_batch(BENCH_MODEL, size, query_embedding[None, :], k)[0]]
+
+    # measured bytes held for the vectors: redis reports its index size, numpy_store its vector files;
+    # None for the others
+    def memory_bytes(self, chunk_count, dim):
+        m = self.module
+        if self.name == "redis":
+            info = m.redis_client.ft(m.embedding_indices[BENCH_MODEL]).info()
+            return int(float(info["vector_index_sz_mb"]) * 1024 * 1024)
+        if self.name == "numpy_store":
+            return m.indices[(BENCH_MODEL, self.chunk_size)].nbytes
+        return None
+
+    # qdrant reports no memory figure: its in-RAM vectors and graph links estimated from the point count
+    # (the float32 originals of a quantized collection live on disk); None for the others
+    def memory_bytes_estimated(self, chunk_count, dim):
+        if self.name == "qdrant":
+            links = (self.hnsw["m"] if self.hnsw else self.module.HNSW_M) * 2 * 4
+            return chunk_count * (dim * (1 if self.storage == "int8" else 4) + links)
+        return None
+
+    def teardown(self):
+        m = self.module
+        if self.name == "redis":
+            for index_name in m.embedding_indices.values():
+                m.redis_client.execute_command(f"FT.DROPINDEX {index_name} DD")
+        elif self.name == "qdrant":
+            m.client.delete_collection(m.COLLECTION_NAME)
+
+
+# latency summary in milliseconds
+def percentiles(latencies):
+    values = np.array(latencies) * 1000
+    return {
+        "count": len(values),
+        "mean_ms": round(float(values.mean()), 3),
+        "p50_ms": round(float(np.percentile(values, 50)), 3),
+        "p95_ms": round(float(np.percentile(values, 95)), 3),
+        "p99_ms": round(float(np.percentile(values, 99)), 3),
+    }
+
+
+# stores every chunk through the adapter, returns (chunk count, seconds)
+def ingest_corpus(adapter, corpus_embeddings):
+    chunk_count = 0
+    start_time = time.perf_counter()
+    for source, chunk_ids, texts, embeddings in corpus_embeddings:
+        adapter.ingest(source, chunk_ids, texts, embeddings)
+        chunk_count += len(chunk_ids)
+    adapter.finish_ingest()
+    return chunk_count, time.perf_counter() - start_time
+
+
+# runs every query once after a few warm-up queries, returns (latencies, recall of each query)
+def measure_queries(adapter, query_matrix, truth, k):
+    for query_embedding in query_matrix[:5]:
+        adapter.search(query_embedding, k)
+
+    latencies, recalls = [], []
+    for query_embedding, expected in zip(query_matrix, truth):
+        start_time = time.perf_counter()
+        found = adapter.search(query_embedding, k)
+        latencies.append(time.perf_counter() - start_time)
+        recalls.append(len(set(found) & set(expected)) / len(expected))
+    return latencies, recalls
+
+
+# ingests the corpus into one backend, runs every query once and scores it against the exact top-k
+def run_backend(adapter, corpus_embeddings, query_matrix, truth, k):
+    adapter.setup()
+    try:
+        chunk_count, ingest_seconds = ingest_corpus(adapter, corpus_embeddings)
+        latencies, recalls = measure_queries(adapter, query_matrix, truth, k)
+        return {
+            "ingest": {
+                "chunks": chunk_count,
+                "seconds": round(ingest_seconds, 4),
+                "chunks_per_sec": round(chunk_count / ingest_seconds, 1) if ingest_seconds else None,
+            },
+            "memory_bytes": adapter.memory_bytes(chunk_count, query_matrix.shape[1]),
+            "memory_bytes_estimated": adapter.memory_bytes_estimated(chunk_count, query_matrix.shape[1]),
+            "query": percentiles(latencies),
+            f"recall_at_{k}": round(float(np.mean(recalls)), 4),
+        }
+    finally:
+        adapter.teardown()
+
+
+# runs every storage mode of one backend and puts memory saved and recall lost next to float32;
+# memory saved is only given for measured memory, never for estimates
+def compare_storage(name, work_dir, chunk_size, corpus_embeddings, query_matrix, truth, k):
+    results = {}
+    for storage in STORAGE_MODES[name]:
+        print(f"Benchmarking {name} with {storage} vectors")
+        adapter = BackendAdapter(name, load_backend(name), work_dir, chunk_size, storage)
+        results[storage] = run_backend(adapter, corpus_embeddings, query_matrix, truth, k)
+
+    baseline = results["float32"]
+    for result in results.values():
+        if baseline["memory_bytes"] and result["memory_bytes"] is not None:
+            result["memory_saved"] = round(1 - result["memory_bytes"] / baseline["memory_bytes"], 4)
+        result["recall_lost"] = round(baseline[f"recall_at_{k}"] - result[f"recall_at_{k}"], 4)
+    return results
+
+
+# runs one backend on full vectors and on vectors reduced to each of dims (a PCA fitted on the corpus,
+# or truncation), scoring recall against the exact top-k of the full vectors
+def compare_dimensions(name, work_dir, chunk_size, corpus_embeddings, query_matrix, truth, k, dims, method):
+    import dim_reduction
+    chunk_matrix = np.vstack([embeddings for _, _, _, embeddings in corpus_embeddings])
+    results = {"full": run_backend(
+        BackendAdapter(name, load_backend(name), work_dir, chunk_size), corpus_embeddings, query_matrix, truth, k
+    )}
+    try:
+        for dim in dims:
+            print(f"Benchmarking {name} with vectors reduced to {dim} dimensions ({method})")
+            if method == "pca":
+                projection = dim_reduction.fit_pca(BENCH_MODEL, chunk_matrix, dim, path=False)
+            else:
+                projection = dim_reduction.Projection(BENCH_MODEL, dim, "truncate")
+                dim_reduction.use_projection(projection)
+            reduced_corpus = [
+                (source, chunk_ids, texts, projection.apply(embeddings))
+                for source, chunk_ids, texts, embeddings in corpus_embeddings
+            ]
+            adapter = BackendAdapter(name, load_backend(name), work_dir, chunk_size)
+            results[str(dim)] = run_backend(adapter, reduced_corpus, projection.apply(query_matrix), truth, k)
+    finally:
+        dim_reduction.TARGET_DIMENSIONS.pop(BENCH_MODEL, None)
+    return results
+
+
+# builds an index for every (m, ef_construction, ef_search) point of the grid; the build time is the
+# time to ingest the corpus, since redis and chroma insert into the graph as points arrive, plus for qdrant
+# the time until its graph is built. The benchmark corpus is far below qdrant's indexing threshold, so the
+# sweep collections lower it (QDRANT_INDEXING_THRESHOLD) or qdrant would search them exactly
+def sweep_hnsw(name, work_dir, chunk_size, corpus_embeddings, query_matrix, truth, k, grid):
+    results = []
+    for m_value, ef_construction, ef_search in grid:
+        print(f"Benchmarking {name} with M={m_value}, ef_construction={ef_construction}, ef_search={ef_search}")
+        hnsw = {"m": m_value, "ef_construction": ef_construction, "ef_search": ef_search}
+        result = run_backend(
+            BackendAdapter(name, load_backend(name), work_dir, chunk_size, hnsw=hnsw),
+            corpus_embeddings, query_matrix, truth, k
+        )
+        results.append({**hnsw, **result})
+    return results
+
+
+# ingests every PDF of the notes folder through the backend's own process_pdf_files, once with the serial loop
+# and once with the async pipeline, each into an empty store with empty embedding and PDF text caches
+def compare_ingest(name, work_dir, chunk_size, notes, concurrency):
+    import embedding_cache
+    import pdf_extraction
+    results = {}
+    for mode in ["serial", "pipeline"]:
+        print(f"Ingesting {notes} into {name} ({mode})")
+        run_dir = os.path.join(work_dir, f"ingest_{name}_{mode}")
+        os.makedirs(run_dir, exist_ok=True)
+        embedding_cache._cache = embedding_cache.EmbeddingCache(os.path.join(run_dir, "embeddings.sqlite"))
+        pdf_extraction.TEXT_CACHE_PATH = os.path.join(run_dir, "pdf_text.sqlite")
+        adapter = BackendAdapter(name, load_backend(name), run_dir, chunk_size)
+        adapter.setup()
+        try:
+            start_time = time.perf_counter()
+            adapter.module.process_pdf_files(notes, pipeline=mode == "pipeline", concurrency=concurrency)
+            seconds = time.perf_counter() - start_time
+            manifest = adapter.module.manifest
+            chunks = sum(len(ids) for source in manifest.files for ids in manifest.chunk_ids(source).values())
+            results[mode] = {
+                "files": len(manifest.files),
+                "chunks": chunks,
+                "seconds": round(seconds, 4),
+                "chunks_per_sec": round(chunks / seconds, 1) if seconds else None,
+            }
+        finally:
+            adapter.teardown()
+    results["speedup"] = round(results["serial"]["seconds"] / results["pipeline"]["seconds"], 2)
+    return results
+
+
+# memory column of the reports in MB, estimates marked with ~
+def format_memory(result):
+    if result["memory_bytes"] is not None:
+        return f"{result['memory_bytes'] / 1024 / 1024:.2f}"
+    if result.get("memory_bytes_estimated") is not None:
+        return f"~{result['memory_bytes_estimated'] / 1024 / 1024:.2f}"
+    return "nan"
+
+
+def print_ingest_report(report):
+    print(f"\n{'backend':<12} {'mode':<9} {'files':>6} {'chunks':>7} {'seconds':>9} {'chunks/s':>9} {'speedup':>8}")
+    for name, modes in report["ingest"].items():
+        if "error" in modes:
+            print(f"{name:<12} error: {modes['error']}")
+            continue
+        for mode in ["serial", "pipeline"]:
+            result = modes[mode]
+            speedup = f"{modes['speedup']:.2f}x" if mode == "pipeline" else ""
+            print(
+                f"{name:<12} {mode:<9} {result['files']:>6} {result['chunks']:>7} {result['seconds']:>9.2f} "
+                f"{result['chunks_per_sec'] or 0:>9.1f} {speedup:>8}"
+            )
+
+
+def print_sweep_report(report, k):
+    print(
+        f"\n{'backend':<10} {'M':>4} {'ef_c':>6} {'ef_s':>6} {'build s':>9} {'memory MB':>10} "
+        f"{'p50 ms':>8} {'p95 ms':>8} {'recall@' + str(k):>10}"
+    )
+    for name, points in report["hnsw"].items():
+        if "error" in points:
+            print(f"{name:<10} error: {points['error']}")
+            continue
+        for point in points:
+            print(
+                f"{name:<10} {point['m']:>4} {point['ef_construction']:>6} {point['ef_search']:>6} "
+                f"{point['ingest']['seconds']:>9.3f} {format_memory(point):>10} "
+                f"{point['query']['p50_ms']:>8.2f} {point['query']['p95_ms']:>8.2f} {point[f'recall_at_{k}']:>10.3f}"
+            )
+
+
+def print_dimension_report(report, k):
+    print(f"\n{'backend':<12} {'dims':<6} {'memory MB':>10} {'recall@' + str(k):>10} {'p50 ms':>8} {'p95 ms':>8}")
+    for name, dims in report["dimensions"].items():
+        if "error" in dims:
+            print(f"{name:<12} error: {dims['error']}")
+            continue
+        for dim, result in dims.items():
+            print(
+                f"{name:<12} {dim:<6} {format_memory(result):>10} "
+                f"{result[f'recall_at_{k}']:>10.3f} {result['query']['p50_ms']:>8.2f} {result['query']['p95_ms']:>8.2f}"
+            )
+
+
+def print_storage_report(report, k):
+    print(f"\n{'backend':<12} {'storage':<8} {'memory MB':>10} {'saved':>7} {'recall@' + str(k):>10} {'lost':>7} {'p95 ms':>8}")
+    for name, modes in report["storage"].items():
+        if "error" in modes:
+            print(f"{name:<12} error: {modes['error']}")
+            continue
+        for storage, result in modes.items():
+            print(
+                f"{name:<12} {storage:<8} {format_memory(result):>10} "
+                f"{result.get('memory_saved', float('nan')):>7.1%} {result[f'recall_at_{k}']:>10.3f} "
+                f"{result['recall_lost']:>7.3f} {result['query']['p95_ms']:>8.2f}"
+            )
+
+
+def print_report(report, k):
+    print(f"\n{'backend':<12} {'ingest/s':>10} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'recall@' + str(k):>10}")
+    for name, result in report["backends"].items():
+        if "error" in result:
+            print(f"{name:<12} error: {result['error']}")
+            continue
+        query = result["query"]
+        print(
+            f"{name:<12} {result['ingest']['chunks_per_sec'] or 0:>10.1f} {query['p50_ms']:>8.2f} "
+            f"{query['p95_ms']:>8.2f} {query['p99_ms']:>8.2f} {result[f'recall_at_{k}']:>10.3f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ingest throughput, query latency and recall@k per backend")
+    parser.add_argument("--backends", nargs="+", default=BACKENDS, choices=BACKENDS)
+    parser.add_argument("--notes", default="./Notes")
+    parser.add_argument("--max-files", type=int, default=10)
+    parser.add_argument("--chunk-size", type=int, default=250)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("-k", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=4300)
+    parser.add_argument("--port", type=int, default=11499, help="port for the in-process fake ollama")
+    parser.add_argument("--output", default="benchmark_report.json")
+    parser.add_argument("--compare-storage", action="store_true", help="compare memory and recall of float32 against float16/int8 storage")
+    parser.add_argument("--dimensions", type=int, nargs="+", help="compare recall of vectors reduced to these dimensions")
+    parser.add_argument("--reduction", choices=["pca", "truncate"], default="pca", help="how --dimensions reduces the vectors")
+    parser.add_argument("--sweep", action="store_true", help="sweep the HNSW parameters below instead of a single run")
+    parser.add_argument("--m", type=int, nargs="+", default=[8, 16, 32], help="HNSW graph degrees to sweep")
+    parser.add_argument("--ef-construction", type=int, nargs="+", default=[100, 200], help="build-time ef values to sweep")
+    parser.add_argument("--ef-search", type=int, nargs="+", default=[10, 50, 100], help="query-time ef values to sweep")
+    parser.add_argument("--compare-ingest", action="store_true", help="time ingesting the whole notes folder serially and through the async pipeline")
+    parser.add_argument("--stage-concurrency", nargs="+", metavar="STAGE=N", help="pipeline workers per stage for --compare-ingest")
+    parser.add_argument("--embed-latency", type=float, default=0.0, help="seconds the fake ollama waits per request, to stand in for a real model")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="rag_bench_")
+    server = use_fake_ollama(work_dir, args.port, args.embed_latency)
+    try:
+        from batch_embedding import embed_batch
+        from numpy_store import questions
+
+        corpus = build_corpus(args.notes, args.chunk_size, args.max_files)
+        corpus_embeddings = []
+        for source, chunks in corpus:
+            if chunks:
+                chunk_ids = [f"{source}_{i}_{args.chunk_size}" for i in range(len(chunks))]
+                corpus_embeddings.append((source, chunk_ids, chunks, embed_batch(chunks, BENCH_MODEL)))
+        all_ids = [chunk_id for _, chunk_ids, _, _ in corpus_embeddings for chunk_id in chunk_ids]
+        chunk_matrix = np.vstack([embeddings for _, _, _, embeddings in corpus_embeddings])
+
+        queries = build_queries(questions, corpus, args.queries, args.seed)
+        query_matrix = embed_batch(queries, BENCH_MODEL)
+        truth = brute_force_top_k(all_ids, chunk_matrix, query_matrix, args.k)
+
+        report = {
+            "config": {
+                "chunk_size": args.chunk_size,
+                "chunks": len(all_ids),
+                "dimension": int(chunk_matrix.shape[1]),
+                "files": len(corpus),
+                "k": args.k,
+                "queries": len(queries),
+                "seed": args.seed,
+            },
+        }
+
+        if args.compare_ingest:
+            mode = "ingest"
+        elif args.compare_storage:
+            mode = "storage"
+        elif args.dimensions:
+            mode = "dimensions"
+        elif args.sweep:
+            mode = "hnsw"
+        else:
+            mode = "backends"
+        report[mode] = {}
+        for name in args.backends:
+            print(f"Benchmarking {name} with {len(all_ids)} chunks and {len(queries)} queries")
+            try:
+                if mode == "ingest":
+                    from ingest_pipeline import parse_concurrency
+                    report[mode][name] = compare_ingest(
+                        name, work_dir, args.chunk_size, args.notes, parse_concurrency(args.stage_concurrency)
+                    )
+                elif mode == "storage":
+                    report[mode][name] = compare_storage(
+                        name, work_dir, args.chunk_size, corpus_embeddings, query_matrix, truth, args.k
+                    )
+                elif mode == "dimensions":
+                    report[mode][name] = compare_dimensions(
+                        name, work_dir, args.chunk_size, corpus_embeddings, query_matrix, truth, args.k,
+                        args.dimensions, args.reduction
+                    )
+                elif mode == "hnsw":
+                    if name == "numpy_store":
+                        print("numpy_store searches exactly, there is nothing to sweep")
+                        continue
+                    grid = [(m, c, e) for m in args.m for c in args.ef_construction for e in args.ef_search]
+                    report[mode][name] = sweep_hnsw(
+                        name, work_dir, args.chunk_size, corpus_embeddings, query_matrix, truth, args.k, grid
+                    )
+                else:
+                    adapter = BackendAdapter(name, load_backend(name), work_dir, args.chunk_size)
+                    report[mode][name] = run_backend(adapter, corpus_embeddings, query_matrix, truth, args.k)
+            except Exception as e:
+                print(f"{name} failed: {e}")
+                report[mode][name] = {"error": str(e)}
+
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+            f.write("\n")
+        if mode == "ingest":
+            print_ingest_report(report)
+        elif mode == "storage":
+            print_storage_report(report, args.k)
+        elif mode == "dimensions":
+            print_dimension_report(report, args.k)
+        elif mode == "hnsw":
+            print_sweep_report(report, args.k)
+        else:
+            print_report(report, args.k)
+        print(f"\nReport written to {args.output}")
+    finally:
+        server.shutdown()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,33 @@
 import os
+import asyncio
+from contextlib import asynccontextmanager
 from pathlib import Path
 import numpy as np
 import chromadb
-import ollama
-import PyPDF2
+from pdf_extraction import extract_pages, extract_texts
+from chunking import iter_chunks, chunks_by_size
+from dim_reduction import reduced_dimension, fit_projections, needs_fit
+from embedding_cache import print_cache_stats
+from batch_embedding import embed_batch, print_embedding_throughput
+from manifest import IngestManifest, sync_manifest
+from dedupe import DEDUPE_THRESHOLD, DedupeIndex
+from answer_cache import AnswerCache
+from ingest_pipeline import IngestPipeline, parse_concurrency
+from scheduler import LLM_CONCURRENCY, build_work_list, grid_of, run_schedule
+from results_store import ResultStore
+from retrieval_plan import build_retrieval_plan
+from tracing import tracer
+from generation import generate, PartialAnswerLog, print_generation_summary
+from context_packing import make_hit, pack_context, join_hits, print_packing_summary
+import argparse
+import time
 from typing import List, Dict, Any
 
 DISTANCE_METRIC = "cosine"
+# HNSW graph degree and build/query candidate list sizes (chroma's defaults), fixed when a collection is created
+HNSW_M = 16
+HNSW_CONSTRUCTION_EF = 100
+HNSW_SEARCH_EF = 10
 
 embedding_models = ["paraphrase-multilingual", "nomic-embed-text", "all-minilm:33m"]
 llm_models = ["deepseek-r1:latest", "llama3.2", "mistral"]
@@ -24,6 +45,9 @@ questions = [
 client = None
 collections = {}
 model_dimensions = {}
+manifest = IngestManifest("chroma")
+dedupe_index = DedupeIndex("chroma")
+answer_cache = AnswerCache("chroma")
 
 # generates a collectio name given model and size
 def get_collection_name(model, chunk_size):
@@ -32,61 +56,130 @@ def get_collection_name(model, chunk_size):
 
 # generates the embedding and dimensions for embedding
 def get_embedding_and_dimensions(text, model):
-    response = ollama.embeddings(model=model, prompt=text)
-    embedding = response["embedding"]
+    embedding = embed_batch([text], model)[0].tolist()
     return embedding, len(embedding)
 
-# initializes the vector store by creating collection for each embedding model and chunk size
-def initialize_vector_store(dictionary = "./chroma_db"):
+# initializes the vector store by creating collection for each embedding model and chunk size,
+# existing collections are kept (with the HNSW settings they were created with) unless rebuild is set
+def initialize_vector_store(dictionary = "./chroma_db", rebuild=False,
+                            m=HNSW_M, construction_ef=HNSW_CONSTRUCTION_EF, search_ef=HNSW_SEARCH_EF):
     global client, collections, model_dimensions
     
     client = chromadb.PersistentClient(path=dictionary)
+    # older chromadb versions list Collection objects, newer ones their names
+    existing = {getattr(collection, "name", collection) for collection in client.list_collections()}
     
     sample_text = "This is a sample text to determine embedding dimensions."
     
     for model in embedding_models:
-        embedding, dim = get_embedding_and_dimensions(sample_text, model)
+        # the probe is the full vector, indices are sized for the reduced one (see dim_reduction.py)
+        dim = reduced_dimension(model, len(embed_batch([sample_text], model, reduce=False)[0]))
         model_dimensions[model] = dim
         
         for chunk_size in chunk_sizes:
             collection_name = get_collection_name(model, chunk_size)
             
-            try:
-                client.delete_collection(collection_name)
-            except:
-                pass
+            if rebuild:
+                try:
+                    client.delete_collection(collection_name)
+                except:
+                    pass
             
-            collection = client.create_collection(
+            collection = client.get_or_create_collection(
                 name=collection_name,
-                metadata={"hnsw:space": DISTANCE_METRIC},
+                metadata={
+                    "hnsw:space": DISTANCE_METRIC,
+                    "hnsw:M": m,
+                    "hnsw:construction_ef": construction_ef,
+                    "hnsw:search_ef": search_ef
+                },
                 embedding_function=None 
             )
             
             collections[(model, chunk_size)] = collection
+            
+            # a collection created just now (e.g. ./chroma_db was deleted) holds none of the chunks the
+            # manifest remembers for it
+            if not rebuild and collection_name not in existing and manifest.forget_combination(model, chunk_size):
+                print(f"Collection {collection_name} was missing, its chunks will be ingested again")
+                manifest.save()
+
+    if rebuild:
+        manifest.clear()
+    # the index settings are part of the fingerprint cached answers are checked against (answer_cache.py)
+    settings = [
+        manifest.record_index(model, chunk_size, dim=model_dimensions[model], vector_type="float32")
+        for model in embedding_models for chunk_size in chunk_sizes
+    ]
+    if any(settings):
+        manifest.save()
+
+# largest number of records chroma accepts in a single add/upsert
+def get_max_batch_size():
+    if hasattr(client, "get_max_batch_size"):
+        return client.get_max_batch_size()
+    return client.max_batch_size
 
-# add document to the collection based on embedding and chunk size
-def add_document(model, chunk_size, text, 
-                source, chunk_id, embedding):
-    """Add a document chunk to the appropriate collection"""
+# add a batch of document chunks to the collection based on embedding and chunk size,
+# split into as many upserts as chroma's max batch size requires; offsets are the (start, end)
+# word offsets of each chunk in its source, used to merge overlapping hits in the prompt
+def add_document(model, chunk_size, texts, 
+                source, chunk_ids, embeddings, offsets=None):
+    """Add document chunks to the appropriate collection"""
     global collections
     
     collection = collections.get((model, chunk_size))
     if not collection:
         raise ValueError(f"Collection for {model} and chunk size {chunk_size} not initialized")
     
-    collection.add(
-        ids=[chunk_id],
-        embeddings=[embedding],
-        metadatas=[{
-            "source": source,
-            "chunk_size": chunk_size,
-            "chunk_id": chunk_id
-        }],
-        documents=[text]
-    )
+    batch_size = get_max_batch_size()
+    for start in range(0, len(chunk_ids), batch_size):
+        end = start + batch_size
+        collection.upsert(
+            ids=chunk_ids[start:end],
+            embeddings=embeddings[start:end],
+            metadatas=[{
+                "source": source,
+                "chunk_size": chunk_size,
+                "chunk_id": chunk_id,
+                **({"start": offsets[i][0], "end": offsets[i][1]} if offsets else {})
+            } for i, chunk_id in enumerate(chunk_ids[start:end], start)],
+            documents=texts[start:end]
+        )
+
+# store stage of the async ingest pipeline; chroma has no async client for a local store,
+# so each batch is added on a worker thread
+@asynccontextmanager
+async def pipeline_store():
+    async def store(batch, embeddings):
+        chunk_ids = [chunk.chunk_id for chunk in batch.chunks]
+        await asyncio.to_thread(
+            add_document,
+            model=batch.model,
+            chunk_size=batch.chunk_size,
+            texts=[chunk.text for chunk in batch.chunks],
+            source=batch.source,
+            chunk_ids=chunk_ids,
+            embeddings=embeddings.tolist(),
+            offsets=[(chunk.start, chunk.end) for chunk in batch.chunks]
+        )
+        return chunk_ids
+    
+    yield store
+
+# deletes the stored chunks of a file, given {(model, chunk_size): chunk ids} from the manifest
+def delete_chunks(chunk_ids):
+    for (model, chunk_size), ids in chunk_ids.items():
+        collection = collections.get((model, chunk_size))
+        if collection and ids:
+            collection.delete(ids=ids)
 
 # queries the data to store the topk 
 def query_vector_store(model, chunk_size, query_embedding, k= 5):
+    return query_vector_store_batch(model, chunk_size, [query_embedding], k)[0]
+
+# queries the topk for several query embeddings in one collection.query call, one result list per query
+def query_vector_store_batch(model, chunk_size, query_embeddings, k=5):
     global collections
     
     collection = collections.get((model, chunk_size))
@@ -94,76 +187,144 @@ def query_vector_store(model, chunk_size, query_embedding, k= 5):
         raise ValueError(f"Collection for {model} and chunk size {chunk_size} not initialized")
     
     results = collection.query(
-        query_embeddings=[query_embedding],
+        query_embeddings=[list(embedding) for embedding in query_embeddings],
         n_results=k,
         include=["documents", "metadatas", "distances"]
     )
     
-    formatted_results = []
-    for i in range(len(results["ids"][0])):
-        formatted_results.append({
-            "text": results["documents"][0][i],
-            "source": results["metadatas"][0][i]["source"],
-            "chunk_id": results["metadatas"][0][i]["chunk_id"],
-            "chunk_size": str(results["metadatas"][0][i]["chunk_size"]),
-            "vector_distance": results["distances"][0][i]
-        })
+    all_results = []
+    for q in range(len(results["ids"])):
+        formatted_results = []
+        for i in range(len(results["ids"][q])):
+            formatted_results.append({
+                "text": results["documents"][q][i],
+                "source": results["metadatas"][q][i]["source"],
+                "chunk_id": results["metadatas"][q][i]["chunk_id"],
+                "chunk_size": str(results["metadatas"][q][i]["chunk_size"]),
+                "start": results["metadatas"][q][i].get("start"),
+                "end": results["metadatas"][q][i].get("end"),
+                "vector_distance": results["distances"][q][i]
+            })
+        all_results.append(formatted_results)
     
-    return formatted_results
+    return all_results
 
 # extracts text from pdf using pypdf2
 def extract_text_from_pdf(pdf_path: str) -> str:
-    with open(pdf_path, 'rb') as file:
-        pdf_reader = PyPDF2.PdfReader(file)
-        text = "".join([page.extract_text() + " " for page in pdf_reader.pages])
-    return text
-
-# creates a chunks of the texts with overlaps (half of chunks)
-def chunk_text(text, chunk_size = 100):
-    words = text.split()
-    chunks = []
-    for i in range(0, len(words), chunk_size // 2): 
-        chunks.append(" ".join(words[i:i + chunk_size]))
-    return chunks
+    return extract_texts([pdf_path])[str(pdf_path)]
+
+# the serial loop: extract every pdf, then chunk, embed and store one file at a time
+def ingest_serially(pending):
+    with tracer.span("extract", files=len(pending)):
+        pages = extract_pages(pending) if pending else {}
+    fit_projections(embedding_models, pages, chunk_sizes)
+    
+    for pdf_file in pending:
+        pdf_name = os.path.basename(str(pdf_file))
+        missing = [
+            (embedding_model, chunk_size) for embedding_model in embedding_models for chunk_size in chunk_sizes
+            if not manifest.has(pdf_name, embedding_model, chunk_size)
+        ]
+        
+        # every missing chunk size comes out of one pass over the pages
+        sizes = sorted({chunk_size for _, chunk_size in missing})
+        with tracer.span("chunk", source=pdf_name, chunk_sizes=sizes) as span:
+            by_size = chunks_by_size(iter_chunks(pages.pop(str(pdf_file)), pdf_name, sizes), sizes)
+            span["chunks"] = sum(len(chunks) for chunks in by_size.values())
+        with tracer.span("dedupe", source=pdf_name) as span:
+            by_size, aliases = dedupe_index.filter(pdf_name, by_size)
+            span["skipped"] = sum(len(size_aliases) for size_aliases in aliases.values())
+        
+        for embedding_model, chunk_size in missing:
+            chunks = [chunk.text for chunk in by_size[chunk_size]]
+            chunk_ids = [chunk.chunk_id for chunk in by_size[chunk_size]]
+            with tracer.span("embed", model=embedding_model, chunks=len(chunks)):
+                embeddings = embed_batch(chunks, embedding_model)
+            
+            with tracer.span("store", backend="chroma", chunks=len(chunks)):
+                add_document(
+                    model=embedding_model,
+                    chunk_size=chunk_size,
+                    texts=chunks,
+                    source=pdf_name,
+                    chunk_ids=chunk_ids,
+                    embeddings=embeddings.tolist(),
+                    offsets=[(chunk.start, chunk.end) for chunk in by_size[chunk_size]]
+                )
+            manifest.record(pdf_name, embedding_model, chunk_size, chunk_ids)
+        for chunk_size, size_aliases in aliases.items():
+            manifest.record_aliases(pdf_name, chunk_size, size_aliases)
+        manifest.save()
+        dedupe_index.save()
+
+# the async pipeline (ingest_pipeline.py); a PCA that still has to be fitted needs every file's pages first
+def ingest_pipelined(pending, concurrency=None):
+    if any(needs_fit(model) for model in embedding_models):
+        fit_projections(embedding_models, extract_pages(pending), chunk_sizes)
+    IngestPipeline("chroma", manifest, dedupe_index, embedding_models, chunk_sizes, pipeline_store, concurrency).run(pending)
 
 # Remove the check for 'os' within the function, since it's already imported at the top.
-def process_pdf_files(folder_path):
+def process_pdf_files(folder_path, pipeline=False, concurrency=None):
     pdf_files = list(Path(folder_path).glob('*.pdf'))
     if not pdf_files:
         print(f"No PDF files found in {folder_path}")
         return
+
+    sync_manifest(manifest, pdf_files, delete_chunks)
+    dedupe_index.retain(manifest)
+    pending = [
+        pdf_file for pdf_file in pdf_files
+        if not all(manifest.has(pdf_file.name, model, size) for model in embedding_models for size in chunk_sizes)
+    ]
+    print(f"{len(pending)} of {len(pdf_files)} PDF files need to be ingested")
+    ingest_start = time.perf_counter()
+    if pipeline and pending:
+        ingest_pipelined(pending, concurrency)
+    else:
+        ingest_serially(pending)
+    seconds = time.perf_counter() - ingest_start
+    tracer.record("ingest", seconds, files=len(pending), pipeline=pipeline)
+    print(f"Ingested {len(pending)} PDF files in {seconds:.2f}s ({'pipeline' if pipeline else 'serial'})")
+
+    dedupe_index.print_stats()
+    print_embedding_throughput()
+    print_cache_stats()
+
+# retrieves the topk for a matrix of question embeddings from one collection with a single query
+def search_batch(embedding_model: str, chunk_size: int, question_matrix, k: int = 5) -> List[List[Dict[str, Any]]]:
+    return query_vector_store_batch(embedding_model, chunk_size, question_matrix.tolist(), k)
+
+# Ggenerates an answer to the question based on the embedding model, chunk size, and llm models,
+# results can be passed in when the chunks were already retrieved;
+# use_cache looks the question up in the semantic answer cache first (answer_cache.py)
+def answer_question(question: str, embedding_model: str, chunk_size: int, llm_model: str, k: int = 5, results=None, stream=False, on_token=None, pack=False, question_embedding=None, use_cache=False) -> str:
+    if question_embedding is None and (results is None or use_cache):
+        with tracer.span("embed", model=embedding_model, chunks=1):
+            question_embedding, _ = get_embedding_and_dimensions(question, embedding_model)
     
-    for embedding_model in embedding_models:
-        for pdf_file in pdf_files:
-            pdf_name = os.path.basename(str(pdf_file))
-            text = extract_text_from_pdf(str(pdf_file))
-            
-            for chunk_size in chunk_sizes:
-                chunks = chunk_text(text, chunk_size)                
-                for i, chunk in enumerate(chunks):
-                    embedding, _ = get_embedding_and_dimensions(chunk, embedding_model)
-                    chunk_id = f"{pdf_name}_{i}_{chunk_size}"
-                    
-                    add_document(
-                        model=embedding_model,
-                        chunk_size=chunk_size,
-                        text=chunk,
-                        source=pdf_name,
-                        chunk_id=chunk_id,
-                        embedding=embedding
-                    )
-# Ggenerates an answer to the question based on the embedding model, chunk size, and llm models
-def answer_question(question: str, embedding_model: str, chunk_size: int, llm_model: str, k: int = 5) -> str:
-    question_embedding, _ = get_embedding_and_dimensions(question, embedding_model)
-    
-    results = query_vector_store(
-        model=embedding_model,
-        chunk_size=chunk_size,
-        query_embedding=question_embedding,
-        k=k
-    )
+    # a close enough earlier question with the same embedding model, chunk size, llm, k and packing skips retrieval
+    # and the llm
+    if use_cache:
+        with tracer.span("cache", llm=llm_model, model=embedding_model, chunk_size=chunk_size) as span:
+            cached = answer_cache.lookup(embedding_model, chunk_size, llm_model, k, pack, question_embedding, manifest)
+            span["hit"] = cached is not None
+        if cached is not None:
+            if on_token:
+                on_token(cached)
+            return cached
+    
+    if results is None:
+        with tracer.span("search", backend="chroma", model=embedding_model, chunk_size=chunk_size):
+            results = query_vector_store(
+                model=embedding_model,
+                chunk_size=chunk_size,
+                query_embedding=question_embedding,
+                k=k
+            )
     
-    context = "\n".join([doc["text"] for doc in results])
+    prompt_start = time.perf_counter()
+    hits = [make_hit(doc["text"], doc["source"], doc.get("start"), doc.get("end")) for doc in results]
+    context, packing = pack_context(hits, llm_model) if pack else join_hits(hits)
     
     prompt = f"""
     Context information:
@@ -173,52 +334,107 @@ def answer_question(question: str, embedding_model: str, chunk_size: int, llm_mo
     
     Answer based on the context. If the answer is unavailable, state it clearly.
     """
+    tracer.record("prompt", time.perf_counter() - prompt_start, context_chars=len(context), packed=pack, **packing)
     
-    response = ollama.chat(
-        model=llm_model,
-        messages=[{"role": "user", "content": prompt}]
-    )
+    with tracer.span("generate", llm=llm_model, model=embedding_model, chunk_size=chunk_size, stream=stream) as span:
+        answer, stats = generate(prompt, llm_model, stream=stream, on_token=on_token)
+        span.update(stats)
+    
+    if use_cache:
+        answer_cache.store(embedding_model, chunk_size, llm_model, k, pack, question, question_embedding, manifest, answer)
     
-    return response["message"]["content"]
+    return answer
 
-# Iterates over embedding, llm, and chunk size to answer all question for all combination for Redis
-def all_combinations_question_answers(log_file: str = "processed_data.txt"):
-    with open(log_file, "w", encoding="utf-8") as log:
-        for embedding_model in embedding_models:
-            
-            for llm_model in llm_models:
-                
-                for chunk_size in chunk_sizes:
-                    
-                    for question in questions:
-                        
-                        try:
-                            answer = answer_question(
-                                question=question,
-                                embedding_model=embedding_model,
-                                chunk_size=chunk_size,
-                                llm_model=llm_model
-                            )
-                            # writes the result in the file
-                            log.write(f"\nLLM\n{llm_model}\n")
-                            log.write(f"Embedding\n{embedding_model}\n")
-                            log.write(f"Chunk Sizes\n{chunk_size}\n\n")
-                            log.write(f"Question\n{question}\n\n")
-                            log.write(f"Answer\n{answer}\n")
-                            
-                        except Exception as e:
-                            print(f"Error processing: {e}")
-                            log.write(f"\nLLM\n{llm_model}\n")
-                            log.write(f"Embedding\n{embedding_model}\n")
-                            log.write(f"Chunk Sizes\n{chunk_size}\n\n")
-                            log.write(f"Question\n{question}\n\n")
-                            log.write(f"Answer\nError: {str(e)}\n")
+# Iterates over embedding, llm, and chunk size to answer all question for all combination for Chroma,
+# the grid is scheduled so each llm is loaded once. Every answer goes to results.sqlite as soon as it is done,
+# cells already answered there with the same packing from the same index are skipped unless resume is False,
+# and the results file is rendered from it
+def all_combinations_question_answers(log_file: str = "processed_data.txt", concurrency: int = LLM_CONCURRENCY, stream: bool = False, pack: bool = False, resume: bool = True):
+    tracer.place_next_to(log_file)
+    partial_log = PartialAnswerLog(log_file, "chroma") if stream else None
+    results = ResultStore.next_to(log_file)
+    work = build_work_list(embedding_models, llm_models, chunk_sizes, questions)
+    todo = results.pending("chroma", work, manifest, packed=pack) if resume else work
+    print(f"{len(work) - len(todo)} of {len(work)} answers already in {results.path}, {len(todo)} to run")
+    
+    # one batched query per collection, shared by every llm
+    plan = build_retrieval_plan(*grid_of(todo), search_batch) if todo else {}
+    
+    def write_entry(log, item, result):
+        # writes the result in the file
+        log.write(f"\nLLM\n{item.llm_model}\n")
+        log.write(f"Embedding\n{item.embedding_model}\n")
+        log.write(f"Chunk Sizes\n{item.chunk_size}\n\n")
+        log.write(f"Question\n{item.question}\n\n")
+        if result.error is None:
+            log.write(f"Answer\n{result.answer}\n")
+        else:
+            log.write(f"Answer\nError: {str(result.error)}\n")
+    
+    # stored as soon as the cell finishes, so an interrupted run only loses the requests in flight
+    def record_result(item, result):
+        results.add("chroma", item, result, manifest, packed=pack, stream=stream)
+        if partial_log:
+            partial_log.discard(item)
+    
+    def write_result(item, result):
+        if result.error is not None:
+            print(f"Error processing: {result.error}")
+    
+    # with stream set, tokens go to a partial file per answer (and to the terminal when running one at a time)
+    def run(item):
+        on_token = partial_log.writer(item, echo=concurrency == 1) if partial_log else None
+        try:
+            return answer_question(
+                question=item.question,
+                embedding_model=item.embedding_model,
+                chunk_size=item.chunk_size,
+                llm_model=item.llm_model,
+                results=plan.get((item.embedding_model, item.chunk_size, item.question)),
+                stream=stream,
+                on_token=on_token,
+                pack=pack
+            )
+        finally:
+            if on_token:
+                on_token.close()
+    
+    # rendered even when the run is interrupted, so the file always has everything answered so far
+    try:
+        run_schedule(todo, run, write_result, concurrency, done_fn=record_result)
+    finally:
+        results.render(log_file, "chroma", work, write_entry, manifest, packed=pack)
+        results.close()
 
 def main():
+    parser = argparse.ArgumentParser(description="RAG over ./Notes with Chroma")
+    parser.add_argument("--rebuild", action="store_true", help="drop the collections and re-ingest every PDF")
+    parser.add_argument("--dedupe-threshold", type=float, default=DEDUPE_THRESHOLD, help="similarity above which a chunk is skipped as a near-duplicate")
+    parser.add_argument("--no-dedupe", action="store_true", help="embed every chunk, even near-duplicates")
+    parser.add_argument("--pipeline", action="store_true", help="ingest through the async extract/chunk/embed/store pipeline")
+    parser.add_argument("--stage-concurrency", nargs="+", metavar="STAGE=N", help="pipeline workers per stage, e.g. embed=8 store=4")
+    parser.add_argument("--hnsw-m", type=int, default=HNSW_M, help="hnsw:M of newly created collections")
+    parser.add_argument("--construction-ef", type=int, default=HNSW_CONSTRUCTION_EF, help="hnsw:construction_ef of newly created collections")
+    parser.add_argument("--search-ef", type=int, default=HNSW_SEARCH_EF, help="hnsw:search_ef of newly created collections")
+    parser.add_argument("--concurrency", type=int, default=LLM_CONCURRENCY, help="concurrent requests per loaded LLM")
+    parser.add_argument("--stream", action="store_true", help="stream answers, keeping partial output on disk")
+    parser.add_argument("--packing", action="store_true", help="merge overlapping chunks and cut the context to a per-llm token budget instead of sending the chunks verbatim")
+    parser.add_argument("--fresh", action="store_true", help="answer every combination again instead of skipping the ones already in results.sqlite")
+    args = parser.parse_args()
+    dedupe_index.threshold = None if args.no_dedupe else args.dedupe_threshold
+
     try:
-        initialize_vector_store()
-        process_pdf_files("./Notes")
-        all_combinations_question_answers()
+        initialize_vector_store(
+            rebuild=args.rebuild,
+            m=args.hnsw_m,
+            construction_ef=args.construction_ef,
+            search_ef=args.search_ef
+        )
+        process_pdf_files("./Notes", pipeline=args.pipeline, concurrency=parse_concurrency(args.stage_concurrency))
+        all_combinations_question_answers(concurrency=args.concurrency, stream=args.stream, pack=args.packing, resume=not args.fresh)
+        tracer.print_summary()
+        print_generation_summary(tracer)
+        print_packing_summary(tracer)
         
     except Exception as e:
         print(f"Main execution failed with error: {str(e)}")
@@ -0,0 +1,79 @@
+from collections import namedtuple
+
+# one overlapping window of words from a document. start/end are word offsets in the whole document
+# (end exclusive) and first_page/last_page the pages those words came from, so later stages can tell
+# overlapping chunks apart or merge them without going back to the text
+Chunk = namedtuple("Chunk", ["chunk_id", "source", "chunk_size", "index", "start", "end", "first_page", "last_page", "text"])
+
+
+def make_chunk_id(source, index, chunk_size):
+    return f"{source}_{index}_{chunk_size}"
+
+
+# streams chunks of every size in chunk_sizes from an iterable of page texts in a single pass. Each page
+# is split into words once and only the words still needed by some window are kept, so the full text is
+# never joined. Windows are the same as words[i:i + size] for i in range(0, len(words), size // 2) on the
+# whole document, and so are the chunk ids; chunks of different sizes are interleaved in the output
+def iter_chunks(pages, source, chunk_sizes):
+    sizes = sorted(set(chunk_sizes))
+    if any(size < 2 for size in sizes):
+        raise ValueError(f"Chunk sizes must be at least 2, got {sizes}")
+
+    words, word_pages = [], []
+    buffer_start = 0
+    next_start = {size: 0 for size in sizes}
+    next_index = {size: 0 for size in sizes}
+
+    def window(size, end):
+        start = next_start[size]
+        lo, hi = start - buffer_start, end - buffer_start
+        chunk = Chunk(
+            chunk_id=make_chunk_id(source, next_index[size], size),
+            source=source,
+            chunk_size=size,
+            index=next_index[size],
+            start=start,
+            end=end,
+            first_page=word_pages[lo],
+            last_page=word_pages[hi - 1],
+            text=" ".join(words[lo:hi]),
+        )
+        next_start[size] += size // 2
+        next_index[size] += 1
+        return chunk
+
+    for page_number, page in enumerate(pages):
+        page_words = page.split()
+        words.extend(page_words)
+        word_pages.extend([page_number] * len(page_words))
+        total = buffer_start + len(words)
+
+        for size in sizes:
+            while next_start[size] + size <= total:
+                yield window(size, next_start[size] + size)
+
+        # drop the words every size has moved past
+        keep_from = min(next_start.values())
+        if keep_from > buffer_start:
+            del words[:keep_from - buffer_start]
+            del word_pages[:keep_from - buffer_start]
+            buffer_start = keep_from
+
+    # the last windows of each size run short, ending at the last word
+    total = buffer_start + len(words)
+    for size in sizes:
+        while next_start[size] < total:
+            yield window(size, min(next_start[size] + size, total))
+
+
+# groups the chunks of one document by chunk size, each list in index order
+def chunks_by_size(chunks, chunk_sizes):
+    grouped = {size: [] for size in chunk_sizes}
+    for chunk in chunks:
+        grouped[chunk.chunk_size].append(chunk)
+    return grouped
+
+
+# chunk texts of a single size for an already joined text
+def chunk_text(text, chunk_size=100):
+    return [chunk.text for chunk in iter_chunks([text], "", [chunk_size])]
@@ -0,0 +1,143 @@
+## Context assembly for the answer prompt
+##
+## python context_packing.py trace.jsonl
+## compares prompt tokens and generation latency of the runs in a trace, e.g. one with --packing and one without
+
+import json
+import math
+import sys
+from collections import namedtuple
+import numpy as np
+
+# context tokens each llm gets, leaving room for the question, the instructions and the answer in ollama's
+# default 2048-token window; deepseek-r1 gets less because it writes a long reasoning section first
+CONTEXT_TOKEN_BUDGETS = {
+    "deepseek-r1:latest": 1024,
+    "llama3.2": 1536,
+    "mistral": 1536,
+}
+DEFAULT_CONTEXT_TOKENS = 1536
+# rough words -> tokens ratio for english text with the llama/mistral tokenizers
+TOKENS_PER_WORD = 1.3
+
+# one retrieved chunk; start/end are its word offsets in the source document (None for chunks stored
+# before offsets were kept, those are used as they are)
+Hit = namedtuple("Hit", ["text", "source", "start", "end"])
+
+
+def make_hit(text, source, start=None, end=None):
+    return Hit(text, source, int(start) if start not in (None, "") else None, int(end) if end not in (None, "") else None)
+
+
+def estimate_tokens(text):
+    return math.ceil(len(text.split()) * TOKENS_PER_WORD)
+
+
+# merges hits of the same source whose word ranges overlap or touch into one span, keeping the words of
+# each hit only once. Spans come back in the order of their best-ranked hit
+def merge_hits(hits):
+    spans = []
+    by_source = {}
+    for rank, hit in enumerate(hits):
+        if hit.start is None or hit.end is None:
+            if all(hit.text != span["text"] for span in spans if span["start"] is None):
+                spans.append({"rank": rank, "source": hit.source, "start": None, "end": None, "text": hit.text})
+            continue
+        by_source.setdefault(hit.source, []).append((hit.start, hit.end, rank, hit.text.split()))
+
+    for source, ranges in by_source.items():
+        ranges.sort()
+        current = None
+        for start, end, rank, words in ranges:
+            if current is not None and start <= current["end"]:
+                if end > current["end"]:
+                    current["words"] += words[current["end"] - start:]
+                    current["end"] = end
+                current["rank"] = min(current["rank"], rank)
+            else:
+                current = {"rank": rank, "source": source, "start": start, "end": end, "words": list(words)}
+                spans.append(current)
+
+    for span in spans:
+        if "words" in span:
+            span["text"] = " ".join(span.pop("words"))
+    return sorted(spans, key=lambda span: span["rank"])
+
+
+# builds the context for llm_model from ranked hits: overlapping hits are merged, then spans are added
+# best first until the model's token budget is used up, the last one cut to fit.
+# Returns (context, stats) where stats compares against joining the raw hits
+def pack_context(hits, llm_model, budget=None):
+    budget = budget or CONTEXT_TOKEN_BUDGETS.get(llm_model, DEFAULT_CONTEXT_TOKENS)
+    raw_tokens = sum(estimate_tokens(hit.text) for hit in hits)
+
+    parts, used = [], 0
+    for span in merge_hits(hits):
+        tokens = estimate_tokens(span["text"])
+        if used + tokens > budget:
+            words = span["text"].split()[:int((budget - used) / TOKENS_PER_WORD)]
+            if words:
+                parts.append(" ".join(words))
+                used += estimate_tokens(parts[-1])
+            break
+        parts.append(span["text"])
+        used += tokens
+
+    stats = {
+        "hits": len(hits),
+        "spans": len(parts),
+        "raw_tokens": raw_tokens,
+        "context_tokens": used,
+        "tokens_saved": raw_tokens - used,
+        "budget": budget,
+    }
+    return "\n\n".join(parts), stats
+
+
+# joins the hits verbatim, the way the prompt was built before packing
+def join_hits(hits):
+    context = "\n".join(hit.text for hit in hits)
+    raw_tokens = sum(estimate_tokens(hit.text) for hit in hits)
+    return context, {"hits": len(hits), "raw_tokens": raw_tokens, "context_tokens": raw_tokens, "tokens_saved": 0}
+
+
+# estimated context tokens saved by packing over this run's prompt spans
+def print_packing_summary(tracer):
+    spans = [span for span in tracer.spans if span["stage"] == "prompt" and "raw_tokens" in span]
+    if not spans:
+        return
+    raw = sum(span["raw_tokens"] for span in spans)
+    packed = sum(span["context_tokens"] for span in spans)
+    print(
+        f"Context: {packed} estimated tokens sent instead of {raw} over {len(spans)} prompts, "
+        f"{raw - packed} saved ({(raw - packed) / raw if raw else 0.0:.1%})"
+    )
+
+
+# per run of a trace file: packing on/off, mean context and prompt tokens, time to first token and generate time
+def compare_runs(trace_path):
+    runs = {}
+    with open(trace_path, "r", encoding="utf-8") as f:
+        for line in f:
+            span = json.loads(line)
+            runs.setdefault(span["run"], []).append(span)
+
+    print(f"{'run':<14} {'packed':>7} {'prompts':>8} {'context tok':>12} {'prompt tok':>11} {'ttft s':>8} {'generate s':>11}")
+    for run_id, spans in runs.items():
+        prompts = [span for span in spans if span["stage"] == "prompt" and "context_tokens" in span]
+        generates = [span for span in spans if span["stage"] == "generate"]
+        if not prompts or not generates:
+            continue
+        prompt_tokens = [span["prompt_tokens"] for span in generates if span.get("prompt_tokens")]
+        ttft = [span["ttft_s"] for span in generates if span.get("ttft_s") is not None]
+        print(
+            f"{run_id:<14} {str(any(span.get('packed') for span in prompts)):>7} {len(prompts):>8} "
+            f"{np.mean([span['context_tokens'] for span in prompts]):>12.1f} "
+            f"{(np.mean(prompt_tokens) if prompt_tokens else float('nan')):>11.1f} "
+            f"{(np.mean(ttft) if ttft else float('nan')):>8.3f} "
+            f"{np.mean([span['seconds'] for span in generates]):>11.3f}"
+        )
+
+
+if __name__ == "__main__":
+    compare_runs(sys.argv[1] if len(sys.argv) > 1 else "trace.jsonl")
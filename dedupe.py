@@ -0,0 +1,146 @@
+import hashlib
+import os
+import re
+import numpy as np
+from embedding_cache import CACHE_DIR
+
+# chunks whose estimated Jaccard similarity (over word shingles) with an already kept chunk of the same size
+# reaches the threshold are not embedded, they are recorded as aliases of the kept chunk instead
+DEDUPE_THRESHOLD = float(os.environ.get("DEDUPE_THRESHOLD", 0.9))
+SHINGLE_SIZE = 3
+NUM_PERM = 128
+BANDS = 32
+SEED = 4300
+
+_rng = np.random.default_rng(SEED)
+_SEEDS = _rng.integers(0, 2**63, NUM_PERM, dtype=np.uint64)
+_MULTIPLIERS = _rng.integers(0, 2**63, NUM_PERM, dtype=np.uint64) | np.uint64(1)
+
+
+# 64-bit hashes of the overlapping word shingles of a text, stable across runs
+def shingle_hashes(text):
+    words = re.findall(r"\w+", text.lower())
+    if len(words) < SHINGLE_SIZE:
+        shingles = {" ".join(words)} if words else set()
+    else:
+        shingles = {" ".join(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+    return np.array(
+        [int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "little") for s in shingles],
+        dtype=np.uint64,
+    )
+
+
+# MinHash signature: for each of NUM_PERM (xor, odd multiply) permutations, the smallest permuted hash
+def minhash(text):
+    hashes = shingle_hashes(text)
+    if len(hashes) == 0:
+        return None
+    return ((hashes[:, None] ^ _SEEDS[None, :]) * _MULTIPLIERS[None, :]).min(axis=0)
+
+
+# fraction of equal signature positions, an estimate of the Jaccard similarity of the shingle sets
+def similarity(a, b):
+    return float(np.mean(a == b))
+
+
+# MinHash signatures of every kept chunk of one backend, with LSH buckets (BANDS bands of NUM_PERM / BANDS
+# rows) so a new chunk is only compared with chunks sharing at least one band
+class DedupeIndex:
+    def __init__(self, backend, threshold=DEDUPE_THRESHOLD, path=None):
+        self.path = path or os.path.join(CACHE_DIR, f"dedupe_{backend}.npz")
+        self.threshold = threshold
+        self.rows = []
+        self.skipped = 0
+        self.checked = 0
+        if os.path.exists(self.path):
+            with np.load(self.path) as data:
+                self.rows = [
+                    (str(source), str(chunk_id), int(chunk_size), signature)
+                    for source, chunk_id, chunk_size, signature in zip(
+                        data["sources"], data["chunk_ids"], data["chunk_sizes"], data["signatures"]
+                    )
+                ]
+        self._rebuild_buckets()
+
+    def _band_keys(self, chunk_size, signature):
+        rows_per_band = NUM_PERM // BANDS
+        return [(chunk_size, band, signature[band * rows_per_band:(band + 1) * rows_per_band].tobytes()) for band in range(BANDS)]
+
+    def _rebuild_buckets(self):
+        self.buckets = {}
+        for i, (_, _, chunk_size, signature) in enumerate(self.rows):
+            for key in self._band_keys(chunk_size, signature):
+                self.buckets.setdefault(key, []).append(i)
+
+    # keeps only the rows of (source, chunk size) pairs the manifest still has chunks for
+    def retain(self, manifest):
+        stored = {(name, chunk_size) for name in manifest.files for _, chunk_size in manifest.chunk_ids(name)}
+        self._keep(lambda row: (row[0], row[2]) in stored)
+
+    def forget(self, source, chunk_sizes):
+        chunk_sizes = set(chunk_sizes)
+        self._keep(lambda row: not (row[0] == source and row[2] in chunk_sizes))
+
+    def _keep(self, predicate):
+        rows = [row for row in self.rows if predicate(row)]
+        if len(rows) != len(self.rows):
+            self.rows = rows
+            self._rebuild_buckets()
+
+    # the kept chunk a signature is a near-duplicate of, or None
+    def find(self, chunk_size, signature):
+        candidates = {i for key in self._band_keys(chunk_size, signature) for i in self.buckets.get(key, [])}
+        best, best_similarity = None, self.threshold
+        for i in candidates:
+            score = similarity(signature, self.rows[i][3])
+            if score >= best_similarity:
+                best, best_similarity = self.rows[i], score
+        return best
+
+    def add(self, source, chunk_id, chunk_size, signature):
+        self.rows.append((source, chunk_id, chunk_size, signature))
+        for key in self._band_keys(chunk_size, signature):
+            self.buckets.setdefault(key, []).append(len(self.rows) - 1)
+
+    # drops the near-duplicates from {chunk size: [Chunk, ...]} of one file and returns
+    # (kept chunks by size, {chunk size: {alias chunk id: [kept source, kept chunk id]}}).
+    # Earlier signatures of the file for these sizes are replaced, so re-ingesting never matches itself
+    def filter(self, source, by_size):
+        if self.threshold is None:
+            return by_size, {}
+        self.forget(source, by_size)
+        kept, aliases = {}, {}
+        for chunk_size, chunks in by_size.items():
+            kept[chunk_size], aliases[chunk_size] = [], {}
+            for chunk in chunks:
+                self.checked += 1
+                signature = minhash(chunk.text)
+                match = self.find(chunk_size, signature) if signature is not None else None
+                if match is not None:
+                    aliases[chunk_size][chunk.chunk_id] = [match[0], match[1]]
+                    self.skipped += 1
+                    continue
+                if signature is not None:
+                    self.add(source, chunk.chunk_id, chunk_size, signature)
+                kept[chunk_size].append(chunk)
+        return kept, aliases
+
+    # writes to a temp file first, like the manifest
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + ".tmp.npz"
+        np.savez(
+            tmp_path,
+            sources=np.array([row[0] for row in self.rows], dtype=str),
+            chunk_ids=np.array([row[1] for row in self.rows], dtype=str),
+            chunk_sizes=np.array([row[2] for row in self.rows], dtype=np.int64),
+            signatures=np.array([row[3] for row in self.rows], dtype=np.uint64).reshape(len(self.rows), NUM_PERM),
+        )
+        os.replace(tmp_path, self.path)
+
+    def print_stats(self):
+        if self.checked:
+            print(
+                f"Dedupe: {self.skipped} of {self.checked} chunks were near-duplicates (threshold {self.threshold}) "
+                f"and were not embedded, {len(self.rows)} chunks indexed"
+            )
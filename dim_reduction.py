@@ -0,0 +1,144 @@
+import os
+import numpy as np
+from embedding_cache import CACHE_DIR
+
+
+# target dimension per embedding model, e.g. EMBED_DIMENSIONS="nomic-embed-text=256,paraphrase-multilingual=384".
+# models that are not listed keep their full vectors; change it only together with --rebuild
+def parse_dimensions(value):
+    dimensions = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        model, dim = item.rsplit("=", 1)
+        dimensions[model.strip()] = int(dim)
+    return dimensions
+
+
+TARGET_DIMENSIONS = parse_dimensions(os.environ.get("EMBED_DIMENSIONS", ""))
+# models trained with Matryoshka representation learning: their leading dimensions are a usable embedding
+# on their own, so reducing is just truncating. Every other model gets a PCA projection fitted on the corpus
+MATRYOSHKA_MODELS = {"nomic-embed-text"}
+PCA_SAMPLE_SIZE = 4096
+
+_projections = {}
+
+
+# rows are L2-normalized again after reducing, the backends all compare by cosine
+def _renormalize(matrix):
+    return matrix / np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+
+
+# maps full embeddings to dim dimensions, by truncation or by x @ components.T
+class Projection:
+    def __init__(self, model, dim, method, components=None):
+        self.model = model
+        self.dim = dim
+        self.method = method
+        self.components = components
+
+    def apply(self, matrix):
+        matrix = np.asarray(matrix, dtype=np.float32)
+        if self.method == "truncate":
+            return _renormalize(matrix[:, :self.dim])
+        return _renormalize(matrix @ self.components.T).astype(np.float32)
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + ".tmp.npz"
+        np.savez(tmp_path, components=self.components)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, model, dim, path):
+        with np.load(path) as data:
+            return cls(model, dim, "pca", data["components"])
+
+
+def reduction_method(model):
+    return "truncate" if model in MATRYOSHKA_MODELS else "pca"
+
+
+# the projection is shared by every backend, so it is fitted once and kept until the file is deleted
+def projection_path(model, dim):
+    model_safe_name = model.replace('-', '_').replace(':', '_')
+    return os.path.join(CACHE_DIR, f"pca_{model_safe_name}_{dim}.npz")
+
+
+# dimension the vectors of a model have once reduced
+def reduced_dimension(model, full_dim):
+    return min(TARGET_DIMENSIONS.get(model, full_dim), full_dim)
+
+
+# the model's projection, None when the model isn't reduced or its PCA hasn't been fitted yet
+def get_projection(model):
+    dim = TARGET_DIMENSIONS.get(model)
+    if dim is None:
+        return None
+    projection = _projections.get(model)
+    if projection is None or projection.dim != dim:
+        if reduction_method(model) == "truncate":
+            projection = Projection(model, dim, "truncate")
+        elif os.path.exists(projection_path(model, dim)):
+            projection = Projection.load(model, dim, projection_path(model, dim))
+        else:
+            return None
+        _projections[model] = projection
+    return projection
+
+
+# makes projection the one applied to its model's embeddings, with its dimension as the target
+def use_projection(projection):
+    TARGET_DIMENSIONS[projection.model] = projection.dim
+    _projections[projection.model] = projection
+
+
+def needs_fit(model):
+    return model in TARGET_DIMENSIONS and reduction_method(model) == "pca" and get_projection(model) is None
+
+
+# fits a PCA on a matrix of full embeddings. The vectors are not centered: the top right singular vectors of
+# the raw matrix span the directions the corpus actually uses, so dot products between stored vectors and a
+# query are kept as well as possible. With fewer samples than dimensions the missing components are zero rows
+def fit_pca(model, matrix, dim=None, path=None):
+    dim = dim or TARGET_DIMENSIONS[model]
+    matrix = np.asarray(matrix, dtype=np.float32)
+    _, _, vt = np.linalg.svd(matrix, full_matrices=False)
+    components = np.zeros((dim, matrix.shape[1]), dtype=np.float32)
+    components[:min(dim, len(vt))] = vt[:dim]
+    if len(vt) < dim:
+        print(f"Only {len(vt)} samples to fit the {dim}-dim PCA of {model}, the remaining components are zero")
+    projection = Projection(model, dim, "pca", components)
+    if path is not False:
+        projection.save(path or projection_path(model, dim))
+    use_projection(projection)
+    return projection
+
+
+# reduces embeddings of a model to its target dimension, leaving models without a target untouched
+def reduce_embeddings(model, matrix):
+    dim = TARGET_DIMENSIONS.get(model)
+    if dim is None or matrix.shape[1] <= dim:
+        return matrix
+    projection = get_projection(model)
+    if projection is None:
+        raise ValueError(f"No PCA projection fitted for {model}, ingest the corpus first (run with --rebuild)")
+    return projection.apply(matrix)
+
+
+# fits the PCA of every model that needs one on up to PCA_SAMPLE_SIZE evenly spaced chunks of the pages
+# about to be ingested ({pdf path: [page text, ...]}); the sampled chunks land in the embedding cache
+def fit_projections(models, pages, chunk_sizes):
+    from batch_embedding import embed_batch
+    from chunking import iter_chunks
+
+    models = [model for model in models if needs_fit(model)]
+    if not models or not pages:
+        return
+    texts = [
+        chunk.text for path, file_pages in pages.items()
+        for chunk in iter_chunks(file_pages, os.path.basename(path), chunk_sizes)
+    ]
+    step = max(1, len(texts) // PCA_SAMPLE_SIZE)
+    texts = texts[::step][:PCA_SAMPLE_SIZE]
+    for model in models:
+        print(f"Fitting a {TARGET_DIMENSIONS[model]}-dim PCA for {model} on {len(texts)} chunks")
+        fit_pca(model, embed_batch(texts, model, reduce=False))
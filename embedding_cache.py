@@ -0,0 +1,144 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import numpy as np
+
+CACHE_DIR = "./.rag_cache"
+CACHE_PATH = os.path.join(CACHE_DIR, "embeddings.sqlite")
+MAX_ENTRIES = 250000
+
+_cache = None
+
+
+# hashes the chunk text so the cache key doesn't depend on where the text came from
+def text_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+# on-disk embedding cache keyed by (embedding model, hash of the text) with LRU eviction
+class EmbeddingCache:
+    def __init__(self, path=CACHE_PATH, max_entries=MAX_ENTRIES):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS embeddings (
+                model TEXT NOT NULL,
+                text_hash TEXT NOT NULL,
+                dim INTEGER NOT NULL,
+                vector BLOB NOT NULL,
+                last_used INTEGER NOT NULL,
+                PRIMARY KEY (model, text_hash)
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        self._conn.commit()
+        row = self._conn.execute("SELECT COALESCE(MAX(last_used), 0), COUNT(*) FROM embeddings").fetchone()
+        self._clock, self._count = row
+
+    # returns the cached embedding as a list of floats, or None on a miss
+    def get(self, model, text):
+        return self.get_many(model, [text])[0]
+
+    # looks up several texts at once, returning None for every miss
+    def get_many(self, model, texts):
+        hashes = [text_hash(text) for text in texts]
+        found = {}
+        with self._lock:
+            for start in range(0, len(hashes), 500):
+                batch = hashes[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN ({placeholders})",
+                    [model, *batch],
+                ).fetchall()
+                found.update(rows)
+            if found:
+                self._clock += 1
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE model = ? AND text_hash = ?",
+                    [(self._clock, model, h) for h in found],
+                )
+                self._conn.commit()
+            results = []
+            for h in hashes:
+                if h in found:
+                    self.hits += 1
+                    results.append(np.frombuffer(found[h], dtype=np.float32).tolist())
+                else:
+                    self.misses += 1
+                    results.append(None)
+        return results
+
+    # stores a single embedding
+    def put(self, model, text, embedding):
+        self.put_many(model, [text], [embedding])
+
+    # stores several embeddings and evicts the least recently used ones past max_entries
+    def put_many(self, model, texts, embeddings):
+        rows = []
+        with self._lock:
+            self._clock += 1
+            for text, embedding in zip(texts, embeddings):
+                vector = np.asarray(embedding, dtype=np.float32)
+                rows.append((model, text_hash(text), len(vector), vector.tobytes(), self._clock))
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, text_hash, dim, vector, last_used) VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+            self._conn.commit()
+            self._count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            if self._count > self.max_entries:
+                self._evict(self._count - self.max_entries)
+
+    # drops the least recently used entries
+    def _evict(self, n):
+        self._conn.execute(
+            "DELETE FROM embeddings WHERE rowid IN (SELECT rowid FROM embeddings ORDER BY last_used ASC LIMIT ?)",
+            (n,),
+        )
+        self._conn.commit()
+        self._count -= n
+
+    def __len__(self):
+        return self._count
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": self._count,
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+# returns the process-wide cache shared by redis.py, chroma.py and qdrant.py
+def get_embedding_cache():
+    global _cache
+    if _cache is None:
+        _cache = EmbeddingCache()
+    return _cache
+
+
+# prints the hit/miss counters of the shared cache
+def print_cache_stats():
+    stats = get_embedding_cache().stats()
+    print(
+        f"Embedding cache: {stats['hits']} hits, {stats['misses']} misses "
+        f"({stats['hit_rate']:.1%} hit rate), {stats['entries']} entries"
+    )
@@ -0,0 +1,125 @@
+## Minimal stand-in for the Ollama HTTP API, for running the scripts offline
+##
+## python fake_ollama.py --port 11435
+## OLLAMA_HOST=http://localhost:11435 python chroma.py
+
+import argparse
+import hashlib
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+
+DEFAULT_DIMENSION = 384
+MODEL_DIMENSIONS = {
+    "nomic-embed-text": 768,
+    "paraphrase-multilingual": 768,
+    "all-minilm:33m": 384,
+}
+
+
+# deterministic hashed bag-of-words embedding, so texts sharing words end up close together
+def fake_embedding(text, model, dim=None):
+    dim = dim or MODEL_DIMENSIONS.get(model, DEFAULT_DIMENSION)
+    vector = np.zeros(dim, dtype=np.float32)
+    for word in re.findall(r"\w+", text.lower()):
+        digest = hashlib.blake2b(f"{model}:{word}".encode("utf-8"), digest_size=8).digest()
+        value = int.from_bytes(digest, "little")
+        vector[value % dim] += 1.0 if (value >> 32) & 1 else -1.0
+    norm = np.linalg.norm(vector)
+    if norm == 0:
+        vector[0] = 1.0
+        norm = 1.0
+    return (vector / norm).tolist()
+
+
+# answers with a short canned response that mentions the question
+def fake_answer(messages):
+    prompt = messages[-1]["content"] if messages else ""
+    question = re.search(r"Question:\s*(.*)", prompt)
+    question = question.group(1).strip() if question else ""
+    return f"This is a fake answer to: {question}"
+
+
+class FakeOllamaHandler(BaseHTTPRequestHandler):
+    latency = 0.0
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    # newline-delimited JSON, one word per chunk, like ollama's streaming responses
+    def _send_stream(self, model, answer, final):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.end_headers()
+        for word in answer.split(" "):
+            chunk = {"model": model, "message": {"role": "assistant", "content": word + " "}, "done": False}
+            self.wfile.write((json.dumps(chunk) + "\n").encode("utf-8"))
+            self.wfile.flush()
+        final = {**final, "message": {"role": "assistant", "content": ""}}
+        self.wfile.write((json.dumps(final) + "\n").encode("utf-8"))
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        model = request.get("model", "")
+        time.sleep(self.latency)
+
+        if self.path == "/api/embed":
+            texts = request.get("input", "")
+            if isinstance(texts, str):
+                texts = [texts]
+            self._send_json({"model": model, "embeddings": [fake_embedding(text, model) for text in texts]})
+        elif self.path == "/api/embeddings":
+            self._send_json({"embedding": fake_embedding(request.get("prompt", ""), model)})
+        elif self.path == "/api/chat":
+            answer = fake_answer(request.get("messages", []))
+            final = {
+                "model": model,
+                "message": {"role": "assistant", "content": answer},
+                "done": True,
+                "prompt_eval_count": sum(len(m.get("content", "").split()) for m in request.get("messages", [])),
+                "eval_count": len(answer.split()),
+            }
+            if request.get("stream", True):
+                self._send_stream(model, answer, final)
+            else:
+                self._send_json(final)
+        else:
+            self.send_error(404)
+
+
+# starts the fake server on a background thread and returns it (call .shutdown() to stop)
+def start_fake_ollama(host="127.0.0.1", port=11435, latency=0.0):
+    handler = type("Handler", (FakeOllamaHandler,), {"latency": latency})
+    server = ThreadingHTTPServer((host, port), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake Ollama server for offline runs")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds of simulated overhead per request")
+    args = parser.parse_args()
+
+    handler = type("Handler", (FakeOllamaHandler,), {"latency": args.latency})
+    server = ThreadingHTTPServer((args.host, args.port), handler)
+    print(f"Fake Ollama listening on http://{args.host}:{args.port}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
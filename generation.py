@@ -0,0 +1,119 @@
+import hashlib
+import os
+import time
+import threading
+import numpy as np
+import ollama
+
+PARTIAL_DIR = "partial_answers"
+# how long ollama keeps a model loaded after a request, e.g. "30m" or -1 for as long as it runs;
+# None leaves ollama's own default (5 minutes)
+KEEP_ALIVE = os.environ.get("OLLAMA_KEEP_ALIVE")
+
+
+# sends the prompt to the llm and returns (answer, stats); with stream=True every piece of text is
+# passed to on_token as soon as it arrives and time-to-first-token is measured
+def generate(prompt, llm_model, stream=False, on_token=None):
+    messages = [{"role": "user", "content": prompt}]
+    start_time = time.perf_counter()
+    first_token = None
+    final = None
+
+    if stream:
+        parts = []
+        for chunk in ollama.chat(model=llm_model, messages=messages, stream=True, keep_alive=KEEP_ALIVE):
+            content = chunk["message"]["content"]
+            if content:
+                if first_token is None:
+                    first_token = time.perf_counter() - start_time
+                parts.append(content)
+                if on_token:
+                    on_token(content)
+            if chunk.get("done"):
+                final = chunk
+        answer = "".join(parts)
+    else:
+        final = ollama.chat(model=llm_model, messages=messages, keep_alive=KEEP_ALIVE)
+        answer = final["message"]["content"]
+
+    total = time.perf_counter() - start_time
+    prompt_tokens = final.get("prompt_eval_count") if final is not None else None
+    completion_tokens = final.get("eval_count") if final is not None else None
+    eval_duration = final.get("eval_duration") if final is not None else None
+
+    # ollama reports eval_duration in nanoseconds; without it, fall back to wall time after the first token
+    if completion_tokens and eval_duration:
+        tokens_per_sec = completion_tokens / (eval_duration / 1e9)
+    elif completion_tokens:
+        tokens_per_sec = completion_tokens / max(total - (first_token or 0.0), 1e-9)
+    else:
+        tokens_per_sec = None
+
+    stats = {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "ttft_s": round(first_token, 6) if first_token is not None else None,
+        "tokens_per_sec": round(tokens_per_sec, 2) if tokens_per_sec else None,
+    }
+    return answer, stats
+
+
+# keeps the text of every in-flight streamed answer in its own file, so a crash mid-grid keeps the
+# partial output; files are removed once the answer has been stored
+class PartialAnswerLog:
+    def __init__(self, log_file, backend):
+        self.directory = os.path.join(os.path.dirname(os.path.abspath(log_file)), PARTIAL_DIR)
+        self.backend = backend
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    # named after the cell rather than item.index, which is renumbered every time a run resumes
+    def _path(self, item):
+        key = "\0".join([self.backend, item.embedding_model, str(item.chunk_size), item.llm_model, item.question])
+        return os.path.join(self.directory, f"{self.backend}_{hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]}.txt")
+
+    # returns an on_token callback appending to this item's partial file (and echoing when echo is set)
+    def writer(self, item, echo=False):
+        f = open(self._path(item), "w", encoding="utf-8")
+        f.write(f"LLM: {item.llm_model}\nEmbedding: {item.embedding_model}\nChunk size: {item.chunk_size}\n")
+        f.write(f"Question: {item.question}\n\nAnswer:\n")
+        f.flush()
+
+        def on_token(text):
+            f.write(text)
+            f.flush()
+            if echo:
+                with self._lock:
+                    print(text, end="", flush=True)
+
+        def close():
+            f.close()
+            if echo:
+                with self._lock:
+                    print(flush=True)
+
+        on_token.close = close
+        return on_token
+
+    def discard(self, item):
+        try:
+            os.remove(self._path(item))
+        except FileNotFoundError:
+            pass
+
+
+# mean time-to-first-token and tokens/sec per llm from the generate spans of a tracer
+def print_generation_summary(tracer):
+    spans = [span for span in tracer.spans if span["stage"] == "generate"]
+    if not spans:
+        return
+    print(f"\n{'llm':<22} {'answers':>8} {'ttft s':>8} {'tok/s':>8} {'total s':>9}")
+    for llm_model in sorted({span.get("llm") for span in spans}, key=str):
+        model_spans = [span for span in spans if span.get("llm") == llm_model]
+        ttft = [span["ttft_s"] for span in model_spans if span.get("ttft_s") is not None]
+        rate = [span["tokens_per_sec"] for span in model_spans if span.get("tokens_per_sec")]
+        print(
+            f"{str(llm_model):<22} {len(model_spans):>8} "
+            f"{(np.mean(ttft) if ttft else float('nan')):>8.2f} {(np.mean(rate) if rate else float('nan')):>8.1f} "
+            f"{np.sum([span['seconds'] for span in model_spans]):>9.1f}"
+        )
@@ -0,0 +1,162 @@
+## Async ingest pipeline: extract -> chunk -> embed -> store, with a bounded queue between every two stages
+##
+## Each stage runs its own number of workers, so Ollama is embedding the next batch while the vector store is
+## still writing the previous one and the next PDF is already being parsed. A full queue makes the stage
+## feeding it wait, which keeps memory bounded when extraction runs ahead of embedding.
+## The backends pass in their store stage as an async context manager yielding store(batch, embeddings) -> ids.
+
+import asyncio
+import os
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+import ollama
+from batch_embedding import EMBED_BATCH_SIZE, EMBED_CONCURRENCY, OLLAMA_HOST, embed_batch_async
+from chunking import iter_chunks, chunks_by_size
+from pdf_extraction import extract_pages_async
+from tracing import tracer
+
+QUEUE_SIZE = int(os.environ.get("INGEST_QUEUE_SIZE", 8))
+# workers per stage; extract is the number of PDFs parsed at once, their pages share one process pool.
+# Chunking also runs the near-duplicate check, which only one worker can do at a time. The embed workers
+# share one limit of EMBED_CONCURRENCY requests in flight to Ollama
+STAGE_CONCURRENCY = {"extract": 2, "chunk": 1, "embed": 4, "store": 2}
+
+# slice of at most EMBED_BATCH_SIZE chunks of one file for one (model, chunk size); part orders the slices
+# again when their stored ids are recorded in the manifest
+EmbedBatch = namedtuple("EmbedBatch", ["source", "model", "chunk_size", "part", "chunks"])
+
+_DONE = object()
+
+
+# ["embed=8", "store=4"] -> STAGE_CONCURRENCY with those stages changed
+def parse_concurrency(values):
+    concurrency = dict(STAGE_CONCURRENCY)
+    for value in values or []:
+        stage, workers = value.split("=", 1)
+        if stage not in concurrency:
+            raise ValueError(f"Unknown stage {stage}, expected one of {', '.join(concurrency)}")
+        concurrency[stage] = max(1, int(workers))
+    return concurrency
+
+
+class IngestPipeline:
+    def __init__(self, backend, manifest, dedupe_index, embedding_models, chunk_sizes, open_store,
+                 concurrency=None, queue_size=QUEUE_SIZE, batch_size=EMBED_BATCH_SIZE):
+        self.backend = backend
+        self.manifest = manifest
+        self.dedupe_index = dedupe_index
+        self.embedding_models = embedding_models
+        self.chunk_sizes = chunk_sizes
+        self.open_store = open_store
+        self.concurrency = concurrency or dict(STAGE_CONCURRENCY)
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.files = {}
+
+    # ingests the pdfs and records each one in the manifest as soon as all of its batches are stored
+    def run(self, pdf_files):
+        asyncio.run(self._run(pdf_files))
+
+    async def _run(self, pdf_files):
+        self.dedupe_lock = asyncio.Lock()
+        inbox = asyncio.Queue()
+        for pdf_file in pdf_files:
+            inbox.put_nowait(pdf_file)
+        inbox.put_nowait(_DONE)
+        extracted, chunked, embedded = (asyncio.Queue(maxsize=self.queue_size) for _ in range(3))
+
+        print(f"Ingest pipeline: {', '.join(f'{stage} x{n}' for stage, n in self.concurrency.items())}, queues of {self.queue_size}")
+        self.client = ollama.AsyncClient(host=OLLAMA_HOST)
+        self.embed_limit = asyncio.Semaphore(max(1, EMBED_CONCURRENCY))
+        with ProcessPoolExecutor() as pool:
+            async with self.open_store() as store:
+                self.store = store
+                tasks = [
+                    asyncio.create_task(self._stage("extract", inbox, extracted, lambda pdf_file: self._extract(pdf_file, pool))),
+                    asyncio.create_task(self._stage("chunk", extracted, chunked, self._chunk)),
+                    asyncio.create_task(self._stage("embed", chunked, embedded, self._embed)),
+                    asyncio.create_task(self._stage("store", embedded, None, self._store)),
+                ]
+                try:
+                    await asyncio.gather(*tasks)
+                finally:
+                    for task in tasks:
+                        task.cancel()
+                    await self.client.close()
+
+    # runs the stage's workers over inbox until it is drained, then passes the end marker on
+    async def _stage(self, stage, inbox, outbox, handle):
+        async def worker():
+            while (item := await inbox.get()) is not _DONE:
+                for result in await handle(item):
+                    await outbox.put(result)
+            await inbox.put(_DONE)
+
+        await asyncio.gather(*(worker() for _ in range(self.concurrency[stage])))
+        if outbox is not None:
+            await outbox.put(_DONE)
+
+    async def _extract(self, pdf_file, pool):
+        with tracer.span("extract", files=1, source=os.path.basename(str(pdf_file))):
+            pages = await extract_pages_async(pdf_file, pool)
+        return [(pdf_file, pages)]
+
+    # chunks every missing size in one pass and drops near-duplicates, then splits the chunks into embed batches
+    async def _chunk(self, item):
+        pdf_file, pages = item
+        source = os.path.basename(str(pdf_file))
+        missing = [
+            (model, chunk_size) for model in self.embedding_models for chunk_size in self.chunk_sizes
+            if not self.manifest.has(source, model, chunk_size)
+        ]
+        sizes = sorted({chunk_size for _, chunk_size in missing})
+        with tracer.span("chunk", source=source, chunk_sizes=sizes) as span:
+            by_size = await asyncio.to_thread(lambda: chunks_by_size(iter_chunks(pages, source, sizes), sizes))
+            span["chunks"] = sum(len(chunks) for chunks in by_size.values())
+        async with self.dedupe_lock:
+            with tracer.span("dedupe", source=source) as span:
+                by_size, aliases = await asyncio.to_thread(self.dedupe_index.filter, source, by_size)
+                span["skipped"] = sum(len(size_aliases) for size_aliases in aliases.values())
+
+        batches = [
+            EmbedBatch(source, model, chunk_size, part, by_size[chunk_size][start:start + self.batch_size])
+            for model, chunk_size in missing
+            for part, start in enumerate(range(0, len(by_size[chunk_size]), self.batch_size))
+        ]
+        self.files[source] = {
+            "missing": missing,
+            "aliases": aliases,
+            "remaining": len(batches),
+            "ids": {pair: {} for pair in missing},
+        }
+        if not batches:
+            await self._finish(source)
+        return batches
+
+    async def _embed(self, batch):
+        with tracer.span("embed", model=batch.model, chunks=len(batch.chunks)):
+            embeddings = await embed_batch_async([chunk.text for chunk in batch.chunks], batch.model, self.client, limit=self.embed_limit)
+        return [(batch, embeddings)]
+
+    async def _store(self, item):
+        batch, embeddings = item
+        with tracer.span("store", backend=self.backend, chunks=len(batch.chunks)):
+            ids = await self.store(batch, embeddings)
+        state = self.files[batch.source]
+        state["ids"][(batch.model, batch.chunk_size)][batch.part] = list(ids)
+        state["remaining"] -= 1
+        if state["remaining"] == 0:
+            await self._finish(batch.source)
+        return []
+
+    # every batch of the file is stored: record it like the serial loop does after each file
+    async def _finish(self, source):
+        state = self.files.pop(source)
+        for (model, chunk_size), parts in state["ids"].items():
+            self.manifest.record(source, model, chunk_size, [chunk_id for part in sorted(parts) for chunk_id in parts[part]])
+        for chunk_size, size_aliases in state["aliases"].items():
+            self.manifest.record_aliases(source, chunk_size, size_aliases)
+        self.manifest.save()
+        async with self.dedupe_lock:
+            self.dedupe_index.save()
+        print(f"Ingested {source}")
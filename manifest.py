@@ -0,0 +1,173 @@
+import hashlib
+import json
+import os
+from embedding_cache import CACHE_DIR
+
+
+# sha256 of the pdf bytes, so touched-but-unchanged files are not re-ingested. Entries are keyed by file
+# name, a renamed file is removed and ingested again under its new name
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+# key of one (embedding model, chunk size) combination inside a manifest entry
+def combination_key(model, chunk_size):
+    return f"{model}|{chunk_size}"
+
+
+# record of what each backend has ingested: file name -> content hash and chunk ids per model/chunk size
+class IngestManifest:
+    def __init__(self, backend, path=None):
+        self.backend = backend
+        self.path = path or os.path.join(CACHE_DIR, f"manifest_{backend}.json")
+        self.files = {}
+        self.indices = {}
+        self._mtime = None
+        self.refresh()
+
+    # (re)loads the manifest when the file on disk is newer than what this process has, e.g. in a
+    # long-running server after a script re-ingested some files
+    def refresh(self):
+        if not os.path.exists(self.path):
+            return False
+        mtime = os.path.getmtime(self.path)
+        if mtime == self._mtime:
+            return False
+        with open(self.path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        self.files = data.get("files", {})
+        self.indices = data.get("indices", {})
+        self._mtime = mtime
+        return True
+
+    # file names that were ingested before but are no longer in the folder
+    def removed(self, names):
+        names = set(names)
+        return [name for name in self.files if name not in names]
+
+    # True when the file is new or its content hash differs from the one ingested
+    def changed(self, name, content_hash):
+        entry = self.files.get(name)
+        return entry is None or entry["hash"] != content_hash
+
+    # True when the chunks of this file for the model/chunk size are already stored
+    def has(self, name, model, chunk_size):
+        entry = self.files.get(name)
+        return entry is not None and combination_key(model, chunk_size) in entry["chunks"]
+
+    # every stored chunk id of a file, grouped by (model, chunk size)
+    def chunk_ids(self, name):
+        entry = self.files.get(name, {"chunks": {}})
+        ids = {}
+        for key, chunk_ids in entry["chunks"].items():
+            model, chunk_size = key.rsplit("|", 1)
+            ids[(model, int(chunk_size))] = chunk_ids
+        return ids
+
+    # starts a fresh entry for a new or changed file and returns the chunk ids that are now stale
+    def reset(self, name, content_hash):
+        stale = self.chunk_ids(name)
+        self.files[name] = {"hash": content_hash, "chunks": {}}
+        return stale
+
+    def record(self, name, model, chunk_size, ids):
+        self.files[name]["chunks"][combination_key(model, chunk_size)] = list(ids)
+
+    # chunks of the file that were skipped as near-duplicates: {alias chunk id: [kept file, kept chunk id]}
+    def record_aliases(self, name, chunk_size, aliases):
+        self.files[name].setdefault("aliases", {})[str(chunk_size)] = dict(aliases)
+
+    def aliases(self, name, chunk_size):
+        return self.files.get(name, {}).get("aliases", {}).get(str(chunk_size), {})
+
+    # files with aliases pointing at chunks of any of the given files
+    def aliased_to(self, names):
+        names = set(names)
+        return {
+            name for name, entry in self.files.items()
+            if any(kept_file in names for aliases in entry.get("aliases", {}).values() for kept_file, _ in aliases.values())
+        }
+
+    # settings of the index a (model, chunk size) is stored in, e.g. its dimension, vector type and HNSW setup;
+    # returns True when they changed
+    def record_index(self, model, chunk_size, **settings):
+        key = combination_key(model, chunk_size)
+        changed = self.indices.get(key) != settings
+        self.indices[key] = settings
+        return changed
+
+    # hash of everything stored for one (model, chunk size): the settings of its index, and each file's
+    # content hash, chunk ids and aliases. It changes whenever a chunk of that combination is added, removed
+    # or re-ingested, or the index is rebuilt with another dimension, vector type or HNSW setup
+    def fingerprint(self, model, chunk_size):
+        key = combination_key(model, chunk_size)
+        stored = {
+            name: [entry["hash"], entry["chunks"].get(key), entry.get("aliases", {}).get(str(chunk_size))]
+            for name, entry in self.files.items() if key in entry["chunks"]
+        }
+        stored = {"index": self.indices.get(key), "files": stored}
+        return hashlib.sha256(json.dumps(stored, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def forget(self, name):
+        self.files.pop(name, None)
+
+    # number of chunk ids stored for one (model, chunk size) over all files
+    def stored(self, model, chunk_size):
+        key = combination_key(model, chunk_size)
+        return sum(len(entry["chunks"].get(key, [])) for entry in self.files.values())
+
+    # drops one (model, chunk size) from every file, e.g. after its index was lost and created again empty,
+    # so those chunks are ingested again; returns the names of the files that had it
+    def forget_combination(self, model, chunk_size):
+        key = combination_key(model, chunk_size)
+        return [name for name, entry in self.files.items() if entry["chunks"].pop(key, None) is not None]
+
+    def clear(self):
+        self.files = {}
+        self.save()
+
+    # writes to a temp file first so a crash never leaves a half-written manifest
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"backend": self.backend, "indices": self.indices, "files": self.files}, f)
+        os.replace(tmp_path, self.path)
+        self._mtime = os.path.getmtime(self.path)
+
+
+# works out which files need work: deletes chunks of removed and changed files through delete_chunks
+# and returns {file name: content hash} for every file in the folder
+def sync_manifest(manifest, pdf_files, delete_chunks):
+    names = {os.path.basename(str(path)): file_hash(path) for path in pdf_files}
+
+    affected = set()
+    for name in manifest.removed(names):
+        print(f"Removing chunks of deleted file {name}")
+        delete_chunks(manifest.chunk_ids(name))
+        manifest.forget(name)
+        affected.add(name)
+
+    for name, content_hash in names.items():
+        if manifest.changed(name, content_hash):
+            stale = manifest.reset(name, content_hash)
+            if stale:
+                print(f"{name} changed, removing its old chunks")
+                delete_chunks(stale)
+            affected.add(name)
+
+    # files whose near-duplicate chunks pointed into an affected file are ingested again, and so on
+    dependents = manifest.aliased_to(affected) - affected
+    while dependents:
+        for name in dependents:
+            print(f"{name} has chunks deduplicated against a removed or changed file, ingesting it again")
+            delete_chunks(manifest.reset(name, manifest.files[name]["hash"]))
+        affected |= dependents
+        dependents = manifest.aliased_to(affected) - affected
+
+    manifest.save()
+    return names
@@ -0,0 +1,530 @@
+import os
+import asyncio
+import json
+import shutil
+from contextlib import asynccontextmanager
+from pathlib import Path
+import numpy as np
+from pdf_extraction import extract_pages, extract_texts
+from chunking import iter_chunks, chunks_by_size
+from dim_reduction import reduced_dimension, fit_projections, needs_fit
+from embedding_cache import print_cache_stats
+from batch_embedding import embed_batch, print_embedding_throughput
+from manifest import IngestManifest, sync_manifest
+from dedupe import DEDUPE_THRESHOLD, DedupeIndex
+from answer_cache import AnswerCache
+from ingest_pipeline import IngestPipeline, parse_concurrency
+from scheduler import LLM_CONCURRENCY, build_work_list, grid_of, run_schedule
+from results_store import ResultStore
+from retrieval_plan import build_retrieval_plan
+from tracing import tracer
+from generation import generate, PartialAnswerLog, print_generation_summary
+from context_packing import make_hit, pack_context, join_hits, print_packing_summary
+import argparse
+import time
+
+# In-process vector store: one memory-mapped matrix per (embedding model, chunk size), no service needed
+STORE_DIR = "./numpy_store"
+# float16 halves and int8 quarters the vector footprint compared to float32
+STORE_DTYPE = "float32"
+STORE_DTYPES = {"float32": np.float32, "float16": np.float16, "int8": np.int8}
+VECTOR_FILES = {"float32": "vectors.f32", "float16": "vectors.f16", "int8": "vectors.i8"}
+SEARCH_BLOCK = 65536
+manifest = IngestManifest("numpy")
+dedupe_index = DedupeIndex("numpy")
+answer_cache = AnswerCache("numpy")
+
+# Embedding models, LLMs, and chunk sizes
+embedding_models = ["paraphrase-multilingual", "nomic-embed-text", "all-minilm:33m"]
+llm_models = ["deepseek-r1:latest", "llama3.2", "mistral"]
+chunk_sizes = [100, 250, 500]
+questions = ["What are pros and cons of different data structures for storing and searching values?",
+             "What is a right-left rotation for an AVL tree? Give an example of an unbalanced AVL tree that can be balanced using a right-left rotation.",
+             "Generally, explain the process for creating a B+ tree. Given the set of numbers [48, 65, 91, 90, 14, 13, 87, 74, 51, 92, 41, 70, 47, 64, 38, 29, 50, 21], create a B+ tree with node size = 3 by inserting the numbers in the given order.",
+             "How are ACID compliance and the CAP theorem related?",
+             "Tell me what you know about Redis. How do you connect to Redis?",
+             "Give examples of comparison operators in MongoDB and what they do. Given the mflix database, write a query to find the average number of imdb votes per year for movies released between 1970 and 2000 (inclusive)? Make sure the results are ordered by year.",
+             "Tell me about Mark Fontenot."
+             ]
+
+indices = {}
+
+
+# rows are L2-normalized on the way in so cosine similarity is a plain dot product
+def normalize(matrix):
+    matrix = np.asarray(matrix, dtype=np.float32)
+    if matrix.ndim == 1:
+        matrix = matrix[None, :]
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.maximum(norms, 1e-12)
+
+
+# vectors.{f32,f16,i8} holds the normalized embeddings back to back, meta.jsonl one line per row.
+# int8 rows are scaled by their largest component, the per-row scales go to scales.f32.
+# meta.jsonl is what commits rows: appends write it last and on open the vector files are cut back to its
+# row count; rewrites go to .next files that are swapped in once meta.jsonl.next is complete
+class VectorIndex:
+    def __init__(self, directory, dim, dtype=STORE_DTYPE):
+        self.directory = directory
+        self.dim = dim
+        self.dtype = dtype
+        self.meta_path = os.path.join(directory, "meta.jsonl")
+        self.scales_path = os.path.join(directory, "scales.f32")
+        os.makedirs(directory, exist_ok=True)
+        self._finish_rewrite()
+        self.meta = self._read_meta()
+        info_path = os.path.join(directory, "info.json")
+        if self.meta and os.path.exists(info_path):
+            with open(info_path, "r", encoding="utf-8") as f:
+                info = json.load(f)
+            if info["dim"] != dim:
+                raise ValueError(f"{directory} holds {info['dim']}-dim vectors but the model returns {dim}, run with --rebuild")
+            if info.get("dtype", "float32") != dtype:
+                print(f"{directory} stores {info.get('dtype', 'float32')} vectors, run with --rebuild to switch to {dtype}")
+                self.dtype = info.get("dtype", "float32")
+        self.vectors_path = os.path.join(directory, VECTOR_FILES[self.dtype])
+        with open(info_path, "w", encoding="utf-8") as f:
+            json.dump({"dim": dim, "dtype": self.dtype}, f)
+        self._truncate_to_meta()
+        self._vectors = None
+        self._scales = None
+
+    # a rewrite that got as far as a complete meta.jsonl.next is swapped in, an earlier one is dropped
+    def _finish_rewrite(self):
+        names = [*VECTOR_FILES.values(), "scales.f32", "meta.jsonl"]
+        committed = os.path.exists(self.meta_path + ".next")
+        for name in names:
+            path = os.path.join(self.directory, name)
+            for suffix in (".next", ".partial"):
+                if os.path.exists(path + suffix):
+                    if committed and suffix == ".next":
+                        os.replace(path + suffix, path)
+                    else:
+                        os.remove(path + suffix)
+
+    # rows of meta.jsonl; a last line cut off by a crash mid-append is dropped
+    def _read_meta(self):
+        if not os.path.exists(self.meta_path):
+            return []
+        with open(self.meta_path, "r", encoding="utf-8") as f:
+            text = f.read()
+        lines = text.split("\n")
+        if lines[-1]:
+            print(f"{self.meta_path} ends in an incomplete row, dropping it")
+            self._replace_meta("".join(line + "\n" for line in lines[:-1]))
+        return [json.loads(line) for line in lines[:-1] if line.strip()]
+
+    def _replace_meta(self, text):
+        with open(self.meta_path + ".partial", "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(self.meta_path + ".partial", self.meta_path)
+
+    # vector rows written by an append that crashed before its meta rows are cut off
+    def _truncate_to_meta(self):
+        files = [(self.vectors_path, self.dim * np.dtype(STORE_DTYPES[self.dtype]).itemsize)]
+        if self.dtype == "int8":
+            files.append((self.scales_path, 4))
+        for path, row_bytes in files:
+            size = os.path.getsize(path) if os.path.exists(path) else 0
+            if size < len(self.meta) * row_bytes:
+                raise ValueError(f"{path} holds {size // row_bytes} rows but {self.meta_path} {len(self.meta)}, run with --rebuild")
+            if size > len(self.meta) * row_bytes:
+                print(f"Dropping {size // row_bytes - len(self.meta)} uncommitted rows from {path}")
+                os.truncate(path, len(self.meta) * row_bytes)
+
+    def __len__(self):
+        return len(self.meta)
+
+    # bytes of vector data on disk (and in the page cache once searched)
+    @property
+    def nbytes(self):
+        size = len(self.meta) * self.dim * np.dtype(STORE_DTYPES[self.dtype]).itemsize
+        return size + (len(self.meta) * 4 if self.dtype == "int8" else 0)
+
+    # read-only memory map of the stored rows, reopened whenever rows were added or removed
+    @property
+    def vectors(self):
+        if self._vectors is None or self._vectors.shape[0] != len(self.meta):
+            if not self.meta:
+                return np.zeros((0, self.dim), dtype=STORE_DTYPES[self.dtype])
+            self._vectors = np.memmap(self.vectors_path, dtype=STORE_DTYPES[self.dtype], mode="r", shape=(len(self.meta), self.dim))
+            if self.dtype == "int8":
+                self._scales = np.fromfile(self.scales_path, dtype=np.float32)
+        return self._vectors
+
+    # converts normalized float32 rows to the stored type, with the int8 scales (None otherwise)
+    def encode(self, matrix):
+        if self.dtype != "int8":
+            return matrix.astype(STORE_DTYPES[self.dtype]), None
+        scales = np.maximum(np.abs(matrix).max(axis=1), 1e-12) / 127.0
+        return np.round(matrix / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+
+    # chunks already stored under the same chunk ids (e.g. from an interrupted ingest) are replaced
+    def append(self, chunk_ids, texts, source, chunk_size, embeddings, offsets=None):
+        self.delete(chunk_ids)
+        matrix, scales = self.encode(normalize(embeddings))
+        with open(self.vectors_path, "ab") as f:
+            f.write(matrix.tobytes())
+        if scales is not None:
+            with open(self.scales_path, "ab") as f:
+                f.write(scales.tobytes())
+        offsets = offsets or [(None, None)] * len(chunk_ids)
+        rows = [
+            {"chunk_id": chunk_id, "text": text, "source": source, "chunk_size": chunk_size, "start": start, "end": end}
+            for chunk_id, text, (start, end) in zip(chunk_ids, texts, offsets)
+        ]
+        with open(self.meta_path, "a", encoding="utf-8") as f:
+            f.write("".join(json.dumps(row) + "\n" for row in rows))
+        self.meta.extend(rows)
+        self._vectors = None
+
+    # rewrites the files without the given chunk ids
+    def delete(self, chunk_ids):
+        chunk_ids = set(chunk_ids)
+        keep = [i for i, row in enumerate(self.meta) if row["chunk_id"] not in chunk_ids]
+        if len(keep) == len(self.meta):
+            return
+        matrix = np.array(self.vectors[keep])
+        scales = self._scales[keep] if self.dtype == "int8" else None
+        meta = [self.meta[i] for i in keep]
+        self._vectors = None
+
+        with open(self.vectors_path + ".next", "wb") as f:
+            f.write(matrix.tobytes())
+        if scales is not None:
+            with open(self.scales_path + ".next", "wb") as f:
+                f.write(scales.tobytes())
+        with open(self.meta_path + ".partial", "w", encoding="utf-8") as f:
+            f.write("".join(json.dumps(row) + "\n" for row in meta))
+        os.replace(self.meta_path + ".partial", self.meta_path + ".next")
+        self._finish_rewrite()
+        self.meta = meta
+
+    # top-k for every row of query_matrix: one matrix product, argpartition, then a sort of just k scores.
+    # compact rows are widened to float32 SEARCH_BLOCK rows at a time so a search never holds a full float32 copy
+    def search(self, query_matrix, k=5):
+        queries = normalize(query_matrix)
+        vectors = self.vectors
+        if len(vectors) == 0:
+            return [[] for _ in range(len(queries))]
+        k = min(k, len(vectors))
+        if self.dtype == "float32":
+            scores = queries @ vectors.T
+        else:
+            scores = np.empty((len(queries), len(vectors)), dtype=np.float32)
+            for start in range(0, len(vectors), SEARCH_BLOCK):
+                block = vectors[start:start + SEARCH_BLOCK].astype(np.float32)
+                scores[:, start:start + SEARCH_BLOCK] = queries @ block.T
+            if self.dtype == "int8":
+                scores *= self._scales[None, :]
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        results = []
+        for q in range(len(queries)):
+            order = top[q][np.argsort(-scores[q, top[q]])]
+            results.append([
+                {**self.meta[i], "chunk_size": str(self.meta[i]["chunk_size"]), "vector_distance": float(1.0 - scores[q, i])}
+                for i in order
+            ])
+        return results
+
+
+# generates a directory name given model and size
+def get_index_name(model, chunk_size):
+    model_safe_name = model.replace('-', '_').replace(':', '_')
+    return f"{model_safe_name}_{chunk_size}"
+
+# generates the embedding and dimensions for embedding
+def get_embedding_and_dimensions(text, model):
+    embedding = embed_batch([text], model)[0].tolist()
+    return embedding, len(embedding)
+
+# creates an index for each embedding model and chunk size, existing ones are kept unless rebuild is set
+def create_indices(rebuild=False, directory=STORE_DIR, dtype=STORE_DTYPE):
+    sample_text = "This is a sample text to determine embedding dimensions."
+
+    for model in embedding_models:
+        # the probe is the full vector, indices are sized for the reduced one (see dim_reduction.py)
+        dim = reduced_dimension(model, len(embed_batch([sample_text], model, reduce=False)[0]))
+
+        for chunk_size in chunk_sizes:
+            index_dir = os.path.join(directory, get_index_name(model, chunk_size))
+            if rebuild and os.path.exists(index_dir):
+                shutil.rmtree(index_dir)
+            index = indices[(model, chunk_size)] = VectorIndex(index_dir, dim, dtype)
+            print(f"Index {get_index_name(model, chunk_size)} ready with {len(index)} {index.dtype} vectors of dimension {dim}")
+            # an empty index (e.g. ./numpy_store was deleted) holds none of the chunks the manifest remembers for it
+            if not rebuild and not len(index) and manifest.stored(model, chunk_size):
+                manifest.forget_combination(model, chunk_size)
+                manifest.save()
+                print(f"Index {get_index_name(model, chunk_size)} is empty, its chunks will be ingested again")
+
+    if rebuild:
+        manifest.clear()
+    # the index settings are part of the fingerprint cached answers are checked against (answer_cache.py)
+    settings = [
+        manifest.record_index(model, chunk_size, dim=indices[(model, chunk_size)].dim, vector_type=indices[(model, chunk_size)].dtype)
+        for model in embedding_models for chunk_size in chunk_sizes
+    ]
+    if any(settings):
+        manifest.save()
+
+# Store a batch of calculated embeddings in the index of the model and chunk size, offsets are the
+# (start, end) word offsets of each chunk in its source
+def store_embedding(model, chunk_size, texts, source, chunk_ids, embeddings, offsets=None):
+    index = indices.get((model, chunk_size))
+    if index is None:
+        raise ValueError(f"Index for {model} and chunk size {chunk_size} not initialized")
+    index.append(chunk_ids, texts, source, chunk_size, embeddings, offsets)
+    return list(chunk_ids)
+
+# store stage of the async ingest pipeline: appends run on a worker thread, one at a time per index
+# since an index appends to its files in place
+@asynccontextmanager
+async def pipeline_store():
+    locks = {key: asyncio.Lock() for key in indices}
+
+    async def store(batch, embeddings):
+        async with locks[(batch.model, batch.chunk_size)]:
+            return await asyncio.to_thread(
+                store_embedding,
+                model=batch.model,
+                chunk_size=batch.chunk_size,
+                texts=[chunk.text for chunk in batch.chunks],
+                source=batch.source,
+                chunk_ids=[chunk.chunk_id for chunk in batch.chunks],
+                embeddings=embeddings,
+                offsets=[(chunk.start, chunk.end) for chunk in batch.chunks]
+            )
+
+    yield store
+
+# deletes the stored chunks of a file, given {(model, chunk_size): chunk ids} from the manifest
+def delete_chunks(chunk_ids):
+    for (model, chunk_size), ids in chunk_ids.items():
+        index = indices.get((model, chunk_size))
+        if index is not None and ids:
+            index.delete(ids)
+
+# top-k for every row of a question embedding matrix, one result list per question
+def search_batch(embedding_model, chunk_size, question_matrix, k=5):
+    index = indices.get((embedding_model, chunk_size))
+    if index is None:
+        raise ValueError(f"Index for {embedding_model} and chunk size {chunk_size} not initialized")
+    return index.search(question_matrix, k)
+
+# extracts text from pdf using pypdf2
+def extract_text_from_pdf(pdf_path):
+    return extract_texts([pdf_path])[str(pdf_path)]
+
+# Ggenerates an answer to the question based on the embedding model, chunk size, and llm models,
+# results can be passed in when the chunks were already retrieved;
+# use_cache looks the question up in the semantic answer cache first (answer_cache.py)
+def answer_question(question, embedding_model, chunk_size, llm_model, k=5, results=None, stream=False, on_token=None, pack=False, question_embedding=None, use_cache=False):
+    if question_embedding is None and (results is None or use_cache):
+        with tracer.span("embed", model=embedding_model, chunks=1):
+            question_embedding, _ = get_embedding_and_dimensions(question, embedding_model)
+
+    # a close enough earlier question with the same embedding model, chunk size, llm, k and packing skips retrieval
+    # and the llm
+    if use_cache:
+        with tracer.span("cache", llm=llm_model, model=embedding_model, chunk_size=chunk_size) as span:
+            cached = answer_cache.lookup(embedding_model, chunk_size, llm_model, k, pack, question_embedding, manifest)
+            span["hit"] = cached is not None
+        if cached is not None:
+            if on_token:
+                on_token(cached)
+            return cached
+
+    if results is None:
+        with tracer.span("search", backend="numpy", model=embedding_model, chunk_size=chunk_size):
+            results = search_batch(embedding_model, chunk_size, [question_embedding], k)[0]
+
+    prompt_start = time.perf_counter()
+    hits = [make_hit(doc["text"], doc["source"], doc.get("start"), doc.get("end")) for doc in results]
+    context, packing = pack_context(hits, llm_model) if pack else join_hits(hits)
+
+    prompt = f"""
+    Context information:
+    {context}
+
+    Question: {question}
+
+    Answer based on the context. If the answer is unavailable, state it clearly.
+    """
+    tracer.record("prompt", time.perf_counter() - prompt_start, context_chars=len(context), packed=pack, **packing)
+
+    with tracer.span("generate", llm=llm_model, model=embedding_model, chunk_size=chunk_size, stream=stream) as span:
+        answer, stats = generate(prompt, llm_model, stream=stream, on_token=on_token)
+        span.update(stats)
+
+    if use_cache:
+        answer_cache.store(embedding_model, chunk_size, llm_model, k, pack, question, question_embedding, manifest, answer)
+
+    return answer
+
+# the serial loop: extract every pdf, then chunk, embed and store one file at a time
+def ingest_serially(pending):
+    with tracer.span("extract", files=len(pending)):
+        pages = extract_pages(pending) if pending else {}
+    fit_projections(embedding_models, pages, chunk_sizes)
+
+    for pdf_file in pending:
+        pdf_name = os.path.basename(str(pdf_file))
+        missing = [
+            (embedding_model, chunk_size) for embedding_model in embedding_models for chunk_size in chunk_sizes
+            if not manifest.has(pdf_name, embedding_model, chunk_size)
+        ]
+
+        # every missing chunk size comes out of one pass over the pages
+        sizes = sorted({chunk_size for _, chunk_size in missing})
+        with tracer.span("chunk", source=pdf_name, chunk_sizes=sizes) as span:
+            by_size = chunks_by_size(iter_chunks(pages.pop(str(pdf_file)), pdf_name, sizes), sizes)
+            span["chunks"] = sum(len(chunks) for chunks in by_size.values())
+        with tracer.span("dedupe", source=pdf_name) as span:
+            by_size, aliases = dedupe_index.filter(pdf_name, by_size)
+            span["skipped"] = sum(len(size_aliases) for size_aliases in aliases.values())
+
+        for embedding_model, chunk_size in missing:
+            chunks = [chunk.text for chunk in by_size[chunk_size]]
+            chunk_ids = [chunk.chunk_id for chunk in by_size[chunk_size]]
+            with tracer.span("embed", model=embedding_model, chunks=len(chunks)):
+                embeddings = embed_batch(chunks, embedding_model)
+
+            with tracer.span("store", backend="numpy", chunks=len(chunks)):
+                ids = store_embedding(
+                    model=embedding_model,
+                    chunk_size=chunk_size,
+                    texts=chunks,
+                    source=pdf_name,
+                    chunk_ids=chunk_ids,
+                    embeddings=embeddings,
+                    offsets=[(chunk.start, chunk.end) for chunk in by_size[chunk_size]]
+                )
+            manifest.record(pdf_name, embedding_model, chunk_size, ids)
+        for chunk_size, size_aliases in aliases.items():
+            manifest.record_aliases(pdf_name, chunk_size, size_aliases)
+        manifest.save()
+        dedupe_index.save()
+
+# the async pipeline (ingest_pipeline.py); a PCA that still has to be fitted needs every file's pages first
+def ingest_pipelined(pending, concurrency=None):
+    if any(needs_fit(model) for model in embedding_models):
+        fit_projections(embedding_models, extract_pages(pending), chunk_sizes)
+    IngestPipeline("numpy", manifest, dedupe_index, embedding_models, chunk_sizes, pipeline_store, concurrency).run(pending)
+
+# Processes all pdf files, chunks them, generates embedding and stores the embedding
+def process_pdf_files(folder_path, pipeline=False, concurrency=None):
+    pdf_files = list(Path(folder_path).glob('*.pdf'))
+    if not pdf_files:
+        print(f"No PDF files found in {folder_path}")
+        return
+
+    sync_manifest(manifest, pdf_files, delete_chunks)
+    dedupe_index.retain(manifest)
+    pending = [
+        pdf_file for pdf_file in pdf_files
+        if not all(manifest.has(pdf_file.name, model, size) for model in embedding_models for size in chunk_sizes)
+    ]
+    print(f"{len(pending)} of {len(pdf_files)} PDF files need to be ingested")
+    ingest_start = time.perf_counter()
+    if pipeline and pending:
+        ingest_pipelined(pending, concurrency)
+    else:
+        ingest_serially(pending)
+    seconds = time.perf_counter() - ingest_start
+    tracer.record("ingest", seconds, files=len(pending), pipeline=pipeline)
+    print(f"Ingested {len(pending)} PDF files in {seconds:.2f}s ({'pipeline' if pipeline else 'serial'})")
+
+    dedupe_index.print_stats()
+    print_embedding_throughput()
+    print_cache_stats()
+
+# Iterates over embedding, llm, and chunk size to answer all question for all combination,
+# the grid is scheduled so each llm is loaded once. Every answer goes to results.sqlite as soon as it is done,
+# cells already answered there with the same packing from the same index are skipped unless resume is False,
+# and the results file is rendered from it
+def all_combinations_question_answers(log_file="processed_data.txt", concurrency=LLM_CONCURRENCY, stream=False, pack=False, resume=True):
+    tracer.place_next_to(log_file)
+    partial_log = PartialAnswerLog(log_file, "numpy") if stream else None
+    results = ResultStore.next_to(log_file)
+    work = build_work_list(embedding_models, llm_models, chunk_sizes, questions)
+    todo = results.pending("numpy", work, manifest, packed=pack) if resume else work
+    print(f"{len(work) - len(todo)} of {len(work)} answers already in {results.path}, {len(todo)} to run")
+    plan = build_retrieval_plan(*grid_of(todo), search_batch) if todo else {}
+
+    def write_entry(log, item, result):
+        log.write(f"\nLLM\n{item.llm_model}\n")
+        log.write(f"Embedding\n{item.embedding_model}\n")
+        log.write(f"Chunk Sizes\n{item.chunk_size}\n\n")
+        log.write(f"Question\n{item.question}\n\n")
+        if result.error is None:
+            log.write(f"Answer\n{result.answer}\n")
+        else:
+            log.write(f"Answer\nError: {str(result.error)}\n")
+
+    # stored as soon as the cell finishes, so an interrupted run only loses the requests in flight
+    def record_result(item, result):
+        results.add("numpy", item, result, manifest, packed=pack, stream=stream)
+        if partial_log:
+            partial_log.discard(item)
+
+    def write_result(item, result):
+        if result.error is None:
+            print(f"✓ Answered question with {item.embedding_model} + {item.llm_model} + {item.chunk_size} in {result.seconds:.4f} seconds")
+        else:
+            print(f"Error processing: {result.error}")
+
+    # with stream set, tokens go to a partial file per answer (and to the terminal when running one at a time)
+    def run(item):
+        on_token = partial_log.writer(item, echo=concurrency == 1) if partial_log else None
+        try:
+            return answer_question(
+                question=item.question,
+                embedding_model=item.embedding_model,
+                chunk_size=item.chunk_size,
+                llm_model=item.llm_model,
+                results=plan.get((item.embedding_model, item.chunk_size, item.question)),
+                stream=stream,
+                on_token=on_token,
+                pack=pack
+            )
+        finally:
+            if on_token:
+                on_token.close()
+
+    # rendered even when the run is interrupted, so the file always has everything answered so far
+    try:
+        run_schedule(todo, run, write_result, concurrency, done_fn=record_result)
+    finally:
+        results.render(log_file, "numpy", work, write_entry, manifest, packed=pack)
+        results.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="RAG over ./Notes with an in-process NumPy vector store")
+    parser.add_argument("--rebuild", action="store_true", help="drop the indices and re-ingest every PDF")
+    parser.add_argument("--dedupe-threshold", type=float, default=DEDUPE_THRESHOLD, help="similarity above which a chunk is skipped as a near-duplicate")
+    parser.add_argument("--no-dedupe", action="store_true", help="embed every chunk, even near-duplicates")
+    parser.add_argument("--pipeline", action="store_true", help="ingest through the async extract/chunk/embed/store pipeline")
+    parser.add_argument("--stage-concurrency", nargs="+", metavar="STAGE=N", help="pipeline workers per stage, e.g. embed=8 store=4")
+    parser.add_argument("--dtype", choices=sorted(STORE_DTYPES), default=STORE_DTYPE, help="vector type of newly created indices")
+    parser.add_argument("--concurrency", type=int, default=LLM_CONCURRENCY, help="concurrent requests per loaded LLM")
+    parser.add_argument("--stream", action="store_true", help="stream answers, keeping partial output on disk")
+    parser.add_argument("--packing", action="store_true", help="merge overlapping chunks and cut the context to a per-llm token budget instead of sending the chunks verbatim")
+    parser.add_argument("--fresh", action="store_true", help="answer every combination again instead of skipping the ones already in results.sqlite")
+    args = parser.parse_args()
+    dedupe_index.threshold = None if args.no_dedupe else args.dedupe_threshold
+
+    try:
+        create_indices(rebuild=args.rebuild, dtype=args.dtype)
+        process_pdf_files("./Notes", pipeline=args.pipeline, concurrency=parse_concurrency(args.stage_concurrency))
+        all_combinations_question_answers(concurrency=args.concurrency, stream=args.stream, pack=args.packing, resume=not args.fresh)
+        tracer.print_summary()
+        print_generation_summary(tracer)
+        print_packing_summary(tracer)
+    except Exception as e:
+        print(f"Main execution failed with error: {str(e)}")
+
+
+if __name__ == "__main__":
+    main()
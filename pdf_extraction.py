@@ -0,0 +1,137 @@
+import asyncio
+import json
+import os
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+import PyPDF2
+from embedding_cache import CACHE_DIR
+
+TEXT_CACHE_PATH = os.path.join(CACHE_DIR, "pdf_text.sqlite")
+# every task has to open and parse the whole pdf again, so pdfs up to SPLIT_PAGES pages are extracted by one
+# worker in one pass (files already run in parallel), and longer ones are split into at most one range per
+# worker of at least MIN_PAGES_PER_TASK pages
+SPLIT_PAGES = 64
+MIN_PAGES_PER_TASK = 16
+
+
+# opens the page text cache, keyed by file path, size and mtime
+def _open_text_cache(path=None):
+    path = path or TEXT_CACHE_PATH
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    conn = sqlite3.connect(path)
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS pdf_text (
+            path TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            pages TEXT NOT NULL
+        )
+        """
+    )
+    return conn
+
+
+# pages in each range when a pdf of count pages is split across workers processes
+def _range_size(count, workers):
+    return count if count <= SPLIT_PAGES else max(MIN_PAGES_PER_TASK, -(-count // workers))
+
+
+# first task of a pdf, runs inside a worker process: returns (page count, text of the first range), which
+# is every page unless the pdf is longer than SPLIT_PAGES
+def _extract_head(pdf_path, workers):
+    with open(pdf_path, 'rb') as file:
+        pdf_reader = PyPDF2.PdfReader(file)
+        count = len(pdf_reader.pages)
+        return count, [pdf_reader.pages[i].extract_text() or "" for i in range(_range_size(count, workers))]
+
+
+# extracts the text of pages [start, end) of a pdf, runs inside a worker process
+def _extract_page_range(pdf_path, start, end):
+    with open(pdf_path, 'rb') as file:
+        pdf_reader = PyPDF2.PdfReader(file)
+        return [pdf_reader.pages[i].extract_text() or "" for i in range(start, end)]
+
+
+# (start, end) of the ranges left after the head of a pdf of count pages
+def _remaining_ranges(count, workers):
+    size = _range_size(count, workers)
+    return [(start, min(start + size, count)) for start in range(size, count, size)]
+
+
+# returns {pdf path: [page text, ...]} parsing each changed pdf once, long ones split across a process pool
+def extract_pages(pdf_paths, max_workers=None, cache_path=None):
+    pdf_paths = [str(path) for path in pdf_paths]
+    conn = _open_text_cache(cache_path)
+    pages = {}
+    stale = []
+
+    for path in pdf_paths:
+        stat = os.stat(path)
+        row = conn.execute("SELECT size, mtime_ns, pages FROM pdf_text WHERE path = ?", (path,)).fetchone()
+        if row and row[0] == stat.st_size and row[1] == stat.st_mtime_ns:
+            pages[path] = json.loads(row[2])
+        else:
+            stale.append((path, stat))
+
+    if stale:
+        workers = max_workers or os.cpu_count() or 1
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            heads = {path: pool.submit(_extract_head, path, workers) for path, _ in stale}
+            tasks = {}
+            for path, _ in stale:
+                count, head = heads[path].result()
+                tasks[path] = (head, [
+                    pool.submit(_extract_page_range, path, start, end) for start, end in _remaining_ranges(count, workers)
+                ])
+            for path, stat in stale:
+                head, ranges = tasks[path]
+                pages[path] = head + [text for task in ranges for text in task.result()]
+                conn.execute(
+                    "INSERT OR REPLACE INTO pdf_text (path, size, mtime_ns, pages) VALUES (?, ?, ?, ?)",
+                    (path, stat.st_size, stat.st_mtime_ns, json.dumps(pages[path])),
+                )
+        conn.commit()
+        print(f"Extracted {len(stale)} PDF(s), {len(pdf_paths) - len(stale)} loaded from the text cache")
+
+    conn.close()
+    return {path: pages[path] for path in pdf_paths}
+
+
+# async extraction of a single pdf for the ingest pipeline: same text cache, page ranges run on the given
+# process pool so several files can be parsed while the event loop keeps the other stages going
+async def extract_pages_async(pdf_path, pool, cache_path=None):
+    path = str(pdf_path)
+    loop = asyncio.get_running_loop()
+    stat = os.stat(path)
+    conn = _open_text_cache(cache_path)
+    try:
+        row = conn.execute("SELECT size, mtime_ns, pages FROM pdf_text WHERE path = ?", (path,)).fetchone()
+        if row and row[0] == stat.st_size and row[1] == stat.st_mtime_ns:
+            return json.loads(row[2])
+
+        workers = os.cpu_count() or 1
+        count, head = await loop.run_in_executor(pool, _extract_head, path, workers)
+        ranges = await asyncio.gather(*(
+            loop.run_in_executor(pool, _extract_page_range, path, start, end)
+            for start, end in _remaining_ranges(count, workers)
+        ))
+        pages = head + [text for texts in ranges for text in texts]
+        conn.execute(
+            "INSERT OR REPLACE INTO pdf_text (path, size, mtime_ns, pages) VALUES (?, ?, ?, ?)",
+            (path, stat.st_size, stat.st_mtime_ns, json.dumps(pages)),
+        )
+        conn.commit()
+        return pages
+    finally:
+        conn.close()
+
+
+# joins page texts the same way extract_text_from_pdf always has
+def pages_to_text(pages):
+    return "".join([page + " " for page in pages])
+
+
+# returns {pdf path: full text} for a list of pdfs
+def extract_texts(pdf_paths, max_workers=None):
+    return {path: pages_to_text(pages) for path, pages in extract_pages(pdf_paths, max_workers).items()}
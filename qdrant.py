@@ -1,16 +1,63 @@
 import os
 from pathlib import Path
 import numpy as np
-import ollama
-import PyPDF2
+from pdf_extraction import extract_pages, extract_texts
+from chunking import iter_chunks, chunks_by_size
+from dim_reduction import reduced_dimension, fit_projections, needs_fit
+from embedding_cache import print_cache_stats
+from batch_embedding import embed_batch, print_embedding_throughput
+from manifest import IngestManifest, sync_manifest
+from dedupe import DEDUPE_THRESHOLD, DedupeIndex
+from answer_cache import AnswerCache
+from ingest_pipeline import IngestPipeline, parse_concurrency
+from scheduler import LLM_CONCURRENCY, build_work_list, grid_of, run_schedule
+from results_store import ResultStore
+from retrieval_plan import build_retrieval_plan
+from tracing import tracer
+from generation import generate, PartialAnswerLog, print_generation_summary
+from context_packing import make_hit, pack_context, join_hits, print_packing_summary
+import argparse
+import asyncio
 import time
-from qdrant_client import QdrantClient
-from qdrant_client.models import Distance, VectorParams, CollectionStatus, PointStruct
+import uuid
+from contextlib import asynccontextmanager
+from qdrant_client import QdrantClient, AsyncQdrantClient
+from qdrant_client.models import (
+    Distance, VectorParams, CollectionStatus, PointStruct, PointIdsList,
+    PayloadSchemaType, Filter, FieldCondition, MatchValue, QueryRequest, PointVectors, Prefetch, FusionQuery, Fusion,
+    ScalarQuantization, ScalarQuantizationConfig, ScalarType, Disabled, SearchParams, QuantizationSearchParams,
+    HnswConfigDiff, OptimizersConfigDiff, DenseVectorNameConfig, DenseVectorConfig
+)
 
-client = QdrantClient(host="localhost", port=6333)
+QDRANT_HOST = "localhost"
+QDRANT_PORT = 6333
+client = QdrantClient(host=QDRANT_HOST, port=QDRANT_PORT)
+manifest = IngestManifest("qdrant")
+dedupe_index = DedupeIndex("qdrant")
+answer_cache = AnswerCache("qdrant")
 
 DOC_PREFIX = "doc:"
+# every chunk is one point of this collection, with one named vector per embedding model (vector_name)
+COLLECTION_NAME = "notes"
+# payload fields with an index, so filters on them don't scan the payloads
+PAYLOAD_INDEXES = {"source": PayloadSchemaType.KEYWORD, "chunk_size": PayloadSchemaType.INTEGER}
+# candidates each model's prefetch hands to the fusion in fused_search, as a multiple of k
+FUSION_CANDIDATES = 4
 DISTANCE_METRIC = Distance.COSINE
+UPSERT_BATCH_SIZE = 256
+UPSERT_PARALLEL = 1
+# HNSW graph degree and build-time candidate list size (qdrant's defaults); HNSW_EF is the query-time
+# candidate list size, None lets qdrant use ef_construct. Qdrant only builds the graph once a segment passes
+# its indexing threshold, smaller collections are searched exactly
+HNSW_M = 16
+HNSW_EF_CONSTRUCT = 100
+HNSW_EF = None
+# seconds wait_for_index waits for the graph to be built
+INDEX_WAIT_TIMEOUT = 600
+# int8 scalar quantization keeps a 4x smaller copy of the vectors in RAM (originals move to disk),
+# search runs on the int8 copy and rescores the top OVERSAMPLING * k candidates with the originals
+QUANTIZATION_QUANTILE = 0.99
+QUANTIZATION_OVERSAMPLING = 2.0
 
 # Embedding models, LLMs, and chunk sizes
 embedding_models = ["paraphrase-multilingual", "nomic-embed-text", "all-minilm:33m"]
@@ -26,80 +73,415 @@ questions = ["What are pros and cons of different data structures for storing an
              ]
 
 
+# name of a model's vector on the points, e.g. nomic-embed-text -> nomic_embed_text
+def vector_name(model):
+    return model.replace('-', '_').replace(':', '_')
+
 # generates the embedding and dimensions for the embedding
 def get_embedding_and_dimensions(text, model):
-    response = ollama.embeddings(model=model, prompt=text)
-    embedding = response["embedding"]
+    embedding = embed_batch([text], model)[0].tolist()
     return embedding, len(embedding)
 
-# creates the index in qdrant
-def create_indices():
+# int8 scalar quantization config for a collection
+def scalar_quantization():
+    return ScalarQuantization(
+        scalar=ScalarQuantizationConfig(type=ScalarType.INT8, quantile=QUANTIZATION_QUANTILE, always_ram=True)
+    )
+
+# rescoring only applies to quantized collections, qdrant ignores it on the others
+def search_params():
+    return SearchParams(
+        hnsw_ef=HNSW_EF,
+        quantization=QuantizationSearchParams(rescore=True, oversampling=QUANTIZATION_OVERSAMPLING)
+    )
+
+# creates the collection in qdrant, an existing one is kept unless rebuild is set (see sync_vector_names for a
+# changed set of embedding models); quantize turns int8 quantization on (or off) and m/ef_construct set the HNSW
+# graph of a new or existing collection (qdrant rebuilds the graph in the background when they change).
+# indexing_threshold (KB of vectors) makes a new collection build its graph, and filtered searches use it,
+# even when it is smaller than qdrant's thresholds, as the HNSW benchmark needs
+def create_indices(rebuild=False, quantize=False, m=HNSW_M, ef_construct=HNSW_EF_CONSTRUCT, indexing_threshold=None):
     sample_text = "This is a sample text to determine embedding dimensions."
     model_dimensions = {}
 
     for model in embedding_models:
-        _, dim = get_embedding_and_dimensions(sample_text, model)
-        model_dimensions[model] = dim
-
-        collection_name = model.replace('-', '_').replace(':', '_')
-        
-        existing_collections = client.get_collections().collections
-        if any(c.name == collection_name for c in existing_collections):
-            client.delete_collection(collection_name)
-        
+        # the probe is the full vector, indices are sized for the reduced one (see dim_reduction.py)
+        dim = reduced_dimension(model, len(embed_batch([sample_text], model, reduce=False)[0]))
+        model_dimensions[vector_name(model)] = dim
+    
+    existing_collections = client.get_collections().collections
+    exists = any(c.name == COLLECTION_NAME for c in existing_collections)
+    if exists and not rebuild:
+        config = client.get_collection(COLLECTION_NAME).config
+        rebuild = not sync_vector_names(config, model_dimensions)
+    if exists and rebuild:
+        client.delete_collection(COLLECTION_NAME)
+    
+    if exists and not rebuild:
+        print(f"Collection {COLLECTION_NAME} already exists, reusing it")
+        if (config.hnsw_config.m, config.hnsw_config.ef_construct) != (m, ef_construct):
+            client.update_collection(
+                collection_name=COLLECTION_NAME,
+                hnsw_config=HnswConfigDiff(m=m, ef_construct=ef_construct)
+            )
+            print(f"Updated HNSW of {COLLECTION_NAME} to m={m}, ef_construct={ef_construct}")
+        quantized = config.quantization_config is not None
+        if quantized != quantize:
+            client.update_collection(
+                collection_name=COLLECTION_NAME,
+                quantization_config=scalar_quantization() if quantize else Disabled.DISABLED
+            )
+            print(f"Turned int8 quantization {'on' if quantize else 'off'} for {COLLECTION_NAME}")
+    else:
         client.create_collection(
-            collection_name=collection_name,
-            vectors_config=VectorParams(size=dim, distance=DISTANCE_METRIC)
+            collection_name=COLLECTION_NAME,
+            vectors_config={
+                name: VectorParams(size=dim, distance=DISTANCE_METRIC, on_disk=quantize)
+                for name, dim in model_dimensions.items()
+            },
+            hnsw_config=HnswConfigDiff(m=m, ef_construct=ef_construct, full_scan_threshold=indexing_threshold),
+            optimizers_config=OptimizersConfigDiff(indexing_threshold=indexing_threshold) if indexing_threshold is not None else None,
+            quantization_config=scalar_quantization() if quantize else None
+        )
+    
+    # lets query_points filter on chunk_size (and deletes on source) server side without scanning payloads
+    for field_name, field_schema in PAYLOAD_INDEXES.items():
+        client.create_payload_index(
+            collection_name=COLLECTION_NAME,
+            field_name=field_name,
+            field_schema=field_schema
+        )
+
+    # a new collection has none of the chunks the manifest remembers
+    if rebuild or not exists:
+        manifest.clear()
+    # the index settings are part of the fingerprint cached answers are checked against (answer_cache.py)
+    settings = [
+        manifest.record_index(
+            model, chunk_size, dim=model_dimensions[vector_name(model)], vector_type="int8" if quantize else "float32",
+            m=m, ef_construct=ef_construct, hnsw_ef=HNSW_EF
         )
+        for model in embedding_models for chunk_size in chunk_sizes
+    ]
+    if any(settings):
+        manifest.save()
 
-# store the calculated embedding in qdrant
-def store_embedding(model, doc_id, text, source, chunk_id, chunk_size, embedding):
-    collection_name = model.replace('-', '_').replace(':', '_')
-    client.upsert(
-        collection_name=collection_name,
-        points=[
-            PointStruct(
-                id=doc_id,
-                vector=embedding,
-                payload={
-                    "text": text,
-                    "source": source,
-                    "chunk_id": chunk_id,
-                    "chunk_size": chunk_size
-                }
+# adds the named vectors of new embedding models to an existing collection and removes those of models no
+# longer used, so only the new models are embedded and stored (store_embeddings updates the existing points).
+# Returns False when the collection has to be rebuilt instead: a model's dimension changed, or the server
+# can't add vectors to a collection
+def sync_vector_names(config, model_dimensions):
+    vectors = config.params.vectors if isinstance(config.params.vectors, dict) else {}
+    stored = {name: params.size for name, params in vectors.items()}
+    if any(stored[name] != dim for name, dim in model_dimensions.items() if name in stored):
+        print(f"An embedding model of {COLLECTION_NAME} changed dimension, rebuilding it")
+        return False
+    
+    for model in embedding_models:
+        name = vector_name(model)
+        if name in stored:
+            continue
+        try:
+            client.create_vector_name(
+                collection_name=COLLECTION_NAME,
+                vector_name=name,
+                vector_name_config=DenseVectorNameConfig(
+                    dense=DenseVectorConfig(size=model_dimensions[name], distance=DISTANCE_METRIC)
+                )
             )
-        ]
-    )
+        except Exception as e:
+            print(f"Could not add vector {name} to {COLLECTION_NAME} ({e}), rebuilding it")
+            return False
+        for chunk_size in chunk_sizes:
+            manifest.forget_combination(model, chunk_size)
+        print(f"Added vector {name} to {COLLECTION_NAME}, only {model} will be embedded")
+    
+    for name in set(stored) - set(model_dimensions):
+        client.delete_vector_name(collection_name=COLLECTION_NAME, vector_name=name)
+        for source in list(manifest.files):
+            for model, chunk_size in manifest.chunk_ids(source):
+                if vector_name(model) == name:
+                    manifest.forget_combination(model, chunk_size)
+        print(f"Removed vector {name} of a model no longer used from {COLLECTION_NAME}")
+    if set(stored) != set(model_dimensions):
+        manifest.save()
+    return True
+
+# blocks until qdrant has built the graph over every point (the collection is green and all vectors are
+# indexed); only finishes for collections past their indexing threshold, see create_indices
+def wait_for_index(timeout=INDEX_WAIT_TIMEOUT):
+    deadline = time.time() + timeout
+    while True:
+        info = client.get_collection(COLLECTION_NAME)
+        if info.status == CollectionStatus.GREEN and (info.indexed_vectors_count or 0) >= (info.points_count or 0):
+            return
+        if time.time() > deadline:
+            raise TimeoutError(f"{COLLECTION_NAME} was not indexed after {timeout}s (status {info.status})")
+        time.sleep(0.05)
+
+# collections of the old layout (one per embedding model, each with its own copy of the payloads) that are
+# still on the server; nothing reads them anymore
+def legacy_collections():
+    names = {vector_name(model) for model in embedding_models}
+    return [c.name for c in client.get_collections().collections if c.name in names]
+
+# qdrant only accepts integers or uuids as point ids, so derive a stable uuid from the chunk id
+def point_id(chunk_id):
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, chunk_id))
+
+# store the calculated embeddings of one chunk in qdrant, vectors is {model: embedding}
+def store_embedding(doc_id, text, source, chunk_id, chunk_size, vectors):
+    return store_embeddings([doc_id], [text], source, [chunk_id], chunk_size, {model: [embedding] for model, embedding in vectors.items()})[0]
+
+# points of a batch of chunks, one named vector per model in vectors ({model: embeddings}) and the chunk's
+# word offsets in its source in the payload
+def build_points(doc_ids, texts, source, chunk_ids, chunk_size, vectors, offsets=None):
+    offsets = offsets or [(None, None)] * len(doc_ids)
+    return [
+        PointStruct(
+            id=doc_id,
+            vector={vector_name(model): embeddings[i] for model, embeddings in vectors.items()},
+            payload={
+                "text": text,
+                "source": source,
+                "chunk_id": chunk_id,
+                "chunk_size": chunk_size,
+                "start": start,
+                "end": end
+            }
+        )
+        for i, (doc_id, text, chunk_id, (start, end)) in enumerate(zip(doc_ids, texts, chunk_ids, offsets))
+    ]
+
+# the vectors of models added to points that already exist, their payloads stay as they are
+def build_point_vectors(doc_ids, vectors):
+    return [
+        PointVectors(id=doc_id, vector={vector_name(model): embeddings[i] for model, embeddings in vectors.items()})
+        for i, doc_id in enumerate(doc_ids)
+    ]
+
+# the chunks of a file and chunk size are already points when another model's vectors were stored for them
+def has_points(source, chunk_size):
+    return any(manifest.has(source, model, chunk_size) for model in embedding_models)
+
+# the ids of doc_ids that are points of the collection; a chunk the other models skipped (a duplicate under the
+# dedupe threshold of an earlier run) has none yet, even when has_points is true for its file and chunk size
+def existing_points(doc_ids):
+    existing = set()
+    for start in range(0, len(doc_ids), UPSERT_BATCH_SIZE):
+        points = client.retrieve(COLLECTION_NAME, ids=doc_ids[start:start + UPSERT_BATCH_SIZE], with_payload=False, with_vectors=False)
+        existing.update(str(point.id) for point in points)
+    return existing
+
+# the rows of vectors ({model: embeddings}) at indices
+def pick_vectors(vectors, indices):
+    return {model: [embeddings[i] for i in indices] for model, embeddings in vectors.items()}
+
+# vectors ({model: embeddings} of texts) completed with the models it lacks, for chunks that become new points
+def with_every_model(texts, vectors):
+    return {
+        **vectors,
+        **{model: embed_batch(texts, model).tolist() for model in embedding_models if model not in vectors}
+    }
+
+# store a batch of chunks in qdrant with the vectors of every model in vectors ({model: embeddings}), split into
+# UPSERT_BATCH_SIZE upserts (UPSERT_PARALLEL workers); update adds the vectors to the points that exist instead,
+# the chunks without a point are stored as new points with the vectors of every model
+def store_embeddings(doc_ids, texts, source, chunk_ids, chunk_size, vectors, offsets=None, update=False):
+    ids = list(doc_ids)
+    offsets = offsets or [(None, None)] * len(doc_ids)
+    new = range(len(doc_ids))
+    if update:
+        existing = existing_points(doc_ids)
+        old = [i for i, doc_id in enumerate(doc_ids) if doc_id in existing]
+        new = [i for i, doc_id in enumerate(doc_ids) if doc_id not in existing]
+        for start in range(0, len(old), UPSERT_BATCH_SIZE):
+            batch = old[start:start + UPSERT_BATCH_SIZE]
+            client.update_vectors(
+                collection_name=COLLECTION_NAME,
+                points=build_point_vectors([doc_ids[i] for i in batch], pick_vectors(vectors, batch)),
+                wait=True
+            )
+        vectors = with_every_model([texts[i] for i in new], pick_vectors(vectors, new)) if new else {}
+        doc_ids, texts, chunk_ids, offsets = ([values[i] for i in new] for values in (doc_ids, texts, chunk_ids, offsets))
+    if new:
+        client.upload_points(
+            collection_name=COLLECTION_NAME,
+            points=build_points(doc_ids, texts, source, chunk_ids, chunk_size, vectors, offsets),
+            batch_size=UPSERT_BATCH_SIZE,
+            parallel=UPSERT_PARALLEL,
+            wait=True
+        )
+    return ids
+
+# store stage of the async ingest pipeline: the batches of the same chunks for each missing model are held
+# until the last one arrives, then written as one upsert through AsyncQdrantClient (existing points get the
+# vectors added, chunks without a point are upserted with every model's vectors as store_embeddings does)
+@asynccontextmanager
+async def pipeline_store():
+    async_client = AsyncQdrantClient(host=QDRANT_HOST, port=QDRANT_PORT)
+    waiting = {}
+    
+    async def store(batch, embeddings):
+        chunk_ids = [chunk.chunk_id for chunk in batch.chunks]
+        doc_ids = [point_id(chunk_id) for chunk_id in chunk_ids]
+        models = [model for model in embedding_models if not manifest.has(batch.source, model, batch.chunk_size)]
+        vectors = waiting.setdefault((batch.source, batch.chunk_size, batch.part), {})
+        vectors[batch.model] = embeddings.tolist()
+        if len(vectors) < len(models):
+            return doc_ids
+        
+        del waiting[(batch.source, batch.chunk_size, batch.part)]
+        new = range(len(doc_ids))
+        if has_points(batch.source, batch.chunk_size):
+            points = await async_client.retrieve(COLLECTION_NAME, ids=doc_ids, with_payload=False, with_vectors=False)
+            existing = {str(point.id) for point in points}
+            old = [i for i, doc_id in enumerate(doc_ids) if doc_id in existing]
+            new = [i for i, doc_id in enumerate(doc_ids) if doc_id not in existing]
+            if old:
+                await async_client.update_vectors(
+                    collection_name=COLLECTION_NAME,
+                    points=build_point_vectors([doc_ids[i] for i in old], pick_vectors(vectors, old)),
+                    wait=True
+                )
+            if new:
+                texts = [batch.chunks[i].text for i in new]
+                vectors = await asyncio.to_thread(with_every_model, texts, pick_vectors(vectors, new))
+        if new:
+            chunks = [batch.chunks[i] for i in new]
+            await async_client.upsert(
+                collection_name=COLLECTION_NAME,
+                points=build_points(
+                    [doc_ids[i] for i in new], [chunk.text for chunk in chunks], batch.source,
+                    [chunk.chunk_id for chunk in chunks], batch.chunk_size, vectors,
+                    [(chunk.start, chunk.end) for chunk in chunks]
+                ),
+                wait=True
+            )
+        return doc_ids
+    
+    try:
+        yield store
+    finally:
+        await async_client.close()
+
+# filter that keeps only the points of one chunk size
+def chunk_size_filter(chunk_size):
+    return Filter(must=[FieldCondition(key="chunk_size", match=MatchValue(value=chunk_size))])
+
+# deletes the stored points of a file, given {(model, chunk_size): point ids} from the manifest; the models
+# of a chunk size share their points
+def delete_chunks(chunk_ids):
+    ids = list(dict.fromkeys(point for points in chunk_ids.values() for point in points))
+    if ids:
+        client.delete(collection_name=COLLECTION_NAME, points_selector=PointIdsList(points=ids))
 
 #extracts text from pdf using pypdf2
 def extract_text_from_pdf(pdf_path):
-    with open(pdf_path, 'rb') as file:
-        pdf_reader = PyPDF2.PdfReader(file)
-        text = "".join([page.extract_text() + " " for page in pdf_reader.pages])
-    return text
-
-# creates a chunks of the texts with overlaps (half of chunks)
-def chunk_text(text, chunk_size=100):
-    words = text.split()
-    chunks = []
-    for i in range(0, len(words), chunk_size // 2):
-        chunk_end = min(i + chunk_size, len(words))
-        chunks.append(" ".join(words[i:chunk_end]))
-    return chunks
-
-# Ggenerates an answer to the question based on the embedding model, chunk size, and llm models
-def answer_question(question, embedding_model, chunk_size, llm_model, k=5):
-    question_embedding, _ = get_embedding_and_dimensions(question, embedding_model)
-    collection_name = embedding_model.replace('-', '_').replace(':', '_')
-    
-    search_results = client.query_points(
-        collection_name=collection_name,
-        query=question_embedding,
+    return extract_texts([pdf_path])[str(pdf_path)]
+
+# runs the filtered top-k for every row of a question embedding matrix in one query_batch_points call
+def search_batch(embedding_model, chunk_size, question_matrix, k=5):
+    responses = client.query_batch_points(
+        collection_name=COLLECTION_NAME,
+        requests=[
+            QueryRequest(
+                query=question_embedding,
+                using=vector_name(embedding_model),
+                filter=chunk_size_filter(chunk_size),
+                params=search_params(),
+                limit=k,
+                with_payload=True
+            )
+            for question_embedding in question_matrix.tolist()
+        ]
+    )
+    return [response.points for response in responses]
+
+# the top-k of every model in one query_batch_points call, question_embeddings is {model: embedding};
+# returns {model: hits}
+def search_models(question_embeddings, chunk_size, k=5):
+    responses = client.query_batch_points(
+        collection_name=COLLECTION_NAME,
+        requests=[
+            QueryRequest(
+                query=list(embedding),
+                using=vector_name(model),
+                filter=chunk_size_filter(chunk_size),
+                params=search_params(),
+                limit=k,
+                with_payload=True
+            )
+            for model, embedding in question_embeddings.items()
+        ]
+    )
+    return {model: response.points for model, response in zip(question_embeddings, responses)}
+
+# one query across models: each model's vector prefetches its candidates and qdrant merges the lists with
+# reciprocal rank fusion, so chunks several models agree on come first
+def fused_search(question_embeddings, chunk_size, k=5):
+    return client.query_points(
+        collection_name=COLLECTION_NAME,
+        prefetch=[
+            Prefetch(
+                query=list(embedding),
+                using=vector_name(model),
+                filter=chunk_size_filter(chunk_size),
+                params=search_params(),
+                limit=k * FUSION_CANDIDATES
+            )
+            for model, embedding in question_embeddings.items()
+        ],
+        query=FusionQuery(fusion=Fusion.RRF),
         limit=k,
         with_payload=True
     ).points
+
+# prints each model's top-k for a question and the fused top-k, all chunks of one size
+def compare_models(question, chunk_size, k=5):
+    question_embeddings = {model: embed_batch([question], model)[0].tolist() for model in embedding_models}
+    for model, hits in [*search_models(question_embeddings, chunk_size, k).items(), ("fused", fused_search(question_embeddings, chunk_size, k))]:
+        print(f"\n{model}:")
+        for hit in hits:
+            print(f"  {hit.score:.4f}  {hit.payload['chunk_id']}  {hit.payload['text'][:80]}")
+
+# Ggenerates an answer to the question based on the embedding model, chunk size, and llm models,
+# search_results can be passed in when the chunks were already retrieved;
+# use_cache looks the question up in the semantic answer cache first (answer_cache.py)
+def answer_question(question, embedding_model, chunk_size, llm_model, k=5, search_results=None, stream=False, on_token=None, pack=False, question_embedding=None, use_cache=False):
+    if question_embedding is None and (search_results is None or use_cache):
+        with tracer.span("embed", model=embedding_model, chunks=1):
+            question_embedding, _ = get_embedding_and_dimensions(question, embedding_model)
     
-    context = "\n".join([hit.payload["text"] for hit in search_results if hit.payload["chunk_size"] == chunk_size])
+    # a close enough earlier question with the same embedding model, chunk size, llm, k and packing skips retrieval
+    # and the llm
+    if use_cache:
+        with tracer.span("cache", llm=llm_model, model=embedding_model, chunk_size=chunk_size) as span:
+            cached = answer_cache.lookup(embedding_model, chunk_size, llm_model, k, pack, question_embedding, manifest)
+            span["hit"] = cached is not None
+        if cached is not None:
+            if on_token:
+                on_token(cached)
+            return cached
+    
+    if search_results is None:
+        with tracer.span("search", backend="qdrant", model=embedding_model, chunk_size=chunk_size):
+            search_results = client.query_points(
+                collection_name=COLLECTION_NAME,
+                query=question_embedding,
+                using=vector_name(embedding_model),
+                query_filter=chunk_size_filter(chunk_size),
+                search_params=search_params(),
+                limit=k,
+                with_payload=True
+            ).points
+    
+    prompt_start = time.perf_counter()
+    hits = [
+        make_hit(hit.payload["text"], hit.payload["source"], hit.payload.get("start"), hit.payload.get("end"))
+        for hit in search_results
+    ]
+    context, packing = pack_context(hits, llm_model) if pack else join_hits(hits)
     
     prompt = f"""
     Context information:
@@ -109,78 +491,195 @@ def answer_question(question, embedding_model, chunk_size, llm_model, k=5):
     
     Answer based on the context. If the answer is unavailable, state it clearly.
     """
+    tracer.record("prompt", time.perf_counter() - prompt_start, context_chars=len(context), packed=pack, **packing)
     
-    response = ollama.chat(
-        model=llm_model,
-        messages=[{"role": "user", "content": prompt}]
-    )
+    with tracer.span("generate", llm=llm_model, model=embedding_model, chunk_size=chunk_size, stream=stream) as span:
+        answer, stats = generate(prompt, llm_model, stream=stream, on_token=on_token)
+        span.update(stats)
     
-    return response["message"]["content"]
+    if use_cache:
+        answer_cache.store(embedding_model, chunk_size, llm_model, k, pack, question, question_embedding, manifest, answer)
+    
+    return answer
+
+# the serial loop: extract every pdf, then chunk, embed and store one file at a time
+def ingest_serially(pending):
+    with tracer.span("extract", files=len(pending)):
+        pages = extract_pages(pending) if pending else {}
+    fit_projections(embedding_models, pages, chunk_sizes)
+    
+    for pdf_file in pending:
+        pdf_name = os.path.basename(str(pdf_file))
+        missing = [
+            (embedding_model, chunk_size) for embedding_model in embedding_models for chunk_size in chunk_sizes
+            if not manifest.has(pdf_name, embedding_model, chunk_size)
+        ]
+        
+        # every missing chunk size comes out of one pass over the pages
+        sizes = sorted({chunk_size for _, chunk_size in missing})
+        with tracer.span("chunk", source=pdf_name, chunk_sizes=sizes) as span:
+            by_size = chunks_by_size(iter_chunks(pages.pop(str(pdf_file)), pdf_name, sizes), sizes)
+            span["chunks"] = sum(len(chunks) for chunks in by_size.values())
+        with tracer.span("dedupe", source=pdf_name) as span:
+            by_size, aliases = dedupe_index.filter(pdf_name, by_size)
+            span["skipped"] = sum(len(size_aliases) for size_aliases in aliases.values())
+        
+        # each chunk is stored once, with the vectors of every missing model
+        for chunk_size in sizes:
+            models = [embedding_model for embedding_model, size in missing if size == chunk_size]
+            chunks = [chunk.text for chunk in by_size[chunk_size]]
+            chunk_ids = [chunk.chunk_id for chunk in by_size[chunk_size]]
+            vectors = {}
+            for embedding_model in models:
+                print(f"Model: {embedding_model}, Chunk size {chunk_size}: {len(chunks)} chunks from {pdf_name}")
+                with tracer.span("embed", model=embedding_model, chunks=len(chunks)):
+                    vectors[embedding_model] = embed_batch(chunks, embedding_model).tolist()
+            
+            with tracer.span("store", backend="qdrant", chunks=len(chunks), models=len(models)):
+                ids = store_embeddings(
+                    doc_ids=[point_id(chunk_id) for chunk_id in chunk_ids],
+                    texts=chunks,
+                    source=pdf_name,
+                    chunk_ids=chunk_ids,
+                    chunk_size=chunk_size,
+                    vectors=vectors,
+                    offsets=[(chunk.start, chunk.end) for chunk in by_size[chunk_size]],
+                    update=has_points(pdf_name, chunk_size)
+                )
+            for embedding_model in models:
+                manifest.record(pdf_name, embedding_model, chunk_size, ids)
+        for chunk_size, size_aliases in aliases.items():
+            manifest.record_aliases(pdf_name, chunk_size, size_aliases)
+        manifest.save()
+        dedupe_index.save()
+
+# the async pipeline (ingest_pipeline.py); a PCA that still has to be fitted needs every file's pages first
+def ingest_pipelined(pending, concurrency=None):
+    if any(needs_fit(model) for model in embedding_models):
+        fit_projections(embedding_models, extract_pages(pending), chunk_sizes)
+    IngestPipeline("qdrant", manifest, dedupe_index, embedding_models, chunk_sizes, pipeline_store, concurrency).run(pending)
 
 # Processes all pdf files, chunks them, generates embedding and stores the embedding
-def process_pdf_files(folder_path):
+def process_pdf_files(folder_path, pipeline=False, concurrency=None):
     pdf_files = list(Path(folder_path).glob('*.pdf'))
     if not pdf_files:
         print(f"No PDF files found in {folder_path}")
         return
+
+    sync_manifest(manifest, pdf_files, delete_chunks)
+    dedupe_index.retain(manifest)
+    pending = [
+        pdf_file for pdf_file in pdf_files
+        if not all(manifest.has(pdf_file.name, model, size) for model in embedding_models for size in chunk_sizes)
+    ]
+    print(f"{len(pending)} of {len(pdf_files)} PDF files need to be ingested")
+    ingest_start = time.perf_counter()
+    if pipeline and pending:
+        ingest_pipelined(pending, concurrency)
+    else:
+        ingest_serially(pending)
+    seconds = time.perf_counter() - ingest_start
+    tracer.record("ingest", seconds, files=len(pending), pipeline=pipeline)
+    print(f"Ingested {len(pending)} PDF files in {seconds:.2f}s ({'pipeline' if pipeline else 'serial'})")
+
+    dedupe_index.print_stats()
+    print_embedding_throughput()
+    print_cache_stats()
+
+# Iterates over embedding, llm, and chunk size to answer all question for all combination for qdrant,
+# the grid is scheduled so each llm is loaded once. Every answer goes to results.sqlite as soon as it is done,
+# cells already answered there with the same packing from the same index are skipped unless resume is False,
+# and the results file is rendered from it
+def all_combinations_question_answers(log_file="processed_data.txt", concurrency=LLM_CONCURRENCY, stream=False, pack=False, resume=True):
+    tracer.place_next_to(log_file)
+    partial_log = PartialAnswerLog(log_file, "qdrant") if stream else None
+    results = ResultStore.next_to(log_file)
+    work = build_work_list(embedding_models, llm_models, chunk_sizes, questions)
+    todo = results.pending("qdrant", work, manifest, packed=pack) if resume else work
+    print(f"{len(work) - len(todo)} of {len(work)} answers already in {results.path}, {len(todo)} to run")
+    plan = build_retrieval_plan(*grid_of(todo), search_batch) if todo else {}
     
-    doc_id_counter = 0
-    for embedding_model in embedding_models:
-        for pdf_file in pdf_files:
-            pdf_name = os.path.basename(str(pdf_file))
-            text = extract_text_from_pdf(str(pdf_file))
-            
-            for chunk_size in chunk_sizes:
-                chunks = chunk_text(text, chunk_size)
-                print(f"Model: {embedding_model}, Chunk size {chunk_size}: {len(chunks)} chunks from {pdf_name}")
-                
-                for i, chunk in enumerate(chunks):
-                    embedding, _ = get_embedding_and_dimensions(chunk, embedding_model)
-                    chunk_id = f"{pdf_name}_{i}_{chunk_size}"
-                    store_embedding(
-                        model=embedding_model,
-                        doc_id=doc_id_counter,
-                        text=chunk,
-                        source=pdf_name,
-                        chunk_id=chunk_id,
-                        chunk_size=chunk_size,
-                        embedding=embedding
-                    )
-                    doc_id_counter += 1
-
-# Iterates over embedding, llm, and chunk size to answer all question for all combination for qdrant
-def all_combinations_question_answers(log_file="processed_data.txt"):
-    with open(log_file, "w", encoding="utf-8") as log:
-        for embedding_model in embedding_models:
-            print(f"Using embedding model: {embedding_model}")
-            for llm_model in llm_models:
-                print(f"Using LLM model: {llm_model}")
-                for chunk_size in chunk_sizes:
-                    print(f"Using chunk size: {chunk_size}")
-                    for question in questions:
-                        print(f"Answering question: {question[:50]}...")
-                        try:
-                            answer = answer_question(
-                                question=question,
-                                embedding_model=embedding_model,
-                                chunk_size=chunk_size,
-                                llm_model=llm_model
-                            )
-                            log.write(f"\nEmbedding: {embedding_model}\nLLM: {llm_model}\nChunk size: {chunk_size}\n")
-                            log.write(f"Question: {question}\nAnswer: {answer}\n")
-                            print(f"✓ Answered question: {question[:50]}...")
-                        except Exception as e:
-                            print(f"Error processing: {e}")
-                            log.write(f"Error for question: {question}\n")
-                            log.write(f"Error: {str(e)}\n")
+    def write_entry(log, item, result):
+        if result.error is None:
+            log.write(f"\nEmbedding: {item.embedding_model}\nLLM: {item.llm_model}\nChunk size: {item.chunk_size}\n")
+            log.write(f"Question: {item.question}\nAnswer: {result.answer}\n")
+        else:
+            log.write(f"Error for question: {item.question}\n")
+            log.write(f"Error: {str(result.error)}\n")
+    
+    # stored as soon as the cell finishes, so an interrupted run only loses the requests in flight
+    def record_result(item, result):
+        results.add("qdrant", item, result, manifest, packed=pack, stream=stream)
+        if partial_log:
+            partial_log.discard(item)
+    
+    def write_result(item, result):
+        if result.error is None:
+            print(f"✓ Answered question: {item.question[:50]}...")
+        else:
+            print(f"Error processing: {result.error}")
+    
+    def run(item):
+        print(f"Answering with {item.embedding_model} + {item.llm_model} + {item.chunk_size}: {item.question[:50]}...")
+        on_token = partial_log.writer(item, echo=concurrency == 1) if partial_log else None
+        try:
+            return answer_question(
+                question=item.question,
+                embedding_model=item.embedding_model,
+                chunk_size=item.chunk_size,
+                llm_model=item.llm_model,
+                search_results=plan.get((item.embedding_model, item.chunk_size, item.question)),
+                stream=stream,
+                on_token=on_token,
+                pack=pack
+            )
+        finally:
+            if on_token:
+                on_token.close()
+    
+    # rendered even when the run is interrupted, so the file always has everything answered so far
+    try:
+        run_schedule(todo, run, write_result, concurrency, done_fn=record_result)
+    finally:
+        results.render(log_file, "qdrant", work, write_entry, manifest, packed=pack)
+        results.close()
 
 
 # main method
 def main():
+    global HNSW_EF
+    parser = argparse.ArgumentParser(description="RAG over ./Notes with Qdrant")
+    parser.add_argument("--rebuild", action="store_true", help="drop the collections and re-ingest every PDF")
+    parser.add_argument("--dedupe-threshold", type=float, default=DEDUPE_THRESHOLD, help="similarity above which a chunk is skipped as a near-duplicate")
+    parser.add_argument("--no-dedupe", action="store_true", help="embed every chunk, even near-duplicates")
+    parser.add_argument("--pipeline", action="store_true", help="ingest through the async extract/chunk/embed/store pipeline")
+    parser.add_argument("--stage-concurrency", nargs="+", metavar="STAGE=N", help="pipeline workers per stage, e.g. embed=8 store=4")
+    parser.add_argument("--quantize", action="store_true", help="keep int8 scalar-quantized vectors in RAM")
+    parser.add_argument("--hnsw-m", type=int, default=HNSW_M, help="HNSW m of the collections")
+    parser.add_argument("--ef-construct", type=int, default=HNSW_EF_CONSTRUCT, help="HNSW ef_construct of the collections")
+    parser.add_argument("--hnsw-ef", type=int, default=HNSW_EF, help="HNSW ef used by searches")
+    parser.add_argument("--concurrency", type=int, default=LLM_CONCURRENCY, help="concurrent requests per loaded LLM")
+    parser.add_argument("--stream", action="store_true", help="stream answers, keeping partial output on disk")
+    parser.add_argument("--packing", action="store_true", help="merge overlapping chunks and cut the context to a per-llm token budget instead of sending the chunks verbatim")
+    parser.add_argument("--fresh", action="store_true", help="answer every combination again instead of skipping the ones already in results.sqlite")
+    parser.add_argument("--compare-models", metavar="QUESTION", help="print each embedding model's top-k for the question and their fused top-k, then exit")
+    parser.add_argument("--chunk-size", type=int, default=250, help="chunk size searched by --compare-models")
+    args = parser.parse_args()
+    dedupe_index.threshold = None if args.no_dedupe else args.dedupe_threshold
+
     try:
-        create_indices()
-        process_pdf_files("./Notes")
-        all_combinations_question_answers()
+        HNSW_EF = args.hnsw_ef
+        create_indices(rebuild=args.rebuild, quantize=args.quantize, m=args.hnsw_m, ef_construct=args.ef_construct)
+        for name in legacy_collections():
+            print(f"Collection {name} is from the one-collection-per-model layout and no longer used, it can be deleted")
+        if args.compare_models:
+            compare_models(args.compare_models, args.chunk_size)
+            return
+        process_pdf_files("./Notes", pipeline=args.pipeline, concurrency=parse_concurrency(args.stage_concurrency))
+        all_combinations_question_answers(concurrency=args.concurrency, stream=args.stream, pack=args.packing, resume=not args.fresh)
+        tracer.print_summary()
+        print_generation_summary(tracer)
+        print_packing_summary(tracer)
     except Exception as e:
         print(f"Main execution failed with error: {str(e)}")
 
@@ -0,0 +1,353 @@
+## Long-running question answering service over the indices a backend script already built
+##
+## python query_server.py --backend redis --port 8000
+## curl -s localhost:8000/answer -d '{"question": "How are ACID compliance and the CAP theorem related?"}'
+## curl -s localhost:8000/stats
+##
+## The backend's clients, indices and the LLM stay loaded between requests. A question is embedded as soon as
+## it arrives and answered right away when a close paraphrase was answered before (answer_cache.py). The
+## others are micro-batched: every BATCH_WINDOW_MS the waiting questions are searched with one batched vector
+## query per (embedding model, chunk size), then each is answered on its own thread. With the answer cache
+## off, the waiting questions are also embedded together in one call.
+## python query_server.py --load-test --clients 16 --requests 200 sends questions at a running server.
+
+import argparse
+import json
+import queue
+import threading
+import time
+import urllib.request
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+import ollama
+import generation
+from answer_cache import ANSWER_CACHE_THRESHOLD
+from batch_embedding import embed_batch
+from benchmark import BACKENDS, load_backend
+
+BATCH_WINDOW_MS = 10
+MAX_BATCH = 64
+LATENCY_WINDOW = 10000
+KEEP_ALIVE = "30m"
+# keyword each backend's answer_question takes already retrieved chunks under
+RETRIEVED_KWARG = {"redis": "docs", "chroma": "results", "qdrant": "search_results", "numpy_store": "results"}
+
+
+# attaches to the indices the backend script built; nothing is dropped and existing indices keep their settings
+def open_backend(name):
+    module = load_backend(name)
+    if name == "redis":
+        module.create_indices(rebuild=False)
+    elif name == "chroma":
+        module.initialize_vector_store(rebuild=False)
+    elif name == "numpy_store":
+        module.create_indices(rebuild=False)
+    else:
+        module.client.get_collection(module.COLLECTION_NAME)
+    return module
+
+
+# loads the llm into ollama with an empty chat and asks it to stay loaded for keep_alive
+def warm_llm(llm_model, keep_alive=KEEP_ALIVE):
+    start_time = time.perf_counter()
+    try:
+        ollama.chat(model=llm_model, messages=[], keep_alive=keep_alive)
+        print(f"Loaded {llm_model} in {time.perf_counter() - start_time:.2f}s, kept for {keep_alive}")
+    except Exception as e:
+        print(f"Could not preload {llm_model}: {e}")
+
+
+# request latency and throughput since the server started, plus how well questions were batched
+class ServerStats:
+    def __init__(self):
+        self.started = time.time()
+        self.lock = threading.Lock()
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.finished = deque(maxlen=LATENCY_WINDOW)
+        self.requests = 0
+        self.errors = 0
+        self.batches = 0
+        self.batched_questions = 0
+        self.embed_calls = 0
+        self.vector_queries = 0
+
+    def record_request(self, seconds, error=False):
+        with self.lock:
+            self.requests += 1
+            self.errors += int(error)
+            self.latencies.append(seconds)
+            self.finished.append(time.time())
+
+    def record_embed(self):
+        with self.lock:
+            self.embed_calls += 1
+
+    def record_batch(self, questions, embed_calls, vector_queries):
+        with self.lock:
+            self.batches += 1
+            self.batched_questions += questions
+            self.embed_calls += embed_calls
+            self.vector_queries += vector_queries
+
+    def snapshot(self):
+        with self.lock:
+            latencies = np.array(self.latencies) * 1000
+            now = time.time()
+            recent = sum(1 for finished in self.finished if finished >= now - 60)
+            uptime = now - self.started
+            return {
+                "uptime_s": round(uptime, 1),
+                "requests": self.requests,
+                "errors": self.errors,
+                "requests_per_sec": round(self.requests / uptime, 3) if uptime else 0.0,
+                "requests_per_sec_last_60s": round(recent / min(60.0, uptime), 3) if uptime else 0.0,
+                "latency_ms": {
+                    "mean": round(float(latencies.mean()), 2),
+                    "p50": round(float(np.percentile(latencies, 50)), 2),
+                    "p95": round(float(np.percentile(latencies, 95)), 2),
+                    "p99": round(float(np.percentile(latencies, 99)), 2),
+                } if len(latencies) else None,
+                "retrieval_batches": self.batches,
+                "mean_batch_size": round(self.batched_questions / self.batches, 2) if self.batches else 0.0,
+                "embed_calls": self.embed_calls,
+                "vector_queries": self.vector_queries,
+            }
+
+
+# collects the questions that arrive within window seconds of each other (up to max_batch) and retrieves
+# them together: one embed_batch call per embedding model for the questions not embedded yet and one
+# search_batch call per (model, chunk size, k)
+class MicroBatcher:
+    def __init__(self, module, stats, window=BATCH_WINDOW_MS / 1000, max_batch=MAX_BATCH):
+        self.module = module
+        self.stats = stats
+        self.window = window
+        self.max_batch = max_batch
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._loop, daemon=True)
+        self.thread.start()
+
+    # blocks until the batch holding this question has been searched, returns (hits, question embedding);
+    # a question_embedding passed in is searched as it is
+    def retrieve(self, question, embedding_model, chunk_size, k, question_embedding=None):
+        future = Future()
+        self.queue.put(((embedding_model, chunk_size, k), question, question_embedding, future))
+        return future.result()
+
+    def _loop(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.perf_counter() + self.window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._run(batch)
+
+    def _run(self, batch):
+        by_model = {}
+        for key, question, question_embedding, future in batch:
+            by_model.setdefault(key[0], []).append((key, question, question_embedding, future))
+
+        embed_calls = vector_queries = 0
+        for embedding_model, requests in by_model.items():
+            try:
+                embeddings = {question: question_embedding for _, question, question_embedding, _ in requests if question_embedding is not None}
+                questions = list(dict.fromkeys(question for _, question, _, _ in requests if question not in embeddings))
+                if questions:
+                    embeddings.update(zip(questions, embed_batch(questions, embedding_model)))
+                    embed_calls += 1
+
+                by_search = {}
+                for key, question, _, future in requests:
+                    by_search.setdefault(key, []).append((question, future))
+                for (_, chunk_size, k), searches in by_search.items():
+                    search_questions = list(dict.fromkeys(question for question, _ in searches))
+                    results = self.module.search_batch(
+                        embedding_model, chunk_size, np.stack([embeddings[question] for question in search_questions]), k
+                    )
+                    vector_queries += 1
+                    hits = dict(zip(search_questions, results))
+                    for question, future in searches:
+                        future.set_result((hits[question], embeddings[question]))
+            except Exception as e:
+                for _, _, _, future in requests:
+                    if not future.done():
+                        future.set_exception(e)
+        self.stats.record_batch(len(batch), embed_calls, vector_queries)
+
+
+class QueryService:
+    def __init__(self, backend, embedding_model, chunk_size, llm_model, k=5, pack=False, use_cache=True):
+        self.backend = backend
+        self.module = open_backend(backend)
+        self.defaults = {"embedding_model": embedding_model, "chunk_size": chunk_size, "llm_model": llm_model, "k": k}
+        self.pack = pack
+        self.use_cache = use_cache
+        self.stats = ServerStats()
+        self.batcher = MicroBatcher(self.module, self.stats)
+
+    # paraphrases of questions answered before come straight from the backend's answer cache, before any
+    # retrieval; the others go through the answer_question of the backend script, with retrieval shared with
+    # the other waiting questions
+    def answer(self, request):
+        params = {**self.defaults, **{key: request[key] for key in self.defaults if request.get(key) is not None}}
+        question = request["question"]
+        embedding_model, chunk_size, llm_model, k = params["embedding_model"], int(params["chunk_size"]), params["llm_model"], int(params["k"])
+        cache, manifest = self.module.answer_cache, self.module.manifest
+        start_time = time.perf_counter()
+        try:
+            question_embedding = cached = None
+            if self.use_cache:
+                question_embedding = embed_batch([question], embedding_model)[0]
+                self.stats.record_embed()
+                cached = cache.lookup(embedding_model, chunk_size, llm_model, k, self.pack, question_embedding, manifest)
+            if cached is not None:
+                answer, retrieval_seconds = cached, time.perf_counter() - start_time
+            else:
+                hits, question_embedding = self.batcher.retrieve(question, embedding_model, chunk_size, k, question_embedding)
+                retrieval_seconds = time.perf_counter() - start_time
+                answer = self.module.answer_question(
+                    question=question,
+                    embedding_model=embedding_model,
+                    chunk_size=chunk_size,
+                    llm_model=llm_model,
+                    k=k,
+                    pack=self.pack,
+                    question_embedding=question_embedding,
+                    **{RETRIEVED_KWARG[self.backend]: hits}
+                )
+                if self.use_cache:
+                    cache.store(embedding_model, chunk_size, llm_model, k, self.pack, question, question_embedding, manifest, answer)
+        except Exception:
+            self.stats.record_request(time.perf_counter() - start_time, error=True)
+            raise
+        seconds = time.perf_counter() - start_time
+        self.stats.record_request(seconds)
+        return {
+            "answer": answer,
+            **params,
+            "cached": cached is not None,
+            "retrieval_ms": round(retrieval_seconds * 1000, 2),
+            "total_ms": round(seconds * 1000, 2),
+        }
+
+
+def make_handler(service):
+    class QueryHandler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def _send_json(self, payload, status=200):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == "/stats":
+                self._send_json({**service.stats.snapshot(), "answer_cache": service.module.answer_cache.stats()})
+            elif self.path == "/health":
+                self._send_json({"backend": service.backend, **service.defaults})
+            else:
+                self.send_error(404)
+
+        def do_POST(self):
+            if self.path != "/answer":
+                self.send_error(404)
+                return
+            try:
+                request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            except ValueError as e:
+                self._send_json({"error": f"Invalid JSON: {e}"}, 400)
+                return
+            if not request.get("question"):
+                self._send_json({"error": "question is required"}, 400)
+                return
+            try:
+                self._send_json(service.answer(request))
+            except Exception as e:
+                self._send_json({"error": str(e)}, 500)
+
+    return QueryHandler
+
+
+# sends requests questions from clients threads at a running server and prints client-side latency
+def load_test(url, questions, clients, requests):
+    def ask(i):
+        body = json.dumps({"question": questions[i % len(questions)]}).encode("utf-8")
+        start_time = time.perf_counter()
+        with urllib.request.urlopen(urllib.request.Request(f"{url}/answer", data=body), timeout=600) as response:
+            response.read()
+        return time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        latencies = np.array(list(pool.map(ask, range(requests)))) * 1000
+    seconds = time.perf_counter() - start_time
+    print(
+        f"{requests} requests from {clients} clients in {seconds:.2f}s, {requests / seconds:.1f} req/s, "
+        f"p50 {np.percentile(latencies, 50):.1f} ms, p95 {np.percentile(latencies, 95):.1f} ms"
+    )
+    with urllib.request.urlopen(f"{url}/stats") as response:
+        print(json.dumps(json.loads(response.read()), indent=2))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve answers over the existing indices of one backend")
+    parser.add_argument("--backend", choices=BACKENDS, default="redis")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--embedding-model", default="nomic-embed-text")
+    parser.add_argument("--chunk-size", type=int, default=250)
+    parser.add_argument("--llm", default="mistral")
+    parser.add_argument("-k", type=int, default=5)
+    parser.add_argument("--batch-window-ms", type=float, default=BATCH_WINDOW_MS, help="how long to wait for more questions before retrieving")
+    parser.add_argument("--max-batch", type=int, default=MAX_BATCH)
+    parser.add_argument("--keep-alive", default=KEEP_ALIVE, help="how long ollama keeps the llm loaded between requests")
+    parser.add_argument("--packing", action="store_true", help="merge overlapping chunks and cut the context to a per-llm token budget")
+    parser.add_argument("--no-answer-cache", action="store_true", help="generate every answer, even for paraphrases of earlier questions")
+    parser.add_argument("--cache-threshold", type=float, default=ANSWER_CACHE_THRESHOLD, help="cosine similarity at which a cached answer is reused")
+    parser.add_argument("--load-test", action="store_true", help="send questions at a running server instead of serving")
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=200)
+    args = parser.parse_args()
+
+    if args.load_test:
+        from numpy_store import questions
+        load_test(f"http://{args.host}:{args.port}", questions, args.clients, args.requests)
+        return
+
+    generation.KEEP_ALIVE = args.keep_alive
+    service = QueryService(
+        args.backend, args.embedding_model, args.chunk_size, args.llm, args.k,
+        pack=args.packing, use_cache=not args.no_answer_cache
+    )
+    service.module.answer_cache.threshold = args.cache_threshold
+    service.batcher.window = args.batch_window_ms / 1000
+    service.batcher.max_batch = args.max_batch
+    embed_batch(["warm up"], args.embedding_model)
+    warm_llm(args.llm, args.keep_alive)
+
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(service))
+    print(f"Answering questions over {args.backend} on http://{args.host}:{args.port} (POST /answer, GET /stats)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(json.dumps(service.stats.snapshot(), indent=2))
+        service.module.answer_cache.print_stats()
+
+
+if __name__ == "__main__":
+    main()
@@ -2,15 +2,46 @@ import os
 from pathlib import Path
 import numpy as np
 import redis
+import redis.asyncio
 from redis.commands.search.query import Query
-import ollama
-import PyPDF2
+from pdf_extraction import extract_pages, extract_texts
+from chunking import iter_chunks, chunks_by_size
+from dim_reduction import reduced_dimension, fit_projections, needs_fit
+from embedding_cache import print_cache_stats
+from batch_embedding import embed_batch, print_embedding_throughput
+from manifest import IngestManifest, sync_manifest
+from dedupe import DEDUPE_THRESHOLD, DedupeIndex
+from answer_cache import AnswerCache
+from ingest_pipeline import IngestPipeline, parse_concurrency
+from scheduler import LLM_CONCURRENCY, build_work_list, grid_of, run_schedule
+from results_store import ResultStore
+from retrieval_plan import build_retrieval_plan
+from tracing import tracer
+from generation import generate, PartialAnswerLog, print_generation_summary
+from context_packing import make_hit, pack_context, join_hits, print_packing_summary
+import argparse
 import time
+from contextlib import asynccontextmanager
 
 # Initialize Redis connection
-redis_client = redis.Redis(host="localhost", port=6380, db=0)
+REDIS_HOST = "localhost"
+REDIS_PORT = 6380
+redis_client = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, db=0)
+manifest = IngestManifest("redis")
+dedupe_index = DedupeIndex("redis")
+answer_cache = AnswerCache("redis")
 DOC_PREFIX = "doc:"
 DISTANCE_METRIC = "COSINE"
+BULK_BATCH_SIZE = 500
+BULK_FLUSH_INTERVAL = 1.0
+# HNSW graph degree, build-time and query-time candidate list sizes (RediSearch defaults),
+# used when an index is created; EF_RUNTIME can also be overridden per query
+HNSW_M = 16
+HNSW_EF_CONSTRUCTION = 200
+EF_RUNTIME = 10
+# FLOAT16 halves the vector memory of the HNSW indices (needs Redis 7.4 / RediSearch 2.10 or newer)
+VECTOR_TYPE = "FLOAT32"
+VECTOR_DTYPES = {"FLOAT32": np.float32, "FLOAT16": np.float16}
 
 # Embedding models, LLMs, and chunk sizes
 embedding_models = ["paraphrase-multilingual", "nomic-embed-text", "all-minilm:33m"]
@@ -26,30 +57,51 @@ questions = ["What are pros and cons of different data structures for storing an
              ]
 
 embedding_indices = {}
+vector_types = {}
+# model -> "M EF_CONSTRUCTION EF_RUNTIME" its index was created with
+hnsw_params = {}
 
 # generates the embedding and dimensions for embedding
 def get_embedding_and_dimensions(text, model):
-    response = ollama.embeddings(model=model, prompt=text)
-    embedding = response["embedding"]
+    embedding = embed_batch([text], model)[0].tolist()
     return embedding, len(embedding)
 
-# creats index for each embedding model in Redis
-def create_indices():
+# creats index for each embedding model in Redis, existing indices are kept unless rebuild is set,
+# and keep the vector type and HNSW parameters they were created with
+def create_indices(rebuild=False, vector_type=VECTOR_TYPE, m=HNSW_M, ef_construction=HNSW_EF_CONSTRUCTION, ef_runtime=EF_RUNTIME):
     sample_text = "This is a sample text to determine embedding dimensions."
     model_dimensions = {}
+    created = []
     
     for model in embedding_models:
-        _, dim = get_embedding_and_dimensions(sample_text, model)
+        # the probe is the full vector, indices are sized for the reduced one (see dim_reduction.py)
+        dim = reduced_dimension(model, len(embed_batch([sample_text], model, reduce=False)[0]))
         model_dimensions[model] = dim
         
-        model_name = model.replace('-', '_').replace(':', '_')
-        index_name = f"embedding_{model_name}"
+        model_safe_name = model.replace('-', '_').replace(':', '_')
+        index_name = f"embedding_{model_safe_name}"
         embedding_indices[model] = index_name
+        vector_types[model] = vector_type
+        hnsw_params[model] = f"{m} {ef_construction} {ef_runtime}"
         
-        try:
-            redis_client.execute_command(f"FT.DROPINDEX {index_name} DD")
-        except redis.exceptions.ResponseError:
-            pass
+        if rebuild:
+            try:
+                redis_client.execute_command(f"FT.DROPINDEX {index_name} DD")
+            except redis.exceptions.ResponseError:
+                pass
+        else:
+            try:
+                redis_client.ft(index_name).info()
+                stored_type = (redis_client.get(f"{index_name}:vector_type") or b"FLOAT32").decode("utf-8")
+                vector_types[model] = stored_type
+                default_hnsw = f"{HNSW_M} {HNSW_EF_CONSTRUCTION} {EF_RUNTIME}".encode("utf-8")
+                hnsw_params[model] = (redis_client.get(f"{index_name}:hnsw") or default_hnsw).decode("utf-8")
+                print(f"Index {index_name} already exists, reusing it")
+                if stored_type != vector_type:
+                    print(f"Index {index_name} stores {stored_type} vectors, run with --rebuild to switch to {vector_type}")
+                continue
+            except redis.exceptions.ResponseError:
+                pass
             
         redis_client.execute_command(
             f"""
@@ -59,45 +111,157 @@ def create_indices():
                 source TEXT
                 chunk_id TEXT
                 chunk_size TAG
-                embedding VECTOR HNSW 6 DIM {dim} TYPE FLOAT32 DISTANCE_METRIC {DISTANCE_METRIC}
+                embedding VECTOR HNSW 12 DIM {dim} TYPE {vector_type} DISTANCE_METRIC {DISTANCE_METRIC}
+                    M {m} EF_CONSTRUCTION {ef_construction} EF_RUNTIME {ef_runtime}
             """
         )
-        print(f"Index {index_name} created successfully with dimension {dim}")
+        redis_client.set(f"{index_name}:vector_type", vector_type)
+        redis_client.set(f"{index_name}:hnsw", hnsw_params[model])
+        created.append(model)
+        print(
+            f"Index {index_name} created successfully with dimension {dim} ({vector_type}, "
+            f"M {m}, EF_CONSTRUCTION {ef_construction}, EF_RUNTIME {ef_runtime})"
+        )
+
+    if rebuild:
+        manifest.clear()
+    elif created:
+        # an index that had to be created (redis flushed or restarted without persistence) holds none of the
+        # chunks the manifest remembers for its model
+        for model in created:
+            if any([manifest.forget_combination(model, chunk_size) for chunk_size in chunk_sizes]):
+                print(f"Index {embedding_indices[model]} was missing, its chunks will be ingested again")
+        manifest.save()
+    # the index settings are part of the fingerprint cached answers are checked against (answer_cache.py)
+    settings = [
+        manifest.record_index(model, chunk_size, dim=model_dimensions[model], vector_type=vector_types[model], hnsw=hnsw_params[model])
+        for model in embedding_models for chunk_size in chunk_sizes
+    ]
+    if any(settings):
+        manifest.save()
+
+# buffers HSETs in a non-transactional pipeline and sends them once batch_size commands
+# are queued or flush_interval seconds have passed since the last flush
+class BulkWriter:
+    def __init__(self, client, batch_size=BULK_BATCH_SIZE, flush_interval=BULK_FLUSH_INTERVAL):
+        self.pipeline = client.pipeline(transaction=False)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.pending = 0
+        self.written = 0
+        self.flushes = 0
+        self.started = None
+        self.last_flush = time.perf_counter()
+
+    def hset(self, key, mapping):
+        if self.started is None:
+            self.started = time.perf_counter()
+        self.pipeline.hset(key, mapping=mapping)
+        self.pending += 1
+        if self.pending >= self.batch_size or time.perf_counter() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            self.pipeline.execute()
+            self.written += self.pending
+            self.flushes += 1
+            self.pending = 0
+        self.last_flush = time.perf_counter()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.flush()
 
-# Store the calculated embedding in Redis
-def store_embedding(model, doc_id, text, source, chunk_id, chunk_size, embedding):
+    def print_throughput(self):
+        seconds = self.last_flush - self.started if self.started else 0.0
+        rate = self.written / seconds if seconds else 0.0
+        print(f"Redis: wrote {self.written} hashes in {self.flushes} pipelines over {seconds:.2f}s, {rate:.1f} hashes/sec")
+
+# packs a vector in the binary layout of the model's index
+def vector_bytes(embedding, model):
+    return np.asarray(embedding, dtype=VECTOR_DTYPES[vector_types.get(model, VECTOR_TYPE)]).tobytes()
+
+# key and hash fields of one chunk; start/end are the chunk's word offsets in its source,
+# used to merge overlapping hits in the prompt
+def chunk_hash(model, doc_id, text, source, chunk_id, chunk_size, embedding, start=None, end=None):
     model_safe_name = model.replace('-', '_').replace(':', '_')
     key = f"{DOC_PREFIX}{model_safe_name}_{doc_id}"
-    redis_client.hset(
-        key,
-        mapping={
-            "text": text,
-            "source": source,
-            "chunk_id": chunk_id,
-            "chunk_size": str(chunk_size),
-            "embedding": np.array(embedding, dtype=np.float32).tobytes(),
-        },
-    )
+    mapping = {
+        "text": text,
+        "source": source,
+        "chunk_id": chunk_id,
+        "chunk_size": str(chunk_size),
+        "embedding": vector_bytes(embedding, model),
+    }
+    if start is not None:
+        mapping.update({"start": start, "end": end})
+    return key, mapping
+
+# Store the calculated embedding in Redis, through the bulk writer when one is given
+def store_embedding(model, doc_id, text, source, chunk_id, chunk_size, embedding, writer=None, start=None, end=None):
+    key, mapping = chunk_hash(model, doc_id, text, source, chunk_id, chunk_size, embedding, start, end)
+    (writer or redis_client).hset(key, mapping=mapping)
+    return key
+
+# store stage of the async ingest pipeline: one pipelined round trip of HSETs per batch over redis.asyncio
+@asynccontextmanager
+async def pipeline_store():
+    client = redis.asyncio.Redis(host=REDIS_HOST, port=REDIS_PORT, db=0)
+    
+    async def store(batch, embeddings):
+        pipeline = client.pipeline(transaction=False)
+        keys = []
+        for chunk, embedding in zip(batch.chunks, embeddings):
+            key, mapping = chunk_hash(
+                batch.model, chunk.chunk_id, chunk.text, chunk.source, chunk.chunk_id, batch.chunk_size, embedding,
+                chunk.start, chunk.end
+            )
+            pipeline.hset(key, mapping=mapping)
+            keys.append(key)
+        await pipeline.execute()
+        return keys
+    
+    try:
+        yield store
+    finally:
+        await client.aclose()
+
+# deletes the stored chunks of a file, given {(model, chunk_size): keys} from the manifest
+def delete_chunks(chunk_ids):
+    keys = [key for ids in chunk_ids.values() for key in ids]
+    for start in range(0, len(keys), 1000):
+        redis_client.delete(*keys[start:start + 1000])
 
 # extracts text from pdf using pypdf2
 def extract_text_from_pdf(pdf_path):
-    with open(pdf_path, 'rb') as file:
-        pdf_reader = PyPDF2.PdfReader(file)
-        text = "".join([page.extract_text() + " " for page in pdf_reader.pages])
-    return text
-
-# creates a chunks of the texts with overlaps (half of chunks)
-def chunk_text(text, chunk_size=100):
-    words = text.split()
-    chunks = []
-    for i in range(0, len(words), chunk_size // 2): 
-        chunks.append(" ".join(words[i:i + chunk_size]))
-    return chunks
-
-# Ggenerates an answer to the question based on the embedding model, chunk size, and llm models
-def answer_question(question, embedding_model, chunk_size, llm_model, k=5):
-    question_embedding, _ = get_embedding_and_dimensions(question, embedding_model)
+    return extract_texts([pdf_path])[str(pdf_path)]
+
+# hybrid KNN query: the chunk_size TAG filter runs inside the vector search, so k hits of that size come back;
+# without ef_runtime the index's own EF_RUNTIME applies
+def search_chunks(question_embedding, embedding_model, chunk_size, k=5, ef_runtime=None):
+    index_name = embedding_indices[embedding_model]
+    query_params = {"vec": vector_bytes(question_embedding, embedding_model)}
+    
+    knn = f"KNN {k} @embedding $vec"
+    if ef_runtime:
+        knn += " EF_RUNTIME $ef"
+        query_params["ef"] = ef_runtime
+    
+    query = (
+        Query(f"(@chunk_size:{{{chunk_size}}})=>[{knn} AS vector_distance]")
+        .sort_by("vector_distance")
+        .return_fields("text", "source", "chunk_id", "vector_distance", "chunk_size", "start", "end")
+        .paging(0, k)
+        .dialect(2)
+    )
     
+    return redis_client.ft(index_name).search(query, query_params=query_params).docs
+
+# the previous behaviour: unfiltered KNN over every chunk size, then dropping other sizes in python
+def search_chunks_post_filter(question_embedding, embedding_model, chunk_size, k=5):
     index_name = embedding_indices[embedding_model]
     
     query = (
@@ -108,12 +272,92 @@ def answer_question(question, embedding_model, chunk_size, llm_model, k=5):
     )
     
     results = redis_client.ft(index_name).search(
-        query, query_params={"vec": np.array(question_embedding, dtype=np.float32).tobytes()}
+        query, query_params={"vec": vector_bytes(question_embedding, embedding_model)}
     )
     
-    filtered_docs = [doc for doc in results.docs if doc.chunk_size == str(chunk_size)]
+    return [doc for doc in results.docs if doc.chunk_size == str(chunk_size)][:k]
+
+# exact top-k chunk ids by brute force over every stored vector of the model and chunk size
+def exact_top_k(question_embedding, embedding_model, chunk_size, k=5):
+    keys = [
+        key for name in manifest.files
+        for key in manifest.chunk_ids(name).get((embedding_model, chunk_size), [])
+    ]
+    if not keys:
+        return []
+    pipeline = redis_client.pipeline(transaction=False)
+    for key in keys:
+        pipeline.hmget(key, "chunk_id", "embedding")
+    rows = [row for row in pipeline.execute() if row[1] is not None]
+    
+    dtype = VECTOR_DTYPES[vector_types.get(embedding_model, VECTOR_TYPE)]
+    matrix = np.stack([np.frombuffer(row[1], dtype=dtype) for row in rows]).astype(np.float32)
+    matrix /= np.linalg.norm(matrix, axis=1, keepdims=True) + 1e-12
+    query = np.array(question_embedding, dtype=np.float32)
+    scores = matrix @ (query / (np.linalg.norm(query) + 1e-12))
+    top = np.argsort(-scores)[:k]
+    return [rows[i][0].decode("utf-8") for i in top]
+
+# compares latency, number of hits and recall@k of the pre-filtered query against the old post-filtering
+def compare_knn_filtering(k=5, ef_runtime=None):
+    stats = {"post_filter": {"ms": [], "hits": [], "recall": []}, "pre_filter": {"ms": [], "hits": [], "recall": []}}
+    
+    for embedding_model in embedding_models:
+        for chunk_size in chunk_sizes:
+            for question in questions:
+                question_embedding, _ = get_embedding_and_dimensions(question, embedding_model)
+                truth = set(exact_top_k(question_embedding, embedding_model, chunk_size, k))
+                
+                for mode in stats:
+                    start_time = time.perf_counter()
+                    if mode == "pre_filter":
+                        docs = search_chunks(question_embedding, embedding_model, chunk_size, k, ef_runtime)
+                    else:
+                        docs = search_chunks_post_filter(question_embedding, embedding_model, chunk_size, k)
+                    stats[mode]["ms"].append((time.perf_counter() - start_time) * 1000)
+                    stats[mode]["hits"].append(len(docs))
+                    if truth:
+                        stats[mode]["recall"].append(len(truth & {doc.chunk_id for doc in docs}) / len(truth))
+    
+    print(f"{'mode':<12} {'mean ms':>9} {'p95 ms':>9} {'hits/query':>11} {'recall@' + str(k):>10}")
+    for mode, values in stats.items():
+        recall = np.mean(values["recall"]) if values["recall"] else float("nan")
+        print(
+            f"{mode:<12} {np.mean(values['ms']):>9.2f} {np.percentile(values['ms'], 95):>9.2f} "
+            f"{np.mean(values['hits']):>11.2f} {recall:>10.3f}"
+        )
+    return stats
+
+# runs the filtered KNN for every row of a question embedding matrix, one result list per question
+def search_batch(embedding_model, chunk_size, question_matrix, k=5):
+    return [search_chunks(question_embedding, embedding_model, chunk_size, k) for question_embedding in question_matrix]
+
+# Ggenerates an answer to the question based on the embedding model, chunk size, and llm models,
+# docs can be passed in when the chunks were already retrieved;
+# use_cache looks the question up in the semantic answer cache first (answer_cache.py)
+def answer_question(question, embedding_model, chunk_size, llm_model, k=5, docs=None, stream=False, on_token=None, pack=False, question_embedding=None, use_cache=False):
+    if question_embedding is None and (docs is None or use_cache):
+        with tracer.span("embed", model=embedding_model, chunks=1):
+            question_embedding, _ = get_embedding_and_dimensions(question, embedding_model)
+    
+    # a close enough earlier question with the same embedding model, chunk size, llm, k and packing skips retrieval
+    # and the llm
+    if use_cache:
+        with tracer.span("cache", llm=llm_model, model=embedding_model, chunk_size=chunk_size) as span:
+            cached = answer_cache.lookup(embedding_model, chunk_size, llm_model, k, pack, question_embedding, manifest)
+            span["hit"] = cached is not None
+        if cached is not None:
+            if on_token:
+                on_token(cached)
+            return cached
+    
+    if docs is None:
+        with tracer.span("search", backend="redis", model=embedding_model, chunk_size=chunk_size):
+            docs = search_chunks(question_embedding, embedding_model, chunk_size, k)
     
-    context = "\n".join([f"{doc.text}" for doc in filtered_docs[:k]])
+    prompt_start = time.perf_counter()
+    hits = [make_hit(doc.text, doc.source, getattr(doc, "start", None), getattr(doc, "end", None)) for doc in docs]
+    context, packing = pack_context(hits, llm_model) if pack else join_hits(hits)
     
     prompt = f"""
     Context information:
@@ -123,93 +367,199 @@ def answer_question(question, embedding_model, chunk_size, llm_model, k=5):
     
     Answer based on the context. If the answer is unavailable, state it clearly.
     """
+    tracer.record("prompt", time.perf_counter() - prompt_start, context_chars=len(context), packed=pack, **packing)
     
-    response = ollama.chat(
-        model=llm_model,
-        messages=[{"role": "user", "content": prompt}]
-    )
+    with tracer.span("generate", llm=llm_model, model=embedding_model, chunk_size=chunk_size, stream=stream) as span:
+        answer, stats = generate(prompt, llm_model, stream=stream, on_token=on_token)
+        span.update(stats)
+    
+    if use_cache:
+        answer_cache.store(embedding_model, chunk_size, llm_model, k, pack, question, question_embedding, manifest, answer)
     
-    return response["message"]["content"]
+    return answer
+
+# the serial loop: extract every pdf, then chunk, embed and store one file at a time
+def ingest_serially(pending):
+    with tracer.span("extract", files=len(pending)):
+        pages = extract_pages(pending) if pending else {}
+    fit_projections(embedding_models, pages, chunk_sizes)
+    
+    with BulkWriter(redis_client) as writer:
+        for pdf_file in pending:
+            pdf_name = os.path.basename(str(pdf_file))
+            missing = [
+                (embedding_model, chunk_size) for embedding_model in embedding_models for chunk_size in chunk_sizes
+                if not manifest.has(pdf_name, embedding_model, chunk_size)
+            ]
+            
+            # every missing chunk size comes out of one pass over the pages
+            sizes = sorted({chunk_size for _, chunk_size in missing})
+            with tracer.span("chunk", source=pdf_name, chunk_sizes=sizes) as span:
+                by_size = chunks_by_size(iter_chunks(pages.pop(str(pdf_file)), pdf_name, sizes), sizes)
+                span["chunks"] = sum(len(chunks) for chunks in by_size.values())
+            with tracer.span("dedupe", source=pdf_name) as span:
+                by_size, aliases = dedupe_index.filter(pdf_name, by_size)
+                span["skipped"] = sum(len(size_aliases) for size_aliases in aliases.values())
+            
+            for embedding_model, chunk_size in missing:
+                chunks = [chunk.text for chunk in by_size[chunk_size]]
+                with tracer.span("embed", model=embedding_model, chunks=len(chunks)):
+                    embeddings = embed_batch(chunks, embedding_model)
+                keys = []
+                
+                with tracer.span("store", backend="redis", chunks=len(chunks)):
+                    for chunk, embedding in zip(by_size[chunk_size], embeddings):
+                        keys.append(store_embedding(
+                            model=embedding_model,
+                            doc_id=chunk.chunk_id,
+                            text=chunk.text,
+                            source=pdf_name,
+                            chunk_id=chunk.chunk_id,
+                            chunk_size=chunk_size,
+                            embedding=embedding,
+                            writer=writer,
+                            start=chunk.start,
+                            end=chunk.end
+                        ))
+                manifest.record(pdf_name, embedding_model, chunk_size, keys)
+            writer.flush()
+            for chunk_size, size_aliases in aliases.items():
+                manifest.record_aliases(pdf_name, chunk_size, size_aliases)
+            manifest.save()
+            dedupe_index.save()
+
+    writer.print_throughput()
+
+# the async pipeline (ingest_pipeline.py); a PCA that still has to be fitted needs every file's pages first
+def ingest_pipelined(pending, concurrency=None):
+    if any(needs_fit(model) for model in embedding_models):
+        fit_projections(embedding_models, extract_pages(pending), chunk_sizes)
+    IngestPipeline("redis", manifest, dedupe_index, embedding_models, chunk_sizes, pipeline_store, concurrency).run(pending)
 
 # Remove the check for 'os' within the function, since it's already imported at the top.
-def process_pdf_files(folder_path):
+def process_pdf_files(folder_path, pipeline=False, concurrency=None):
     pdf_files = list(Path(folder_path).glob('*.pdf'))
     if not pdf_files:
         print(f"No PDF files found in {folder_path}")
         return
+
+    sync_manifest(manifest, pdf_files, delete_chunks)
+    dedupe_index.retain(manifest)
+    pending = [
+        pdf_file for pdf_file in pdf_files
+        if not all(manifest.has(pdf_file.name, model, size) for model in embedding_models for size in chunk_sizes)
+    ]
+    print(f"{len(pending)} of {len(pdf_files)} PDF files need to be ingested")
+    ingest_start = time.perf_counter()
+    if pipeline and pending:
+        ingest_pipelined(pending, concurrency)
+    else:
+        ingest_serially(pending)
+    seconds = time.perf_counter() - ingest_start
+    tracer.record("ingest", seconds, files=len(pending), pipeline=pipeline)
+    print(f"Ingested {len(pending)} PDF files in {seconds:.2f}s ({'pipeline' if pipeline else 'serial'})")
+
+    dedupe_index.print_stats()
+    print_embedding_throughput()
+    print_cache_stats()
+
+
+# Iterates over embedding, llm, and chunk size to answer all question for all combination for Redis,
+# the grid is scheduled so each llm is loaded once. Every answer goes to results.sqlite as soon as it is done,
+# cells already answered there with the same packing from the same index are skipped unless resume is False,
+# and the results file is rendered from it
+def all_combinations_question_answers(log_file="processed_data.txt", concurrency=LLM_CONCURRENCY, stream=False, pack=False, resume=True):
+    tracer.place_next_to(log_file)
+    partial_log = PartialAnswerLog(log_file, "redis") if stream else None
+    results = ResultStore.next_to(log_file)
+    work = build_work_list(embedding_models, llm_models, chunk_sizes, questions)
+    todo = results.pending("redis", work, manifest, packed=pack) if resume else work
+    print(f"{len(work) - len(todo)} of {len(work)} answers already in {results.path}, {len(todo)} to run")
+    plan = build_retrieval_plan(*grid_of(todo), search_batch) if todo else {}
     
-    for embedding_model in embedding_models:
-        doc_id_counter = 0
+    def write_entry(log, item, result):
+        #writes the result in file
+        log.write(f"\nLLM\n{item.llm_model}\n")
+        log.write(f"Embedding\n{item.embedding_model}\n")
+        log.write(f"Chunk Sizes\n{item.chunk_size}\n\n")
+        log.write(f"Question\n{item.question}\n\n")
+        if result.error is None:
+            log.write(f"Answer\n{result.answer}\n")
+        else:
+            log.write(f"Answer\nError: {str(result.error)}\n")
     
-        for pdf_file in pdf_files:
-            pdf_name = os.path.basename(str(pdf_file))
-            text = extract_text_from_pdf(str(pdf_file))
-            
-            for chunk_size in chunk_sizes:
-                chunks = chunk_text(text, chunk_size)
-                
-                for i, chunk in enumerate(chunks):
-                    embedding, _ = get_embedding_and_dimensions(chunk, embedding_model)
-                    chunk_id = f"{pdf_name}_{i}_{chunk_size}"
-                    
-                    store_embedding(
-                        model=embedding_model,
-                        doc_id=str(doc_id_counter),
-                        text=chunk,
-                        source=pdf_name,
-                        chunk_id=chunk_id,
-                        chunk_size=chunk_size,
-                        embedding=embedding
-                    )
-                    doc_id_counter += 1
-
-
-# Iterates over embedding, llm, and chunk size to answer all question for all combination for Redis
-def all_combinations_question_answers(log_file="processed_data.txt"):
-    with open(log_file, "w", encoding="utf-8") as log:
-        for embedding_model in embedding_models:
-            for llm_model in llm_models:
-                for chunk_size in chunk_sizes:
-                    for question in questions:
-                        start_time = time.time()
-                        
-                        try:
-                            answer = answer_question(
-                                question=question,
-                                embedding_model=embedding_model,
-                                chunk_size=chunk_size,
-                                llm_model=llm_model
-                            )
-                            
-                            #was planning to use this but scrapped after
-                            end_time = time.time()
-                            
-                            total_time = end_time - start_time
-                            #writes the result in file                            
-                            log.write(f"\nLLM\n{llm_model}\n")
-                            log.write(f"Embedding\n{embedding_model}\n")
-                            log.write(f"Chunk Sizes\n{chunk_size}\n\n")
-                            log.write(f"Question\n{question}\n\n")
-                            log.write(f"Answer\n{answer}\n")
-                            
-                            print(f"✓ Answered question with {embedding_model} + {llm_model} + {chunk_size} in {total_time:.4f} seconds")
-                        except Exception as e:
-                            end_time = time.time()
-                            total_time = end_time - start_time
-                            
-                            print(f"Error processing: {e}")
-                            log.write(f"\nLLM\n{llm_model}\n")
-                            log.write(f"Embedding\n{embedding_model}\n")
-                            log.write(f"Chunk Sizes\n{chunk_size}\n\n")
-                            log.write(f"Question\n{question}\n\n")
-                            log.write(f"Answer\nError: {str(e)}\n")
-
+    # stored as soon as the cell finishes, so an interrupted run only loses the requests in flight
+    def record_result(item, result):
+        results.add("redis", item, result, manifest, packed=pack, stream=stream)
+        if partial_log:
+            partial_log.discard(item)
+    
+    def write_result(item, result):
+        if result.error is None:
+            print(f"✓ Answered question with {item.embedding_model} + {item.llm_model} + {item.chunk_size} in {result.seconds:.4f} seconds")
+        else:
+            print(f"Error processing: {result.error}")
+    
+    # with stream set, tokens go to a partial file per answer (and to the terminal when running one at a time)
+    def run(item):
+        on_token = partial_log.writer(item, echo=concurrency == 1) if partial_log else None
+        try:
+            return answer_question(
+                question=item.question,
+                embedding_model=item.embedding_model,
+                chunk_size=item.chunk_size,
+                llm_model=item.llm_model,
+                docs=plan.get((item.embedding_model, item.chunk_size, item.question)),
+                stream=stream,
+                on_token=on_token,
+                pack=pack
+            )
+        finally:
+            if on_token:
+                on_token.close()
+    
+    # rendered even when the run is interrupted, so the file always has everything answered so far
+    try:
+        run_schedule(todo, run, write_result, concurrency, done_fn=record_result)
+    finally:
+        results.render(log_file, "redis", work, write_entry, manifest, packed=pack)
+        results.close()
 
 def main():
+    parser = argparse.ArgumentParser(description="RAG over ./Notes with Redis")
+    parser.add_argument("--rebuild", action="store_true", help="drop the indices and re-ingest every PDF")
+    parser.add_argument("--dedupe-threshold", type=float, default=DEDUPE_THRESHOLD, help="similarity above which a chunk is skipped as a near-duplicate")
+    parser.add_argument("--no-dedupe", action="store_true", help="embed every chunk, even near-duplicates")
+    parser.add_argument("--pipeline", action="store_true", help="ingest through the async extract/chunk/embed/store pipeline")
+    parser.add_argument("--stage-concurrency", nargs="+", metavar="STAGE=N", help="pipeline workers per stage, e.g. embed=8 store=4")
+    parser.add_argument("--compare-knn", action="store_true", help="compare pre-filtered and post-filtered KNN instead of answering")
+    parser.add_argument("--hnsw-m", type=int, default=HNSW_M, help="HNSW M of newly created indices")
+    parser.add_argument("--ef-construction", type=int, default=HNSW_EF_CONSTRUCTION, help="HNSW EF_CONSTRUCTION of newly created indices")
+    parser.add_argument("--ef-runtime", type=int, default=EF_RUNTIME, help="HNSW EF_RUNTIME of newly created indices and the KNN comparison")
+    parser.add_argument("--vector-type", choices=sorted(VECTOR_DTYPES), default=VECTOR_TYPE, help="vector type of newly created indices")
+    parser.add_argument("--concurrency", type=int, default=LLM_CONCURRENCY, help="concurrent requests per loaded LLM")
+    parser.add_argument("--stream", action="store_true", help="stream answers, keeping partial output on disk")
+    parser.add_argument("--packing", action="store_true", help="merge overlapping chunks and cut the context to a per-llm token budget instead of sending the chunks verbatim")
+    parser.add_argument("--fresh", action="store_true", help="answer every combination again instead of skipping the ones already in results.sqlite")
+    args = parser.parse_args()
+    dedupe_index.threshold = None if args.no_dedupe else args.dedupe_threshold
+
     try:
-        create_indices()
-        process_pdf_files("./Notes")
-        all_combinations_question_answers()
+        create_indices(
+            rebuild=args.rebuild,
+            vector_type=args.vector_type,
+            m=args.hnsw_m,
+            ef_construction=args.ef_construction,
+            ef_runtime=args.ef_runtime
+        )
+        process_pdf_files("./Notes", pipeline=args.pipeline, concurrency=parse_concurrency(args.stage_concurrency))
+        if args.compare_knn:
+            compare_knn_filtering(ef_runtime=args.ef_runtime)
+        else:
+            all_combinations_question_answers(concurrency=args.concurrency, stream=args.stream, pack=args.packing, resume=not args.fresh)
+        tracer.print_summary()
+        print_generation_summary(tracer)
+        print_packing_summary(tracer)
     except Exception as e:
         print(f"Main execution failed with error: {str(e)}")
 
@@ -0,0 +1,145 @@
+import os
+import sqlite3
+import threading
+import time
+from scheduler import WorkResult
+from tracing import tracer
+
+RESULTS_FILE = "results.sqlite"
+
+
+# a cell of the evaluation grid within one backend
+def result_key(item):
+    return (item.embedding_model, item.llm_model, item.chunk_size, item.question)
+
+
+# sql condition and parameters matching rows produced with the given settings (packed); settings left as
+# None match any row. Streaming only changes how the answer arrives, so it is recorded but never matched on
+def _settings(attrs):
+    if attrs.get("packed") is None:
+        return "", []
+    return " AND packed = ?", [int(attrs["packed"])]
+
+
+# {(embedding model, chunk size): manifest fingerprint} for the cells of rows, read from manifest once per
+# combination; the fingerprint covers the chunks and index settings an answer was retrieved from
+def _fingerprints(manifest, rows):
+    combinations = {(row[0], row[2]) for row in rows}
+    return {(model, chunk_size): manifest.fingerprint(model, chunk_size) for model, chunk_size in combinations}
+
+
+# append-only record of the evaluation grid: a row is added every time a (backend, embedding model, llm,
+# chunk size, question) cell finishes, failures included, so an interrupted run can pick up where it stopped.
+# Each row carries the manifest fingerprint of the index it was retrieved from (IngestManifest.fingerprint),
+# rows of another index (other chunks, e.g. re-ingested or deduped differently, or another dimension, vector
+# type or HNSW setup) are not reused. processed_data.txt is rendered from it, the newest successful answer of each cell winning
+class ResultStore:
+    def __init__(self, path=RESULTS_FILE):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS results (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                run TEXT NOT NULL,
+                backend TEXT NOT NULL,
+                embedding_model TEXT NOT NULL,
+                llm_model TEXT NOT NULL,
+                chunk_size INTEGER NOT NULL,
+                question TEXT NOT NULL,
+                answer TEXT,
+                error TEXT,
+                seconds REAL NOT NULL,
+                packed INTEGER,
+                stream INTEGER,
+                fingerprint TEXT,
+                finished_at REAL NOT NULL
+            )
+            """
+        )
+        # a store from before rows carried the fingerprint; its rows match no index and are answered again
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(results)")]
+        if "fingerprint" not in columns:
+            self._conn.execute("ALTER TABLE results ADD COLUMN fingerprint TEXT")
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS results_key ON results (backend, embedding_model, llm_model, chunk_size, question)"
+        )
+        self._conn.commit()
+
+    # the store beside a results file, e.g. processed_data.txt -> results.sqlite in the same folder
+    @classmethod
+    def next_to(cls, log_file):
+        return cls(os.path.join(os.path.dirname(os.path.abspath(log_file)), RESULTS_FILE))
+
+    # cells of the backend that already have a successful answer produced with the same settings from the
+    # index manifest describes now
+    def completed(self, backend, manifest, **attrs):
+        conditions, params = _settings(attrs)
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT DISTINCT embedding_model, llm_model, chunk_size, question, fingerprint FROM results "
+                "WHERE backend = ? AND error IS NULL" + conditions,
+                (backend, *params),
+            ).fetchall()
+        fingerprints = _fingerprints(manifest, rows)
+        return {tuple(row[:4]) for row in rows if row[4] == fingerprints[(row[0], row[2])]}
+
+    # the work items without a successful answer with these settings (packed) from the current index yet,
+    # renumbered so the scheduler sees a contiguous grid
+    def pending(self, backend, work, manifest, **attrs):
+        done = self.completed(backend, manifest, **attrs)
+        todo = [item for item in work if result_key(item) not in done]
+        return [item._replace(index=i) for i, item in enumerate(todo)]
+
+    def add(self, backend, item, result, manifest, **attrs):
+        fingerprint = manifest.fingerprint(item.embedding_model, item.chunk_size)
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO results (run, backend, embedding_model, llm_model, chunk_size, question, answer, error, "
+                "seconds, packed, stream, fingerprint, finished_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    tracer.run_id, backend, item.embedding_model, item.llm_model, item.chunk_size, item.question,
+                    result.answer, None if result.error is None else str(result.error), result.seconds,
+                    attrs.get("packed"), attrs.get("stream"), fingerprint, time.time(),
+                ),
+            )
+            self._conn.commit()
+
+    # {cell: WorkResult} with the newest successful row of each cell, or its newest failure, among the rows
+    # produced with the given settings from the current index
+    def latest(self, backend, manifest, **attrs):
+        conditions, params = _settings(attrs)
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT embedding_model, llm_model, chunk_size, question, answer, error, seconds, fingerprint "
+                "FROM results WHERE backend = ?" + conditions + " ORDER BY error IS NULL, id",
+                (backend, *params),
+            ).fetchall()
+        fingerprints = _fingerprints(manifest, rows)
+        return {
+            tuple(row[:4]): WorkResult(row[4], row[5], row[6]) for row in rows
+            if row[7] == fingerprints[(row[0], row[2])]
+        }
+
+    # rewrites the results file from the store in the order of the work list, write_entry(log, item, result)
+    # writes one cell in the backend's format; returns how many cells had a result
+    def render(self, log_file, backend, work, write_entry, manifest, **attrs):
+        latest = self.latest(backend, manifest, **attrs)
+        written = 0
+        with open(log_file, "w", encoding="utf-8") as log:
+            for item in work:
+                result = latest.get(result_key(item))
+                if result is not None:
+                    write_entry(log, item, result)
+                    written += 1
+        print(f"Wrote {written} of {len(work)} answers from {self.path} to {log_file}")
+        return written
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,29 @@
+from batch_embedding import embed_batch
+from tracing import tracer
+
+
+# retrieval doesn't depend on the llm, so it's done once for the whole grid: every question is embedded
+# once per embedding model as one matrix, and search_fn(embedding_model, chunk_size, question_matrix, k)
+# returns one result list per question. Returns {(embedding model, chunk size, question): results}
+def build_retrieval_plan(questions, embedding_models, chunk_sizes, search_fn, k=5):
+    plan = {}
+    for embedding_model in embedding_models:
+        try:
+            with tracer.span("embed", model=embedding_model, chunks=len(questions)):
+                question_matrix = embed_batch(questions, embedding_model)
+        except Exception as e:
+            print(f"Embedding questions with {embedding_model} failed: {e}")
+            continue
+
+        for chunk_size in chunk_sizes:
+            try:
+                with tracer.span("search", model=embedding_model, chunk_size=chunk_size, queries=len(questions)):
+                    results = search_fn(embedding_model, chunk_size, question_matrix, k)
+            except Exception as e:
+                print(f"Retrieval with {embedding_model} + {chunk_size} failed, it will be retried per question: {e}")
+                continue
+            for question, question_results in zip(questions, results):
+                plan[(embedding_model, chunk_size, question)] = question_results
+
+    print(f"Retrieved context for {len(plan)} (embedding model, chunk size, question) combinations")
+    return plan
@@ -0,0 +1,100 @@
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+LLM_CONCURRENCY = 2
+
+# one (embedding model, llm, chunk size, question) cell of the evaluation grid,
+# index is its position in the original embedding -> llm -> chunk size -> question order
+WorkItem = namedtuple("WorkItem", ["index", "embedding_model", "llm_model", "chunk_size", "question"])
+WorkResult = namedtuple("WorkResult", ["answer", "error", "seconds"])
+
+
+# builds the full grid in the original logical order
+def build_work_list(embedding_models, llm_models, chunk_sizes, questions):
+    work = []
+    for embedding_model in embedding_models:
+        for llm_model in llm_models:
+            for chunk_size in chunk_sizes:
+                for question in questions:
+                    work.append(WorkItem(len(work), embedding_model, llm_model, chunk_size, question))
+    return work
+
+
+# (questions, embedding models, chunk sizes) that appear in the work, in grid order, so retrieval can be
+# limited to what is left to answer
+def grid_of(work):
+    questions, embedding_models, chunk_sizes = {}, {}, {}
+    for item in work:
+        questions.setdefault(item.question, None)
+        embedding_models.setdefault(item.embedding_model, None)
+        chunk_sizes.setdefault(item.chunk_size, None)
+    return list(questions), list(embedding_models), list(chunk_sizes)
+
+
+# orders the work so each llm is loaded once: everything for one llm runs together,
+# then by embedding model and chunk size so retrieval state stays warm as well
+def schedule(work):
+    llm_order = {}
+    embedding_order = {}
+    for item in work:
+        llm_order.setdefault(item.llm_model, len(llm_order))
+        embedding_order.setdefault(item.embedding_model, len(embedding_order))
+    return sorted(work, key=lambda item: (llm_order[item.llm_model], embedding_order[item.embedding_model], item.index))
+
+
+# counts how often the llm changes between consecutive items
+def count_model_switches(work):
+    return sum(1 for previous, item in zip(work, work[1:]) if previous.llm_model != item.llm_model)
+
+
+# hands results to write_fn strictly in index order, holding back the ones that finish early
+class OrderedWriter:
+    def __init__(self, write_fn):
+        self.write_fn = write_fn
+        self.next_index = 0
+        self.pending = {}
+        self.lock = threading.Lock()
+
+    def add(self, item, result):
+        with self.lock:
+            self.pending[item.index] = (item, result)
+            while self.next_index in self.pending:
+                self.write_fn(*self.pending.pop(self.next_index))
+                self.next_index += 1
+
+
+# runs run_fn(item) for every item, one llm at a time with up to `concurrency` requests in flight,
+# and calls write_fn(item, result) in the original order of the work list. done_fn(item, result) is called
+# as soon as each item finishes, for whatever has to survive an interrupted run
+def run_schedule(work, run_fn, write_fn, concurrency=LLM_CONCURRENCY, done_fn=None):
+    ordered = schedule(work)
+    print(f"Scheduled {len(work)} requests with {count_model_switches(ordered)} model switches "
+          f"(was {count_model_switches(work)})")
+    writer = OrderedWriter(write_fn)
+
+    def run(item):
+        start_time = time.time()
+        try:
+            result = WorkResult(run_fn(item), None, time.time() - start_time)
+        except Exception as e:
+            result = WorkResult(None, e, time.time() - start_time)
+        if done_fn:
+            done_fn(item, result)
+        writer.add(item, result)
+        return result
+
+    groups = []
+    for item in ordered:
+        if not groups or groups[-1][0].llm_model != item.llm_model:
+            groups.append([])
+        groups[-1].append(item)
+
+    results = [None] * len(work)
+    for group in groups:
+        print(f"Running {len(group)} requests on {group[0].llm_model}")
+        with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+            for item, result in zip(group, pool.map(run, group)):
+                results[item.index] = result
+    return results
@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+from qdrant_client import QdrantClient
+from qdrant_client.models import VectorParams
+import qdrant
+
+DIM = 4
+
+
+# a fixed vector per (model, text), so a test can tell which model's vector a point holds
+def fake_embed_batch(texts, model, **kwargs):
+    return np.asarray([[len(text), len(model), i, 1.0] for i, text in enumerate(texts)], dtype=np.float32)
+
+
+@pytest.fixture
+def collection(monkeypatch):
+    client = QdrantClient(":memory:")
+    client.create_collection(
+        qdrant.COLLECTION_NAME,
+        vectors_config={qdrant.vector_name(model): VectorParams(size=DIM, distance=qdrant.DISTANCE_METRIC) for model in qdrant.embedding_models}
+    )
+    monkeypatch.setattr(qdrant, "client", client)
+    monkeypatch.setattr(qdrant, "embed_batch", fake_embed_batch)
+    return client
+
+
+def vectors_of(texts, models):
+    return {model: fake_embed_batch(texts, model).tolist() for model in models}
+
+
+# a model added after a run that deduped chunks away: the skipped chunks have no point for update_vectors,
+# they become new points with the vectors of every model
+def test_update_stores_chunks_without_a_point(collection):
+    old_models, new_model = qdrant.embedding_models[:2], qdrant.embedding_models[2]
+    chunk_ids = ["avl.pdf:100:0", "avl_copy.pdf:100:0"]
+    texts = ["kept chunk", "chunk dedupe skipped"]
+    doc_ids = [qdrant.point_id(chunk_id) for chunk_id in chunk_ids]
+    qdrant.store_embeddings(doc_ids[:1], texts[:1], "avl.pdf", chunk_ids[:1], 100, vectors_of(texts[:1], old_models))
+
+    ids = qdrant.store_embeddings(doc_ids, texts, "avl.pdf", chunk_ids, 100, vectors_of(texts, [new_model]), update=True)
+
+    assert ids == doc_ids
+    points = {str(point.id): point for point in collection.retrieve(qdrant.COLLECTION_NAME, ids=doc_ids, with_vectors=True, with_payload=True)}
+    assert set(points) == set(doc_ids)
+    for doc_id, text in zip(doc_ids, texts):
+        assert set(points[doc_id].vector) == {qdrant.vector_name(model) for model in qdrant.embedding_models}
+        assert points[doc_id].payload["text"] == text
+    added = points[doc_ids[1]].vector[qdrant.vector_name(old_models[0])]
+    expected = fake_embed_batch(texts[1:], old_models[0])[0]
+    assert added == pytest.approx((expected / np.linalg.norm(expected)).tolist())
@@ -0,0 +1,85 @@
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+import numpy as np
+
+TRACE_FILE = "trace.jsonl"
+STAGES = ["extract", "chunk", "dedupe", "embed", "store", "cache", "search", "prompt", "generate"]
+
+
+# records per-stage spans (extract, chunk, dedupe, embed, store, search, prompt, generate) as JSONL,
+# one line per span, tagged with a run id so several runs can share one trace file
+class Tracer:
+    def __init__(self, path=TRACE_FILE):
+        self.path = path
+        self.run_id = uuid.uuid4().hex[:12]
+        self.spans = []
+        self._lock = threading.Lock()
+        self._file = None
+
+    # moves the trace next to the given results file, e.g. processed_data.txt -> trace.jsonl beside it
+    def place_next_to(self, log_file):
+        path = os.path.join(os.path.dirname(os.path.abspath(log_file)), TRACE_FILE)
+        with self._lock:
+            if path != self.path and self._file is not None:
+                self._file.close()
+                self._file = None
+            self.path = path
+
+    def record(self, stage, seconds, **attrs):
+        span = {"run": self.run_id, "stage": stage, "seconds": round(seconds, 6), "ts": round(time.time(), 3), **attrs}
+        with self._lock:
+            self.spans.append(span)
+            if self._file is None:
+                self._file = open(self.path, "a", encoding="utf-8")
+            self._file.write(json.dumps(span) + "\n")
+            self._file.flush()
+        return span
+
+    # times the block and writes one span; the yielded dict can be filled with extra attributes
+    @contextmanager
+    def span(self, stage, **attrs):
+        start_time = time.perf_counter()
+        try:
+            yield attrs
+        finally:
+            self.record(stage, time.perf_counter() - start_time, **attrs)
+
+    # per-stage count, total, mean and p95 plus token totals for this run
+    def summary(self):
+        rows = []
+        with self._lock:
+            spans = list(self.spans)
+        stages = STAGES + sorted({span["stage"] for span in spans} - set(STAGES))
+        for stage in stages:
+            seconds = [span["seconds"] for span in spans if span["stage"] == stage]
+            if not seconds:
+                continue
+            rows.append({
+                "stage": stage,
+                "count": len(seconds),
+                "total_s": float(np.sum(seconds)),
+                "mean_ms": float(np.mean(seconds)) * 1000,
+                "p95_ms": float(np.percentile(seconds, 95)) * 1000,
+                "prompt_tokens": sum(span.get("prompt_tokens") or 0 for span in spans if span["stage"] == stage),
+                "completion_tokens": sum(span.get("completion_tokens") or 0 for span in spans if span["stage"] == stage),
+            })
+        return rows
+
+    def print_summary(self):
+        rows = self.summary()
+        if not rows:
+            return
+        print(f"\n{'stage':<10} {'count':>7} {'total s':>10} {'mean ms':>10} {'p95 ms':>10} {'prompt tok':>11} {'output tok':>11}")
+        for row in rows:
+            print(
+                f"{row['stage']:<10} {row['count']:>7} {row['total_s']:>10.2f} {row['mean_ms']:>10.2f} "
+                f"{row['p95_ms']:>10.2f} {row['prompt_tokens']:>11} {row['completion_tokens']:>11}"
+            )
+        print(f"Trace written to {self.path}")
+
+
+tracer = Tracer()